@@ -0,0 +1,275 @@
+"""Historical backfill from a folder of old Daylio backups.
+
+Every backup_*.daylio file is decoded and cleaned in a process pool, with the same
+DaylioPickup and DaylioTable code the daily ingest uses, and reduced to the delta row
+hashes of its tables. The hashes are merged oldest first into one row history,
+recording when every row first appeared, when it last changed and when it was
+deleted. A backup identical to the one before it is skipped. The database is then
+loaded a single time from the newest backup, with the history, the delta baseline and
+the rollups written alongside, so the next daily ingest carries on as a delta.
+
+The backfill takes the ingest lock like any other job, and its stage timings show up
+on the performance page under the 'backfill' job.
+
+    python backfill.py path/to/old/backups              # one worker per core
+    python backfill.py path/to/old/backups --workers 4
+    python backfill.py path/to/old/backups --user alice # into alice's database shard
+    python backfill.py --benchmark 120                  # synthetic backups, 1 worker up to one per core
+"""
+import argparse
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from daylio_prep import DaylioPickup, DaylioTable, get_table_info, create_entry_tags, create_mood_groups, file_sha256
+from daylio_prep.daylio_pickup import BACKUP_GLOB, backup_day, backup_sort_key
+from sql_cmds import (create_tables, create_db_conn, insert_prefs, pref_watermark, record_baseline, BulkLoader,
+                      refresh_rollups, enqueue_job, claim_job, finish_job, store_spans, create_views, ensure_shard,
+                      route_to)
+from sql_cmds.delta_ingest import PRIMARY_KEYS, hash_table_rows
+from sql_cmds.ingest_jobs import record_backup
+from sql_cmds.row_history import RowHistory
+from log_setup import logger, span, record_spans
+import pandas as pd
+
+
+@dataclass
+class BackupSummary:
+    """What a worker sends back for one backup, the row hashes only unless the backup is the one to load"""
+    path: Path
+    day: str
+    content_hash: str
+    watermark: int | None
+    hashes: dict[str, dict[str, str]]
+    prefs: list[dict] = field(default_factory=list)
+    tables: list[DaylioTable] | None = None
+    seconds: float = 0.0
+
+
+def clean_tables(decoded: dict, table_names: list[str]) -> list[DaylioTable]:
+    """cleans every decoded table except prefs, entry_tags is derived right after dayEntries"""
+    tables = []
+    for table_name in table_names:
+        if table_name == 'prefs':
+            continue
+        table = DaylioTable(table_name, pd.DataFrame(decoded[table_name]), get_table_info(table_name))
+        tables.append(table)
+        if table_name == 'dayEntries':
+            tables.append(create_entry_tags(table, get_table_info('entry_tags')))
+    return tables
+
+
+def _quiet_worker():
+    # every worker would otherwise log each transform of every backup into the shared log database
+    logger.disabled = True
+
+
+def summarize_backup(path: Path, keep_tables: bool = False) -> BackupSummary:
+    """
+    decodes and cleans one backup, runs in the pool's worker processes
+    :param keep_tables: send the cleaned tables back too, for the backup that gets loaded
+    """
+    started = time.perf_counter()
+    pickup = DaylioPickup(pickup_dir=path.parent, backup_path=path)
+    decoded = pickup.decode_backup_streaming()
+    tables = clean_tables(decoded, pickup.selected_tables)
+    hashes = {table.name: hash_table_rows(table)[2] for table in tables if table.name in PRIMARY_KEYS}
+    return BackupSummary(path, backup_day(path), file_sha256(path), pref_watermark(decoded['prefs']), hashes,
+                         decoded['prefs'], tables if keep_tables else None, time.perf_counter() - started)
+
+
+def summarize_backups(paths: list[Path], workers: int | None = None) -> list[BackupSummary]:
+    """
+    :param workers: worker processes, one per core when None. 1 runs everything in this process
+    :return: summaries of the backups, oldest first, without repeats. Only the newest keeps its cleaned tables
+    """
+    paths = sorted(paths, key=backup_sort_key)
+    keep = [path == paths[-1] for path in paths]
+    if workers == 1:
+        summaries = [summarize_backup(path, keep_tables) for path, keep_tables in zip(paths, keep)]
+    else:
+        with ProcessPoolExecutor(workers, initializer=_quiet_worker) as pool:
+            summaries = list(pool.map(summarize_backup, paths, keep))
+    # only repeats of the previous backup are dropped, content that comes back after a change is a change again
+    distinct = []
+    for summary in summaries:
+        if distinct and summary.content_hash == distinct[-1].content_hash:
+            logger.info(f"Skipping {summary.path.name}, it has the same content as {distinct[-1].path.name}")
+            distinct[-1].tables = distinct[-1].tables or summary.tables
+            continue
+        distinct.append(summary)
+    return distinct
+
+
+def load_history(summaries: list[BackupSummary], db_conn) -> dict[str, int]:
+    """
+    merges the backups' row hashes into the row history and loads the newest backup into the database
+    :return: rows loaded per table
+    """
+    newest = summaries[-1]
+    with span("merge_history") as merge_span:
+        history = RowHistory()
+        for summary in summaries:
+            history.observe(summary.day, summary.hashes)
+        merge_span.rows = len(history.rows)
+
+    tables = newest.tables + [create_mood_groups(get_table_info('mood_groups'))]
+    with span("create_tables"):
+        create_tables(db_conn, reset=False)
+    with span("bulk_load") as load_span:
+        counts = BulkLoader(db_conn).load(tables)
+        load_span.rows = sum(counts.values())
+    with span("store_history") as history_span:
+        history_span.rows = history.store(db_conn)
+    record_baseline(db_conn, tables, newest.watermark)
+    with span("refresh_rollups") as rollup_span:
+        rollup_span.rows = refresh_rollups(db_conn, full=True)
+    with span("insert_prefs"):
+        insert_prefs(newest.prefs, db_conn)
+    return counts
+
+
+def backfill(folder: Path, workers: int | None = None, db_conn=None) -> dict[str, int]:
+    """
+    backfills the database from every backup in a folder, holding the ingest lock while it runs
+    :return: rows loaded per table
+    """
+    db_conn = db_conn or create_db_conn()
+    paths = sorted(Path(folder).glob(BACKUP_GLOB))
+    if not paths:
+        raise FileNotFoundError(f"no {BACKUP_GLOB} files in {folder}")
+    queued_id = enqueue_job(db_conn, 'backfill')
+    claimed = claim_job(db_conn, ['backfill'])
+    if claimed is None:
+        # a backfill only runs with its folder, left queued the request would be claimed later without one
+        finish_job(db_conn, queued_id, "another ingest job held the ingest lock")
+        raise RuntimeError("another ingest job holds the ingest lock, try again once it finished")
+    job_id = claimed[0]
+
+    started = time.perf_counter()
+    error, counts = None, {}
+    with record_spans(trace_memory=False) as recording:
+        try:
+            with span("backfill", rows=len(paths)):
+                with span("summarize_backups", rows=len(paths)):
+                    summaries = summarize_backups(paths, workers)
+                counts = load_history(summaries, db_conn)
+                with span("create_views"):
+                    create_views(db_conn)
+            # remembered like picked up backups, so pickup_daemon.py does not queue them again
+            for summary in summaries:
+                record_backup(db_conn, summary.content_hash, summary.path, job_id)
+        except Exception as e:
+            logger.exception("Backfill failed")
+            error = f"{type(e).__name__}: {e}"
+    store_spans(db_conn, job_id, 'backfill', recording.spans)
+    finish_job(db_conn, job_id, error)
+    if error:
+        raise RuntimeError(error)
+    elapsed = time.perf_counter() - started
+    logger.info(f"Backfilled {len(summaries)} distinct of {len(paths)} backups in {elapsed:.1f}s, "
+                f"{sum(counts.values())} rows loaded")
+    return counts
+
+
+def write_synthetic_backups(folder: Path, count: int, entries_per_backup: int = 30, seed: int = 0) -> list[Path]:
+    """
+    writes `count` daily backups of a growing journal, every backup adds entries, edits a few old ones
+    and deletes one now and then
+    """
+    import base64
+    import json
+    import zipfile
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    first_day = date(2020, 1, 1)
+    base = int(datetime(2020, 1, 1).timestamp() * 1000)
+    entries: dict[int, dict] = {}
+    # ids are never reused, a new entry after a delete must not overwrite a live one
+    next_id = itertools.count(1)
+    static = {
+        'customMoods': [{'id': i, 'custom_name': '', 'mood_group_id': i, 'mood_group_order': 0, 'createdAt': base}
+                        for i in range(1, 6)],
+        'tags': [{'id': i, 'name': f'tag{i}', 'createdAt': base, 'id_tag_group': 1 + i % 3} for i in range(1, 40)],
+        'tag_groups': [{'id': i, 'name': f'group{i}'} for i in range(1, 4)],
+        'goals': [{'id': 1, 'goal_id': 1, 'created_at': base, 'id_tag': 1, 'end_date': -1, 'name': 'walk', 'note': ''}],
+    }
+    paths = []
+    for k in range(count):
+        for _ in range(entries_per_backup):
+            entry_id = next(next_id)
+            entries[entry_id] = {
+                'id': entry_id, 'datetime': base + entry_id * 3_600_000, 'mood': int(rng.integers(1, 6)),
+                'note': 'a note ' * int(rng.integers(0, 20)), 'note_title': '',
+                'tags': rng.integers(1, 40, int(rng.integers(0, 5))).tolist(), 'assets': []}
+        for entry_id in rng.choice(list(entries), min(3, len(entries)), replace=False):
+            entries[int(entry_id)]['mood'] = int(rng.integers(1, 6))
+        if k % 10 == 9:
+            del entries[int(rng.choice(list(entries)))]
+        last = max(entry['datetime'] for entry in entries.values())
+        data = {
+            **static,
+            'dayEntries': list(entries.values()),
+            'goalEntries': [{'id': i, 'goalId': 1, 'createdAt': base + i * 86_400_000} for i in range(1, k + 2)],
+            'prefs': [{'key': 'AUTO_BACKUP_IS_ON', 'value': True}, {'key': 'LAST_DAYS_IN_ROWS_NUMBER', 'value': k},
+                      {'key': 'DAYS_IN_ROW_LONGEST_CHAIN', 'value': k}, {'key': 'LAST_ENTRY_CREATION_TIME', 'value': last}],
+        }
+        path = Path(folder) / (first_day + timedelta(days=k)).strftime('backup_%Y_%m_%d.daylio')
+        with zipfile.ZipFile(path, 'w') as backup:
+            backup.writestr('backup.daylio', base64.b64encode(json.dumps(data).encode('utf-8')))
+        paths.append(path)
+    return paths
+
+
+def benchmark(count: int = 120, worker_counts: list[int] | None = None):
+    """
+    backfills `count` synthetic backups into a fresh database with increasing numbers of worker processes
+    must run from the project directory, the cleaner reads data/table_info.json
+    """
+    import sqlite3
+    import tempfile
+    cores = os.cpu_count() or 1
+    worker_counts = worker_counts or sorted({1, 2, 4, cores} - {n for n in (2, 4) if n > cores})
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = Path(tmp) / "backups"
+        folder.mkdir()
+        paths = write_synthetic_backups(folder, count)
+        size_mb = sum(path.stat().st_size for path in paths) / 1e6
+        print(f"{count} synthetic backups, {size_mb:.1f} MB, {cores} cores")
+        print(f"{'workers':>8}{'summarize s':>13}{'load s':>9}{'backups/s':>11}{'speedup':>9}")
+        baseline = None
+        for workers in worker_counts:
+            db_conn = sqlite3.connect(Path(tmp) / f"backfill_{workers}.db")
+            started = time.perf_counter()
+            summaries = summarize_backups(paths, workers)
+            summarized = time.perf_counter() - started
+            load_history(summaries, db_conn)
+            loaded = time.perf_counter() - started - summarized
+            db_conn.close()
+            baseline = baseline or summarized
+            print(f"{workers:>8}{summarized:>13.2f}{loaded:>9.2f}{count / summarized:>11.1f}"
+                  f"{baseline / summarized:>8.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill the database from a folder of old Daylio backups")
+    parser.add_argument("folder", nargs="?", type=Path, help="folder with the backup_*.daylio files")
+    parser.add_argument("--workers", type=int, help="worker processes, defaults to one per core")
+    parser.add_argument("--user", help="backfill this user's database shard, the single database when left out")
+    parser.add_argument("--benchmark", type=int, metavar="BACKUPS",
+                        help="time the backfill of this many synthetic backups instead")
+    args = parser.parse_args()
+    if args.benchmark:
+        logger.disabled = True
+        benchmark(args.benchmark, [args.workers] if args.workers else None)
+    elif args.folder:
+        with route_to(args.user):
+            if args.user:
+                ensure_shard(args.user)
+            backfill(args.folder, args.workers)
+    else:
+        parser.error("a backup folder or --benchmark is required")
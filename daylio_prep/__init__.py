@@ -1,2 +1,5 @@
-from .daylio_pickup import DaylioPickup
-from .daylio_cleaner import ColumnInfo, DaylioTable, create_entry_tags, create_mood_groups, get_table_info
+from .daylio_pickup import DaylioPickup, configured_pickup_dir, find_newest_backup, file_sha256
+from .daylio_cleaner import DaylioTable, create_entry_tags, create_mood_groups
+from .schema import ColumnInfo, get_table_info
+from .snapshot_archive import SnapshotArchive
+from .working_store import WorkingStore
@@ -0,0 +1,281 @@
+import base64
+import codecs
+import json
+import re
+import sys
+import time
+import zipfile as zf
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Iterator
+
+BACKUP_MEMBER = "backup.daylio"
+DEFAULT_CHUNK_SIZE = 1 << 20  # 1 MiB of base64 text per read
+
+_NON_WS = re.compile(r'\S')
+_STRUCTURAL = re.compile(r'["\[\]{}]')
+_STRING_SPECIAL = re.compile(r'["\\]')
+_SCALAR_END = re.compile(r'[,\]}\s]')
+
+
+@dataclass
+class DecodeStats:
+    """Size, timing and memory figures for a single streaming decode."""
+    encoded_bytes: int = 0
+    decoded_bytes: int = 0
+    seconds: float = 0.0
+    peak_rss_bytes: int | None = None
+
+    @property
+    def throughput_mb_s(self) -> float:
+        if self.seconds <= 0:
+            return 0.0
+        return self.decoded_bytes / self.seconds / 1_000_000
+
+    def summary(self) -> str:
+        rss = "n/a" if self.peak_rss_bytes is None else f"{self.peak_rss_bytes / 1_000_000:.1f} MB"
+        return (f"{self.encoded_bytes / 1_000_000:.1f} MB base64 -> {self.decoded_bytes / 1_000_000:.1f} MB json "
+                f"in {self.seconds:.2f}s ({self.throughput_mb_s:.1f} MB/s), peak RSS {rss}")
+
+
+def peak_rss_bytes() -> int | None:
+    """Returns the peak resident set size of this process, or None if it can't be determined."""
+    try:
+        import resource
+    except ImportError:
+        return _windows_peak_rss()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes everywhere else
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _windows_peak_rss() -> int | None:
+    try:
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return None
+        return counters.PeakWorkingSetSize
+    except (AttributeError, OSError):
+        return None
+
+
+def iter_decoded_text(stream, stats: DecodeStats | None = None,
+                      chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[str]:
+    """Base64-decodes a binary stream chunk by chunk and yields utf-8 text.
+
+    :param stream: binary file-like object holding base64 text
+    :param stats: optional DecodeStats updated with byte counts as the stream is read
+    :param chunk_size: number of base64 bytes read per chunk
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    pending = b""
+    while raw := stream.read(chunk_size):
+        if stats is not None:
+            stats.encoded_bytes += len(raw)
+        pending += b"".join(raw.split())
+        usable = len(pending) - len(pending) % 4
+        if usable:
+            decoded = base64.b64decode(pending[:usable])
+            pending = pending[usable:]
+            if stats is not None:
+                stats.decoded_bytes += len(decoded)
+            yield decoder.decode(decoded)
+    decoded = base64.b64decode(pending) if pending else b""
+    if stats is not None:
+        stats.decoded_bytes += len(decoded)
+    yield decoder.decode(decoded, final=True)
+
+
+class _ValueScanner:
+    """Finds where a single JSON value ends without building it, resumable across chunks."""
+
+    def __init__(self):
+        self.started = False
+        self.scalar = False
+        self.in_string = False
+        self.escape = False
+        self.depth = 0
+
+    def scan(self, buf: str, pos: int) -> int | None:
+        """Returns the index just past the value, or None if the buffer ran out first."""
+        if not self.started:
+            self.started = True
+            char = buf[pos]
+            if char == '"':
+                self.in_string = True
+                pos += 1
+            elif char in "[{":
+                self.depth = 1
+                pos += 1
+            else:
+                self.scalar = True
+
+        if self.scalar:
+            match = _SCALAR_END.search(buf, pos)
+            return match.start() if match else None
+
+        while True:
+            if self.escape:
+                if pos >= len(buf):
+                    return None
+                pos += 1
+                self.escape = False
+            if self.in_string:
+                match = _STRING_SPECIAL.search(buf, pos)
+                if match is None:
+                    return None
+                pos = match.end()
+                if match.group() == "\\":
+                    self.escape = True
+                    continue
+                self.in_string = False
+                if self.depth == 0:
+                    return pos
+                continue
+            match = _STRUCTURAL.search(buf, pos)
+            if match is None:
+                return None
+            pos = match.end()
+            char = match.group()
+            if char == '"':
+                self.in_string = True
+            elif char in "[{":
+                self.depth += 1
+            else:
+                self.depth -= 1
+                if self.depth == 0:
+                    return pos
+
+
+class _ChunkReader:
+    """Pull-based cursor over a stream of text chunks that only buffers what is still needed."""
+
+    def __init__(self, chunks: Iterable[str]):
+        self._chunks = iter(chunks)
+        self.buf = ""
+        self.pos = 0
+        self._mark: int | None = None
+
+    def _fill(self) -> bool:
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            return False
+        keep_from = self.pos if self._mark is None else self._mark
+        self.buf = self.buf[keep_from:] + chunk
+        self.pos -= keep_from
+        if self._mark is not None:
+            self._mark = 0
+        return True
+
+    def peek(self) -> str:
+        """Skips whitespace and returns the next significant character without consuming it."""
+        while True:
+            match = _NON_WS.search(self.buf, self.pos)
+            if match:
+                self.pos = match.start()
+                return match.group()
+            self.pos = len(self.buf)
+            if not self._fill():
+                raise ValueError("Unexpected end of backup data")
+
+    def take(self, *expected: str) -> str:
+        char = self.peek()
+        if char not in expected:
+            raise ValueError(f"Malformed backup data: expected {' or '.join(expected)!r}, found {char!r}")
+        self.pos += 1
+        return char
+
+    def read_value(self, keep: bool = True):
+        """Reads the next JSON value; it is only parsed (and buffered) when keep is True."""
+        self.peek()
+        scanner = _ValueScanner()
+        if keep:
+            self._mark = self.pos
+        while (end := scanner.scan(self.buf, self.pos)) is None:
+            self.pos = len(self.buf)
+            if not self._fill():
+                raise ValueError("Unexpected end of backup data")
+        self.pos = end
+        if not keep:
+            return None
+        text = self.buf[self._mark:end]
+        self._mark = None
+        return json.loads(text)
+
+
+def iter_selected_tables(chunks: Iterable[str], tables: Iterable[str]) -> Iterator[tuple[str, object]]:
+    """Walks the top-level backup object and yields (name, value) for the selected tables only.
+
+    Unselected tables are skipped without being parsed, and selected arrays are built
+    one row at a time so the decoded text is never held in memory all at once.
+    """
+    wanted = set(tables)
+    reader = _ChunkReader(chunks)
+    reader.take("{")
+    if reader.peek() == "}":
+        return
+    while True:
+        key = reader.read_value()
+        reader.take(":")
+        if key not in wanted:
+            reader.read_value(keep=False)
+        elif reader.peek() == "[":
+            reader.take("[")
+            rows = []
+            if reader.peek() == "]":
+                reader.take("]")
+            else:
+                while True:
+                    rows.append(reader.read_value())
+                    if reader.take(",", "]") == "]":
+                        break
+            yield key, rows
+        else:
+            yield key, reader.read_value()
+        if reader.take(",", "}") == "}":
+            return
+
+
+def decode_backup_tables(backup_path: Path, tables: Iterable[str],
+                         chunk_size: int = DEFAULT_CHUNK_SIZE) -> tuple[dict, DecodeStats]:
+    """Decodes only the selected tables straight out of a .daylio backup archive.
+
+    :param backup_path: path to the zipped .daylio backup file
+    :param tables: names of the tables to keep
+    :param chunk_size: number of base64 bytes read per chunk
+    :return: the selected tables and the decode statistics
+    """
+    tables = [table for table in tables if table]
+    stats = DecodeStats()
+    start = time.perf_counter()
+    with zf.ZipFile(backup_path, "r") as archive, archive.open(BACKUP_MEMBER) as member:
+        data = dict(iter_selected_tables(iter_decoded_text(member, stats, chunk_size), tables))
+    stats.seconds = time.perf_counter() - start
+    stats.peak_rss_bytes = peak_rss_bytes()
+
+    missing = [table for table in tables if table not in data]
+    if missing:
+        raise KeyError(f"Tables missing from backup: {', '.join(missing)}")
+    return {table: data[table] for table in tables}, stats
+
+
+if __name__ == "__main__":
+    # usage: python -m daylio_prep.backup_stream path/to/backup_YYYY_MM_DD.daylio
+    tables_path = Path(__file__).parent.parent / "data" / "tables_needed.txt"
+    selected = [table.strip() for table in tables_path.read_text().split('\n')]
+    decoded, decode_stats = decode_backup_tables(Path(sys.argv[1]), selected)
+    for name, rows in decoded.items():
+        print(f"{name}: {len(rows)} rows")
+    print(decode_stats.summary())
@@ -1,19 +1,74 @@
 from pathlib import Path
-from datetime import datetime
+import hashlib
 import os
-import base64
+import re
+from datetime import date
+from functools import cache
 import json
-import zipfile as zf
-import shutil
 from log_setup import logger
-from dotenv import load_dotenv
-load_dotenv()
+from .backup_stream import decode_backup_tables, DEFAULT_CHUNK_SIZE
+from .snapshot_archive import SnapshotArchive, StoredSnapshot
+from .working_store import WorkingStore
 
 
 
 
+BACKUP_GLOB = "backup_*.daylio"
+_BACKUP_DATE = re.compile(r"backup_(\d{4})_(\d{2})_(\d{2})")
+
+
+@cache
+def _load_env():
+    """reads .env into the environment once per process, on first use rather than at import"""
+    from dotenv import load_dotenv
+    load_dotenv()
+
+
+def configured_project_dir() -> Path:
+    """the project directory, DAYLIO_PROJECT_DIR from the environment or .env, else the one this package is in"""
+    _load_env()
+    return Path(os.getenv('DAYLIO_PROJECT_DIR') or Path(__file__).resolve().parent.parent)
+
+
+def configured_pickup_dir() -> Path:
+    """the folder Daylio backups are dropped in, DAYLIO_PICKUP_DIR from the environment or .env"""
+    _load_env()
+    return Path(os.getenv('DAYLIO_PICKUP_DIR', 'C:/Users/YourUsername/Downloads'))
+
+
+def backup_sort_key(path: Path) -> tuple:
+    """orders backups by the date in their name, then by modification time, for copies like 'backup_... (1).daylio'"""
+    match = _BACKUP_DATE.search(path.name)
+    named = match.group(1, 2, 3) if match else ()
+    return named, path.stat().st_mtime
+
+
+def backup_day(path: Path) -> str:
+    """ISO date of a backup, from its name, else from its modification time"""
+    match = _BACKUP_DATE.search(path.name)
+    if match:
+        return "-".join(match.group(1, 2, 3))
+    return date.fromtimestamp(path.stat().st_mtime).isoformat()
+
+
+def find_newest_backup(folder: Path) -> Path | None:
+    """
+    :return: the newest backup_*.daylio file in the folder, None if there is none
+    """
+    backups = [path for path in Path(folder).glob(BACKUP_GLOB) if path.is_file()]
+    return max(backups, key=backup_sort_key, default=None)
+
+
+def file_sha256(path: Path, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
 class DaylioPickup:
-    """class designed for picking up backup data, decoding it, and saving it as json
+    """class designed for picking up backup data, decoding it, and saving it to the working store
 
     Raises:
         FileNotFoundError: 
@@ -23,61 +78,65 @@ class DaylioPickup:
         : 
     """
     
-    expected_cwd: str = os.getenv('EXPECTED_WD', 'daylio-mood-dash')
-    
-    def __init__(self, pickup_dir: Path = Path(os.getenv('DAYLIO_PICKUP_DIR', 'C:/Users/YourUsername/Downloads'))):
-        logger.info(f"Checking CWD is set to {self.expected_cwd}")
+    def __init__(self, pickup_dir: Path | None = None, backup_path: Path | None = None, work_dir: Path | None = None):
+        """
+        :param pickup_dir: folder the backups are dropped in, defaults to DAYLIO_PICKUP_DIR from the environment or .env
+        :param backup_path: backup to ingest, defaults to the newest one in the pickup folder
+        :param work_dir: folder for the working store, the snapshot archive and the json export, defaults to data/.
+            Each user's shard folder when ingesting per user
+        """
+        self.project_dir = configured_project_dir()
+        # daylio.json is no longer part of the pipeline, it is only written when asked for
+        self.export_json: bool = os.getenv('DAYLIO_EXPORT_JSON', '').lower() in ('1', 'true', 'yes')
+
         self.__set_cwd()
         
-        self.pickup_dir = pickup_dir
-        self.pickup_path = self.__find_backup_file()
+        self.pickup_dir = pickup_dir or configured_pickup_dir()
+        self.pickup_path = Path(backup_path) if backup_path else self.__find_backup_file()
         
         self.data_dir = Path.cwd() / "data"
-        self.json_path = self.data_dir / "daylio.json"
+        self.work_dir = Path(work_dir) if work_dir else self.data_dir
+        self.json_path = self.work_dir / "daylio.json"
+        self.working_store = WorkingStore(self.work_dir / "working")
         
         selected_tables_path = self.data_dir / "tables_needed.txt"
         self.selected_tables = [table.strip() for table in selected_tables_path.read_text().split('\n')]
     
     def __set_cwd(self):
-        if Path.cwd().name != self.expected_cwd:
-            logger.info(f"CWD not '{self.expected_cwd}' searching for correct directory...")
-            for folder in Path.home().rglob(self.expected_cwd):
-                if folder.is_dir() and folder.name == self.expected_cwd:
-                    logger.info(f"'{self.expected_cwd}' directory found, changing working directory")
-                    os.chdir(str(folder))
-                    break
-            else:
-                logger.error(f"'{self.expected_cwd}' does not exist on this system")
-                raise FileNotFoundError(f'{self.expected_cwd} does not exist')
+        if not self.project_dir.is_dir():
+            logger.error(f"Project directory {self.project_dir} does not exist")
+            raise FileNotFoundError(f'{self.project_dir} does not exist')
+        if Path.cwd().resolve() != self.project_dir.resolve():
+            logger.info(f"Changing working directory to the project directory {self.project_dir}")
+            os.chdir(self.project_dir)
     
     def __find_backup_file(self):
-        pickup_path = Path(self.pickup_dir, datetime.today().strftime('backup_%Y_%m_%d.daylio'))
-        logger.info(f"Searching for todays backup file: {pickup_path.name}")
-        if pickup_path.exists():
-            logger.info('File found')
+        logger.info(f"Searching for the newest backup file in {self.pickup_dir}")
+        pickup_path = find_newest_backup(self.pickup_dir)
+        if pickup_path is not None:
+            logger.info(f'File found: {pickup_path.name}')
             return pickup_path
         else:
-            logger.error(f"{pickup_path.name} does not exist in designated pickup directory: {self.pickup_dir}")
-            raise FileNotFoundError(f"{pickup_path} does not exist")
+            logger.error(f"No {BACKUP_GLOB} file in designated pickup directory: {self.pickup_dir}")
+            raise FileNotFoundError(f"no {BACKUP_GLOB} file in {self.pickup_dir}")
     
-    def extract_backup(self):
-        logger.info("Extracting zipped data from backup file into data directory")
-        with zf.ZipFile(self.pickup_path, 'r') as zr:
-            zr.extractall(self.data_dir)
-            # remove assets folder from extraction, it is not needed
-            shutil.rmtree((self.data_dir / "assets"))
-            
-    
-    def decode_backup_to_json(self):
-        backup_path = self.data_dir / "backup.daylio"
-        logger.info('Decoding backup from base64 to utf-8')
-        with open(str(backup_path), 'r') as backup:
-            contents = base64.b64decode(backup.read()).decode("utf-8")
-            
-        data = json.loads(contents)
-        
+    def decode_backup_streaming(self, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        """Decodes only the selected tables straight from the backup zip, without extracting it.
+
+        The backup is base64-decoded in chunks and parsed incrementally, so unselected
+        tables and photo assets are never loaded into memory.
+        """
+        logger.info(f'Stream decoding selected tables from {self.pickup_path.name}')
+        data, self.decode_stats = decode_backup_tables(self.pickup_path, self.selected_tables, chunk_size)
+        logger.info(f'Backup decoded: {self.decode_stats.summary()}')
         return data
     
+    def save_to_store(self, daylio_data) -> WorkingStore:
+        """writes the selected tables to the Arrow working store the cleaner reads from"""
+        logger.info(f'Saving decoded data to the working store: {self.working_store.store_dir}')
+        self.working_store.write({table: daylio_data[table] for table in self.selected_tables})
+        return self.working_store
+
     def save_to_json(self, daylio_data):
         selected_tables_data = {table: daylio_data[table] for table in self.selected_tables}
         if self.json_path.exists():
@@ -86,9 +145,13 @@ class DaylioPickup:
         with open(str(self.json_path), "w", encoding='utf-8') as j:
             json.dump(selected_tables_data, j, indent=4)
     
-    def archive_json(self):
-        
-        date_str = datetime.today().strftime('%Y%m%d_%H%M')
-        archive_path = self.data_dir / "archive" / f"daylio_{date_str}.json"
-        logger.info(f"Creating archive copy of todays json file: {archive_path.name}")
-        shutil.copy(self.json_path, archive_path)
\ No newline at end of file
+    def archive_snapshot(self, daylio_data) -> StoredSnapshot:
+        """
+        adds the selected tables to the content-addressed archive in <work_dir>/archive, tables unchanged since an
+        earlier snapshot are not stored again, then applies the archive's retention policy
+        """
+        selected_tables_data = {table: daylio_data[table] for table in self.selected_tables}
+        with SnapshotArchive(self.work_dir / "archive") as archive:
+            stored = archive.store(selected_tables_data, source=self.pickup_path.name)
+            archive.apply_retention()
+        return stored
@@ -0,0 +1,73 @@
+import json
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from types import MappingProxyType
+import pandas as pd
+from log_setup import logger
+
+# compact pandas dtype for each table_info.json type_name, timestamps are left to the date transforms
+# text has no default, short text columns stay object and table_info.json gives the free-text ones string[pyarrow]
+TYPE_DTYPES = {
+    'Int64.Type': 'Int32',
+}
+
+# raw backup columns kept alongside the declared ones because later steps still need them
+PASSTHROUGH_COLUMNS = {
+    'dayEntries': ('tags',),
+}
+
+
+class SchemaCastError(Exception):
+    def __init__(self, message: str):
+        super().__init__(message)
+
+
+@dataclass(frozen=True, slots=True)
+class ColumnInfo:
+    """Class representing the columns in each table
+    """
+    name: str
+    type_name: str
+    kind: str
+    dtype: str | None = None
+
+    @property
+    def pandas_dtype(self) -> str | None:
+        """the dtype this column is stored as, an explicit dtype in table_info.json wins over the type_name default"""
+        return self.dtype or TYPE_DTYPES.get(self.type_name)
+
+
+@lru_cache(maxsize=None)
+def load_schema(table_info_path: Path) -> MappingProxyType:
+    """parses table_info.json once per path and returns a read-only mapping of table name to column tuples"""
+    logger.info(f"Loading table schema from {table_info_path}...")
+    json_data = json.loads(table_info_path.read_text())
+    return MappingProxyType({
+        table_name: tuple(ColumnInfo(**data) for data in columns)
+        for table_name, columns in json_data.items()
+    })
+
+
+def get_table_info(table_name: str) -> list[ColumnInfo]:
+    logger.info(f"Getting column information for table {table_name}...")
+    table_info_path = (Path.cwd() / 'data' / 'table_info.json').resolve()
+    return list(load_schema(table_info_path)[table_name])
+
+
+def apply_schema(table_name: str, df: pd.DataFrame, columns: list[ColumnInfo]) -> pd.DataFrame:
+    """
+    drops raw columns the table does not need and casts the rest to their compact dtypes
+    :raises SchemaCastError: if a column does not fit its dtype, the backup no longer matches table_info.json
+    """
+    keep = {x.name for x in columns}.union(PASSTHROUGH_COLUMNS.get(table_name, ()))
+    df = df.drop(columns=[col for col in df.columns if col not in keep])
+    for col in columns:
+        dtype = col.pandas_dtype
+        if dtype is None or col.name not in df or df[col.name].dtype == dtype:
+            continue
+        try:
+            df[col.name] = df[col.name].astype(dtype)
+        except (TypeError, ValueError, OverflowError) as e:
+            raise SchemaCastError(f"Could not cast {table_name}.{col.name} to {dtype}: {e}") from e
+    return df
@@ -0,0 +1,329 @@
+"""Content-addressed archive of the decoded backup tables.
+
+Every table of a snapshot is serialized as canonical JSON, compressed with zlib and
+stored once under the SHA-256 of its JSON, so a table that did not change since the
+previous run costs nothing but an index row. The index is a small SQLite database
+next to the objects, one row per run and one per table of that run, which is all it
+takes to rebuild any historical snapshot or to tell which tables two snapshots
+disagree on without decompressing anything.
+
+    data/archive/index.db                     runs and the object each of their tables points at
+    data/archive/objects/3f/3fa9...e1.zz      one compressed table
+
+Run ``python -m daylio_prep.snapshot_archive`` to list the runs, see its --help for
+diffing two dates, pruning and importing the old daylio_*.json copies.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import zlib
+from dataclasses import dataclass
+from datetime import date, datetime
+from pathlib import Path
+import pandas as pd
+from log_setup import logger
+
+COMPRESSION_LEVEL = 9
+# snapshots younger than KEEP_DAILY_DAYS are all kept, older ones thin out to the last of each week for
+# KEEP_WEEKLY_WEEKS and to the last of each month after that, KEEP_MONTHLY_MONTHS=None keeps those forever
+KEEP_DAILY_DAYS = 90
+KEEP_WEEKLY_WEEKS = 104
+KEEP_MONTHLY_MONTHS = None
+# column that identifies a row in the diff of two snapshots, 'id' for every table not listed
+ROW_KEYS = {
+    'prefs': 'key',
+}
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+INDEX_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS snapshots (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        taken_at DATETIME NOT NULL,
+        source TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_snapshots_taken_at ON snapshots (taken_at);
+    CREATE TABLE IF NOT EXISTS snapshot_tables (
+        snapshot_id INTEGER NOT NULL REFERENCES snapshots(id) ON DELETE CASCADE,
+        table_name TEXT NOT NULL,
+        object_hash TEXT NOT NULL,
+        row_count INTEGER,
+        PRIMARY KEY (snapshot_id, table_name)
+    );
+    CREATE INDEX IF NOT EXISTS idx_snapshot_tables_object_hash ON snapshot_tables (object_hash);
+    CREATE TABLE IF NOT EXISTS objects (
+        hash TEXT PRIMARY KEY,
+        raw_bytes INTEGER,
+        stored_bytes INTEGER
+    );
+'''
+
+
+@dataclass
+class StoredSnapshot:
+    """What archiving one snapshot took"""
+    snapshot_id: int
+    tables: int
+    new_objects: int
+    raw_bytes: int
+    stored_bytes: int  # compressed bytes written for the new objects, 0 when nothing changed
+
+    def summary(self) -> str:
+        return (f"snapshot {self.snapshot_id}: {self.tables} tables, {self.new_objects} new objects, "
+                f"{self.raw_bytes / 1e6:.2f} MB of JSON stored as {self.stored_bytes / 1e6:.3f} MB")
+
+
+def canonical_json(rows) -> bytes:
+    """the bytes a table is hashed and stored as, independent of key order and whitespace"""
+    return json.dumps(rows, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+class SnapshotArchive:
+    """Deduplicated, compressed history of the decoded backup tables."""
+
+    def __init__(self, archive_dir: Path):
+        self.archive_dir = Path(archive_dir)
+        self.objects_dir = self.archive_dir / "objects"
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.archive_dir / "index.db")
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.executescript(INDEX_SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _object_path(self, object_hash: str) -> Path:
+        return self.objects_dir / object_hash[:2] / f"{object_hash}.zz"
+
+    def _write_object(self, payload: bytes) -> tuple[str, int]:
+        """
+        :return: hash of the payload, and the compressed bytes written, 0 if the object was already stored
+        """
+        object_hash = hashlib.sha256(payload).hexdigest()
+        path = self._object_path(object_hash)
+        if path.exists():
+            self.conn.execute("INSERT OR IGNORE INTO objects (hash, raw_bytes, stored_bytes) VALUES (?, ?, ?)",
+                              (object_hash, len(payload), path.stat().st_size))
+            return object_hash, 0
+        compressed = zlib.compress(payload, COMPRESSION_LEVEL)
+        path.parent.mkdir(exist_ok=True)
+        # written under a temporary name first, a crash never leaves a truncated object behind its hash
+        partial = path.with_suffix('.partial')
+        partial.write_bytes(compressed)
+        os.replace(partial, path)
+        self.conn.execute("INSERT OR REPLACE INTO objects (hash, raw_bytes, stored_bytes) VALUES (?, ?, ?)",
+                          (object_hash, len(payload), len(compressed)))
+        return object_hash, len(compressed)
+
+    def _read_object(self, object_hash: str):
+        payload = zlib.decompress(self._object_path(object_hash).read_bytes())
+        if hashlib.sha256(payload).hexdigest() != object_hash:
+            raise ValueError(f"archive object {object_hash} is corrupt")
+        return json.loads(payload)
+
+    def store(self, tables: dict, taken_at: datetime | None = None, source: str | None = None) -> StoredSnapshot:
+        """
+        archives one snapshot, only tables whose content is not in the archive yet are written
+        :param tables: table name to its rows, as decoded from the backup
+        :param taken_at: time of the snapshot, now when None
+        :param source: where the snapshot came from, e.g. the backup file name
+        """
+        taken_at = (taken_at or datetime.now()).strftime(TIMESTAMP_FORMAT)
+        raw_bytes = stored_bytes = new_objects = 0
+        with self.conn:
+            snapshot_id = self.conn.execute("INSERT INTO snapshots (taken_at, source) VALUES (?, ?)",
+                                            (taken_at, source)).lastrowid
+            for table_name, rows in tables.items():
+                payload = canonical_json(rows)
+                object_hash, written = self._write_object(payload)
+                raw_bytes += len(payload)
+                stored_bytes += written
+                new_objects += written > 0
+                self.conn.execute(
+                    "INSERT INTO snapshot_tables (snapshot_id, table_name, object_hash, row_count) VALUES (?, ?, ?, ?)",
+                    (snapshot_id, table_name, object_hash, len(rows) if isinstance(rows, list) else None))
+        stored = StoredSnapshot(snapshot_id, len(tables), new_objects, raw_bytes, stored_bytes)
+        logger.info(f"Archived {stored.summary()}")
+        return stored
+
+    def snapshots(self) -> pd.DataFrame:
+        """
+        :return: one row per archived run with its table count, total rows and the compressed bytes it added
+        """
+        return pd.read_sql_query('''
+            SELECT s.id, s.taken_at, s.source, COUNT(st.table_name) AS tables, SUM(st.row_count) AS rows,
+                   SUM(CASE WHEN first.snapshot_id = s.id THEN o.stored_bytes ELSE 0 END) AS new_bytes
+            FROM snapshots s
+            LEFT JOIN snapshot_tables st ON st.snapshot_id = s.id
+            LEFT JOIN objects o ON o.hash = st.object_hash
+            LEFT JOIN (SELECT object_hash, MIN(snapshot_id) AS snapshot_id FROM snapshot_tables
+                       GROUP BY object_hash) first ON first.object_hash = st.object_hash
+            GROUP BY s.id
+            ORDER BY s.taken_at, s.id
+        ''', self.conn, parse_dates=['taken_at'])
+
+    def resolve(self, when: int | str | date | datetime) -> int:
+        """
+        :param when: a snapshot id, or a date/datetime (or its ISO string) to take the latest snapshot at or before.
+            A bare date covers the whole day
+        :return: the snapshot id
+        """
+        if isinstance(when, int):
+            found = self.conn.execute("SELECT id FROM snapshots WHERE id = ?", (when,)).fetchone()
+        else:
+            if isinstance(when, str):
+                when = datetime.fromisoformat(when) if ' ' in when or 'T' in when else date.fromisoformat(when)
+            if not isinstance(when, datetime):
+                when = datetime.combine(when, datetime.max.time())
+            found = self.conn.execute(
+                "SELECT id FROM snapshots WHERE taken_at <= ? ORDER BY taken_at DESC, id DESC LIMIT 1",
+                (when.strftime(TIMESTAMP_FORMAT),)).fetchone()
+        if found is None:
+            raise LookupError(f"no archived snapshot at or before {when}")
+        return found[0]
+
+    def _table_hashes(self, snapshot_id: int) -> dict[str, str]:
+        return dict(self.conn.execute(
+            "SELECT table_name, object_hash FROM snapshot_tables WHERE snapshot_id = ?", (snapshot_id,)))
+
+    def load(self, when: int | str | date | datetime, tables: list[str] | None = None) -> dict:
+        """
+        rebuilds a snapshot, decompressing only the requested tables
+        :return: table name to rows, the same shape that was stored
+        """
+        hashes = self._table_hashes(self.resolve(when))
+        return {name: self._read_object(object_hash) for name, object_hash in hashes.items()
+                if tables is None or name in tables}
+
+    def diff(self, old: int | str | date | datetime, new: int | str | date | datetime) -> pd.DataFrame:
+        """
+        compares two snapshots row by row. Tables with the same hash are skipped without being read
+        :return: one row per difference: table, key, change ('added', 'removed' or 'changed') and the changed fields
+        """
+        old_hashes, new_hashes = self._table_hashes(self.resolve(old)), self._table_hashes(self.resolve(new))
+        changes = []
+        for table_name in sorted(old_hashes.keys() | new_hashes.keys()):
+            if old_hashes.get(table_name) == new_hashes.get(table_name):
+                continue
+            key = ROW_KEYS.get(table_name, 'id')
+            old_rows = self._rows_by_key(old_hashes.get(table_name), key)
+            new_rows = self._rows_by_key(new_hashes.get(table_name), key)
+            for row_key in old_rows.keys() - new_rows.keys():
+                changes.append((table_name, row_key, 'removed', None))
+            for row_key in new_rows.keys() - old_rows.keys():
+                changes.append((table_name, row_key, 'added', None))
+            for row_key in old_rows.keys() & new_rows.keys():
+                old_row, new_row = old_rows[row_key], new_rows[row_key]
+                if old_row != new_row:
+                    fields = sorted(field for field in old_row.keys() | new_row.keys()
+                                    if old_row.get(field) != new_row.get(field))
+                    changes.append((table_name, row_key, 'changed', ', '.join(fields)))
+        return (pd.DataFrame(changes, columns=['table', 'key', 'change', 'fields'])
+                .sort_values(['table', 'change', 'key'], key=lambda column: column.astype(str), ignore_index=True))
+
+    def _rows_by_key(self, object_hash: str | None, key: str) -> dict:
+        if object_hash is None:
+            return {}
+        rows = self._read_object(object_hash)
+        if not isinstance(rows, list):
+            return {None: rows}
+        return {row.get(key, position) if isinstance(row, dict) else position: row
+                for position, row in enumerate(rows)}
+
+    def apply_retention(self, today: date | None = None, keep_daily_days: int = KEEP_DAILY_DAYS,
+                        keep_weekly_weeks: int = KEEP_WEEKLY_WEEKS,
+                        keep_monthly_months: int | None = KEEP_MONTHLY_MONTHS) -> tuple[int, int]:
+        """
+        thins out old snapshots and deletes the objects no remaining snapshot points at
+        :return: number of snapshots and of objects deleted
+        """
+        today = today or date.today()
+        snapshots = pd.read_sql_query("SELECT id, taken_at FROM snapshots ORDER BY taken_at, id", self.conn,
+                                      parse_dates=['taken_at'])
+        if snapshots.empty:
+            return 0, 0
+        age_days = (pd.Timestamp(today) - snapshots['taken_at'].dt.normalize()).dt.days
+        daily = age_days < keep_daily_days
+        weekly = ~daily & (age_days < keep_daily_days + 7 * keep_weekly_weeks)
+        monthly = ~daily & ~weekly
+        if keep_monthly_months is not None:
+            monthly &= age_days < keep_daily_days + 7 * keep_weekly_weeks + 31 * keep_monthly_months
+        keep = daily.copy()
+        # the last snapshot of every week (or month) in its band survives
+        for band, period in ((weekly, 'W'), (monthly, 'M')):
+            periods = snapshots.loc[band, 'taken_at'].dt.to_period(period)
+            keep[periods.index.to_series().groupby(periods).last()] = True
+        # the newest snapshot is never deleted, whatever the policy
+        keep.iloc[-1] = True
+
+        expired = snapshots.loc[~keep, 'id'].tolist()
+        with self.conn:
+            self.conn.executemany("DELETE FROM snapshots WHERE id = ?", [(snapshot_id,) for snapshot_id in expired])
+            orphans = [row[0] for row in self.conn.execute(
+                "SELECT hash FROM objects WHERE hash NOT IN (SELECT object_hash FROM snapshot_tables)")]
+            self.conn.executemany("DELETE FROM objects WHERE hash = ?", [(object_hash,) for object_hash in orphans])
+        for object_hash in orphans:
+            self._object_path(object_hash).unlink(missing_ok=True)
+        if expired:
+            logger.info(f"Archive retention removed {len(expired)} snapshots and {len(orphans)} objects")
+        return len(expired), len(orphans)
+
+    def import_json_copies(self, paths: list[Path], remove: bool = False) -> int:
+        """
+        archives the daylio_YYYYMMDD_HHMM.json copies the pickup used to write, in the order they were taken
+        :param remove: delete each copy once it is archived
+        :return: number of copies imported
+        """
+        dated = sorted((datetime.strptime(path.stem, 'daylio_%Y%m%d_%H%M'), path) for path in paths)
+        for taken_at, path in dated:
+            self.store(json.loads(path.read_text(encoding='utf-8')), taken_at=taken_at, source=path.name)
+            if remove:
+                path.unlink()
+        return len(dated)
+
+    def stats(self) -> dict:
+        snapshot_count = self.conn.execute("SELECT COUNT(*) FROM snapshots").fetchone()[0]
+        objects, stored_bytes = self.conn.execute("SELECT COUNT(*), SUM(stored_bytes) FROM objects").fetchone()
+        # what the snapshots would take as uncompressed, undeduplicated JSON
+        logical_bytes = self.conn.execute(
+            "SELECT SUM(o.raw_bytes) FROM snapshot_tables st JOIN objects o ON o.hash = st.object_hash").fetchone()[0]
+        return {'snapshots': snapshot_count, 'objects': objects, 'stored_bytes': stored_bytes or 0,
+                'logical_bytes': logical_bytes or 0}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect and maintain the Daylio snapshot archive")
+    parser.add_argument("--archive", type=Path, default=Path("data") / "archive")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("list", help="list the archived snapshots (default)")
+    diff_parser = commands.add_parser("diff", help="rows that differ between two snapshots")
+    diff_parser.add_argument("old", help="snapshot id or date, e.g. 2024-03-01")
+    diff_parser.add_argument("new", help="snapshot id or date")
+    commands.add_parser("prune", help="apply the retention policy")
+    import_parser = commands.add_parser("import", help="archive the old daylio_*.json copies")
+    import_parser.add_argument("--remove", action="store_true", help="delete each copy once it is archived")
+    args = parser.parse_args()
+
+    def snapshot_ref(value: str) -> int | str:
+        return int(value) if value.isdigit() else value
+
+    with SnapshotArchive(args.archive) as archive:
+        if args.command == "diff":
+            print(archive.diff(snapshot_ref(args.old), snapshot_ref(args.new)).to_string(index=False))
+        elif args.command == "prune":
+            print("removed {} snapshots and {} objects".format(*archive.apply_retention()))
+        elif args.command == "import":
+            print(f"imported {archive.import_json_copies(list(args.archive.glob('daylio_*.json')), args.remove)} copies")
+        else:
+            print(archive.snapshots().to_string(index=False))
+            stats = archive.stats()
+            print(f"\n{stats['snapshots']} snapshots in {stats['objects']} objects, "
+                  f"{stats['stored_bytes'] / 1e6:.2f} MB stored for {stats['logical_bytes'] / 1e6:.2f} MB of JSON")
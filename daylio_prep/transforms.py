@@ -0,0 +1,114 @@
+import time
+from typing import Callable
+import pandas as pd
+from log_setup import logger
+
+# transforms take a table's DataFrame and its list of ColumnInfo, and return the transformed DataFrame
+TableTransform = Callable[[pd.DataFrame, list], pd.DataFrame]
+
+# timestamp column -> date column derived from it
+DATE_FIELDS = {
+    'createdAt': 'date',
+    'datetime': 'date',
+    'created_at': 'date',
+    'end_date': 'date_end',
+}
+
+# names Daylio leaves blank for the predefined moods of these mood groups
+DEFAULT_MOOD_NAMES = {2: 'Good', 3: 'Meh', 4: 'Bad'}
+
+_TRANSFORMS: dict[str, list[TableTransform]] = {}
+
+
+def register_transform(table_name: str):
+    """Decorator registering a transform for a table, transforms run in registration order"""
+    def decorator(transform: TableTransform) -> TableTransform:
+        _TRANSFORMS.setdefault(table_name, []).append(transform)
+        return transform
+    return decorator
+
+
+def transforms_for(table_name: str) -> list[TableTransform]:
+    """returns the transforms registered for a table, tables without any just get their dates fixed"""
+    return _TRANSFORMS.get(table_name, [fix_dates])
+
+
+def apply_transforms(table_name: str, df: pd.DataFrame, columns: list) -> pd.DataFrame:
+    for transform in transforms_for(table_name):
+        logger.info(f"Applying transform {transform.__name__} to table {table_name}...")
+        df = transform(df, columns)
+    return df
+
+
+def fix_dates(df: pd.DataFrame, columns: list, null_values: tuple = (0,)) -> pd.DataFrame:
+    """
+    converts epoch-ms timestamp columns to datetimes, with a single pass per column
+    :param null_values: raw values Daylio uses for 'no timestamp'
+    """
+    for col in columns:
+        if col.type_name != 'timestamp' or col.name not in DATE_FIELDS or col.name not in df:
+            continue
+        raw = df[col.name]
+        stamps = pd.to_datetime(raw.where(~raw.isin(null_values)), unit='ms')
+        df[col.name] = stamps
+        df[DATE_FIELDS[col.name]] = stamps.dt.normalize()
+    return df
+
+
+register_transform('customMoods')(fix_dates)
+register_transform('tags')(fix_dates)
+register_transform('dayEntries')(fix_dates)
+register_transform('goalEntries')(fix_dates)
+
+
+@register_transform('goals')
+def fix_goal_dates(df: pd.DataFrame, columns: list) -> pd.DataFrame:
+    # goals without an end date carry -1 rather than 0
+    return fix_dates(df, columns, null_values=(0, -1))
+
+
+@register_transform('customMoods')
+def add_mood_values(df: pd.DataFrame, columns: list) -> pd.DataFrame:
+    """adds mood_value and fills in the names of the predefined moods"""
+    df['mood_value'] = 6 - df['mood_group_id']
+    if 'custom_name' not in df:
+        df['custom_name'] = None
+    defaults = df['mood_group_id'].map(DEFAULT_MOOD_NAMES)
+    mask = defaults.notna() & (df['mood_group_order'] == 0)
+    df.loc[mask, 'custom_name'] = defaults[mask]
+    return df
+
+
+def _synthetic_table(columns: list, n_rows: int) -> pd.DataFrame:
+    import numpy as np
+    rng = np.random.default_rng(0)
+    data = {}
+    for col in columns:
+        if col.type_name == 'timestamp':
+            stamps = 1_500_000_000_000 + rng.integers(0, 300_000_000_000, n_rows)
+            stamps[rng.random(n_rows) < 0.05] = 0
+            data[col.name] = stamps
+        elif col.type_name == 'Int64.Type':
+            data[col.name] = rng.integers(0, 6, n_rows)
+        else:
+            data[col.name] = np.where(rng.random(n_rows) < 0.5, 'text', '')
+    return pd.DataFrame(data)
+
+
+def benchmark(sizes: tuple = (1_000, 10_000, 100_000, 1_000_000)):
+    """times every registered table's transforms over synthetic tables of increasing size"""
+    from .daylio_cleaner import get_table_info
+    for table_name in _TRANSFORMS:
+        columns = get_table_info(table_name)
+        for n_rows in sizes:
+            df = _synthetic_table(columns, n_rows)
+            start = time.perf_counter()
+            apply_transforms(table_name, df, columns)
+            elapsed = time.perf_counter() - start
+            print(f"{table_name:<12} {n_rows:>9,} rows  {elapsed * 1000:>9.1f} ms  "
+                  f"{elapsed / n_rows * 1e6:>6.2f} us/row")
+
+
+if __name__ == "__main__":
+    logger.disabled = True
+    benchmark()
@@ -0,0 +1,179 @@
+"""Typed per-table working store between the backup decoder and the cleaner.
+
+DaylioPickup writes every decoded table to ``data/working/<table>.arrow`` as an
+uncompressed Arrow IPC file, and the cleaner reads it back through a memory map.
+Reading is zero-copy up to the pandas conversion, and only the requested columns
+are converted at all. Compared to the indented daylio.json this was replacing, it
+saves a full JSON serialize and parse, most of the disk space, and the memory of the
+columns the cleaner drops anyway.
+
+Columns whose values Arrow cannot type, e.g. the mixed bools, numbers and strings of
+prefs.value, are stored as JSON text and decoded again on read.
+
+Run ``python -m daylio_prep.working_store [entries ...]`` to compare it with the JSON
+round trip on synthetic histories.
+"""
+import json
+import os
+from pathlib import Path
+import pandas as pd
+import pyarrow as pa
+from log_setup import logger
+
+STORE_SUFFIX = ".arrow"
+_JSON_ENCODED = {b"encoding": b"json"}
+
+
+def rows_to_arrow(rows: list[dict]) -> pa.Table:
+    """
+    builds an Arrow table from decoded backup rows. Every key that appears in any row becomes a column,
+    rows without it get nulls
+    """
+    names = list(dict.fromkeys(key for row in rows for key in row))
+    fields, arrays = [], []
+    for name in names:
+        values = [row.get(name) for row in rows]
+        try:
+            array = pa.array(values)
+            fields.append(pa.field(name, array.type))
+        except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+            array = pa.array([None if value is None else json.dumps(value) for value in values], pa.string())
+            fields.append(pa.field(name, pa.string(), metadata=_JSON_ENCODED))
+        arrays.append(array)
+    return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+
+def _decode_json_columns(table: pa.Table, df: pd.DataFrame) -> pd.DataFrame:
+    for field in table.schema:
+        if field.metadata == _JSON_ENCODED:
+            df[field.name] = df[field.name].map(json.loads, na_action='ignore')
+    return df
+
+
+class WorkingStore:
+    """One Arrow IPC file per decoded backup table."""
+
+    def __init__(self, store_dir: Path):
+        self.store_dir = Path(store_dir)
+
+    def path(self, table_name: str) -> Path:
+        return self.store_dir / f"{table_name}{STORE_SUFFIX}"
+
+    def tables(self) -> list[str]:
+        return sorted(path.stem for path in self.store_dir.glob(f"*{STORE_SUFFIX}"))
+
+    def write(self, tables: dict[str, list]) -> int:
+        """
+        replaces the store's contents with the given tables
+        :return: bytes written
+        """
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        written = sum(self.write_table(name, rows) for name, rows in tables.items())
+        for stale in set(self.tables()) - tables.keys():
+            self.path(stale).unlink()
+        logger.info(f"Working store written: {len(tables)} tables, {written / 1e6:.2f} MB")
+        return written
+
+    def write_table(self, table_name: str, rows: list[dict]) -> int:
+        table = rows_to_arrow(rows)
+        path = self.path(table_name)
+        # written next to the target and swapped in, a reader never sees a half-written file
+        partial = path.with_suffix(".partial")
+        with pa.OSFile(str(partial), "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(partial, path)
+        return path.stat().st_size
+
+    def read_arrow(self, table_name: str, columns: list[str] | None = None) -> pa.Table:
+        """
+        memory-maps a table, only the pages of the selected columns are ever read from disk
+        :param columns: columns to keep, names the table does not have are skipped. None keeps all
+        """
+        path = self.path(table_name)
+        if not path.exists():
+            raise FileNotFoundError(f"{table_name} is not in the working store {self.store_dir}")
+        with pa.memory_map(str(path), "r") as source:
+            table = pa.ipc.open_file(source).read_all()
+        if columns is not None:
+            table = table.select([name for name in columns if name in table.schema.names])
+        return table
+
+    def read_table(self, table_name: str, columns: list[str] | None = None) -> pd.DataFrame:
+        table = self.read_arrow(table_name, columns)
+        return _decode_json_columns(table, table.to_pandas())
+
+    def read_records(self, table_name: str) -> list[dict]:
+        """the table's rows as dicts, the shape the decoder produced them in, missing keys come back as None"""
+        table = self.read_arrow(table_name)
+        encoded = [field.name for field in table.schema if field.metadata == _JSON_ENCODED]
+        rows = table.to_pylist()
+        for row in rows:
+            for name in encoded:
+                if row[name] is not None:
+                    row[name] = json.loads(row[name])
+        return rows
+
+
+def _synthetic_entries(n_entries: int) -> list[dict]:
+    import numpy as np
+    rng = np.random.default_rng(0)
+    stamps = 1_500_000_000_000 + np.sort(rng.integers(0, 300_000_000_000, n_entries))
+    moods = rng.integers(1, 6, n_entries)
+    return [{
+        "id": i, "minute": 0, "hour": 12, "day": 1, "month": 0, "year": 2020, "datetime": int(stamps[i]),
+        "timeZoneOffset": 3600000, "mood": int(moods[i]), "note": "note " * int(rng.integers(0, 40)),
+        "note_title": "", "tags": rng.integers(1, 60, int(rng.integers(0, 6))).tolist(), "assets": [],
+    } for i in range(n_entries)]
+
+
+def benchmark(sizes: list[int]) -> pd.DataFrame:
+    """
+    times getting dayEntries from the decoded rows into the cleaner's DataFrame, through daylio.json and
+    through the working store, reading the columns the cleaner keeps
+    """
+    import tempfile
+    import time
+    import tracemalloc
+    columns = ["id", "datetime", "mood", "note", "note_title", "tags"]
+
+    def measure(fn) -> tuple[float, int]:
+        # timed untraced, tracemalloc slows the allocation-heavy json path down far more than the store
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        tracemalloc.start()
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return elapsed * 1000, peak
+
+    rows = []
+    for n_entries in sizes:
+        decoded = {"dayEntries": _synthetic_entries(n_entries)}
+        with tempfile.TemporaryDirectory() as tmp:
+            json_path = Path(tmp) / "daylio.json"
+            store = WorkingStore(Path(tmp) / "working")
+            json_write_ms, _ = measure(lambda: json_path.write_text(json.dumps(decoded, indent=4)))
+            json_read_ms, json_peak = measure(
+                lambda: pd.DataFrame(json.loads(json_path.read_text())["dayEntries"])[columns])
+            store_write_ms, _ = measure(lambda: store.write(decoded))
+            store_read_ms, store_peak = measure(lambda: store.read_table("dayEntries", columns))
+            rows.append({
+                "entries": n_entries,
+                "json_mb": json_path.stat().st_size / 1e6,
+                "store_mb": store.path("dayEntries").stat().st_size / 1e6,
+                "json_write_ms": json_write_ms,
+                "store_write_ms": store_write_ms,
+                "json_read_ms": json_read_ms,
+                "store_read_ms": store_read_ms,
+                "json_read_peak_mb": json_peak / 1e6,
+                "store_read_peak_mb": store_peak / 1e6,
+            })
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    import sys
+    logger.disabled = True
+    entry_counts = [int(arg) for arg in sys.argv[1:]] or [5_000, 50_000, 200_000]
+    print(benchmark(entry_counts).to_string(index=False, float_format=lambda value: f"{value:.1f}"))
@@ -1 +1,4 @@
-from .get_fitbit_sleep import get_fitbit_sleep_data, clean_sleep_data
\ No newline at end of file
+from .get_fitbit_sleep import get_fitbit_sleep_data
+from .sleep_cleaner import clean_sleep_data, nap_or_full
+from .sleep_sync import sync_fitbit_sleep, drop_legacy_sleep_table, add_short_wakes_column, sync_watermark
+from .sleep_stages import encode_segments, count_short_wakes, hypnogram, time_in_stage_by_hour, stage_totals
@@ -0,0 +1,142 @@
+"""Equivalence check and benchmark for the columnar sleep cleaner.
+
+Run with ``python -m fitbit_sleep.sleep_benchmark [years]``. The row-wise cleaner below is
+the original implementation, kept only as the reference the columnar one must match.
+"""
+import datetime
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+from .sleep_cleaner import clean_sleep_data, nap_or_full
+
+
+def clean_sleep_data_rowwise(sleep_entries):
+    cleaned_entries = []
+
+    for entry in sleep_entries:
+        duration = entry.get('duration', 0)
+        duration_td = datetime.timedelta(milliseconds=duration)
+        formatted_time = str(duration_td)
+
+        start_time_obj = datetime.datetime.strptime(entry['startTime'], "%Y-%m-%dT%H:%M:%S.%f")
+        end_time_obj = datetime.datetime.strptime(entry['endTime'], "%Y-%m-%dT%H:%M:%S.%f")
+        start_time_readable = start_time_obj.strftime("%Y-%m-%d %H:%M")
+        end_time_readable = end_time_obj.strftime("%Y-%m-%d %H:%M")
+        sleep_type = nap_or_full(round(duration / 3600000), start_time_obj, end_time_obj)
+        sleep_date = datetime.datetime.strptime(entry['dateOfSleep'], '%Y-%m-%d').date()
+        sleep_log_type = entry.get('type', 'unknown')
+        summary = entry.get('levels', {}).get('summary', {})
+
+        if sleep_log_type == "classic":
+            levels = entry.get("levels", {}).get("data", [])
+            asleep_count = sum(1 for level in levels if level["level"] == "asleep")
+            awake_count = sum(1 for level in levels if level["level"] == "awake")
+            restless_count = sum(1 for level in levels if level["level"] == "restless")
+        else:
+            asleep_count = awake_count = restless_count = None
+
+        cleaned_entries.append({
+            "log_id": entry['logId'],
+            "date": sleep_date,
+            "duration_milliseconds": duration,
+            "duration_seconds": round(duration_td.total_seconds()),
+            "duration_minutes": round(duration / 60000),
+            "duration_hours": round(duration / 3600000, 1),
+            "duration_hhmmss": formatted_time,
+            "sleep_type": sleep_type,
+            "start_time": start_time_obj,
+            "start_time_ymdhm": start_time_readable,
+            "end_time": end_time_obj,
+            "end_time_ymdhm": end_time_readable,
+            "efficiency": entry['efficiency'],
+            "minutes_asleep": entry['minutesAsleep'],
+            "minutes_awake": entry['minutesAwake'],
+            "main_sleep": entry['isMainSleep'],
+            "deep_sleep_count": summary.get('deep', {}).get('count', None),
+            "deep_sleep_minutes": summary.get('deep', {}).get('minutes', None),
+            "light_sleep_count": summary.get('light', {}).get('count', None),
+            "light_sleep_minutes": summary.get('light', {}).get('minutes', None),
+            "rem_sleep_count": summary.get('rem', {}).get('count', None),
+            "rem_sleep_minutes": summary.get('rem', {}).get('minutes', None),
+            "wake_count": summary.get('wake', {}).get('count', None),
+            "wake_minutes": summary.get('wake', {}).get('minutes', None),
+            "asleep_count": asleep_count,
+            "asleep_minutes": summary.get('asleep', {}).get('minutes', None),
+            "awake_count": awake_count,
+            "awake_minutes": summary.get('awake', {}).get('minutes', None),
+            "restless_count": restless_count,
+            "restless_minutes": summary.get('restless', {}).get('minutes', None),
+            "sleep_log_type": sleep_log_type,
+        })
+
+    return pd.DataFrame(cleaned_entries)
+
+
+def synthetic_sleep_logs(n_nights: int, seed: int = 0, classic_share: float = 0.2) -> list[dict]:
+    """builds Fitbit-shaped sleep logs: one main sleep per night plus the occasional nap"""
+    rng = np.random.default_rng(seed)
+    first_night = datetime.datetime(2018, 1, 1, 22, 0)
+    logs = []
+    for night in range(n_nights):
+        sleeps = [(first_night + datetime.timedelta(days=night, minutes=int(rng.integers(-120, 180))),
+                   int(rng.integers(240, 600)), True)]
+        if rng.random() < 0.15:
+            sleeps.append((first_night + datetime.timedelta(days=night, hours=-8, minutes=int(rng.integers(0, 240))),
+                           int(rng.integers(15, 200)), False))
+        for start, minutes, is_main in sleeps:
+            end = start + datetime.timedelta(minutes=minutes)
+            classic = rng.random() < classic_share
+            levels = ("asleep", "awake", "restless") if classic else ("deep", "light", "rem", "wake")
+            segments, offset = [], 0
+            while offset < minutes * 60:
+                seconds = int(rng.integers(1, 40)) * 30
+                segments.append({"dateTime": (start + datetime.timedelta(seconds=offset)).strftime("%Y-%m-%dT%H:%M:%S.000"),
+                                 "level": levels[rng.integers(0, len(levels))], "seconds": seconds})
+                offset += seconds
+            short_data = []
+            if not classic:
+                for _ in range(int(rng.integers(0, 8))):
+                    blip_at = int(rng.integers(0, minutes * 2)) * 30
+                    short_data.append({"dateTime": (start + datetime.timedelta(seconds=blip_at)).strftime("%Y-%m-%dT%H:%M:%S.000"),
+                                       "level": "wake", "seconds": int(rng.integers(1, 4)) * 30})
+            summary = {level: {"count": int(rng.integers(1, 30)), "minutes": int(rng.integers(0, minutes))}
+                       for level in levels}
+            logs.append({
+                "logId": 10_000_000 + len(logs),
+                "dateOfSleep": end.strftime("%Y-%m-%d"),
+                "startTime": start.strftime("%Y-%m-%dT%H:%M:%S.000"),
+                "endTime": end.strftime("%Y-%m-%dT%H:%M:%S.000"),
+                "duration": minutes * 60000,
+                "efficiency": int(rng.integers(70, 100)),
+                "minutesAsleep": int(minutes * 0.9),
+                "minutesAwake": minutes - int(minutes * 0.9),
+                "isMainSleep": is_main,
+                "type": "classic" if classic else "stages",
+                "levels": {"summary": summary, "data": segments, "shortData": short_data},
+            })
+    return logs
+
+
+def check_equivalence(sleep_entries: list[dict]):
+    """raises AssertionError if the columnar cleaner differs from the row-wise reference in any way"""
+    pd.testing.assert_frame_equal(clean_sleep_data(sleep_entries), clean_sleep_data_rowwise(sleep_entries))
+
+
+def benchmark(years: int = 5):
+    logs = synthetic_sleep_logs(years * 365)
+    for classic_share in (0.0, 1.0):
+        check_equivalence(synthetic_sleep_logs(60, seed=1, classic_share=classic_share))
+    check_equivalence(logs)
+    print(f"columnar output identical to row-wise reference over {len(logs):,} logs")
+
+    for name, cleaner in (("row-wise", clean_sleep_data_rowwise), ("columnar", clean_sleep_data)):
+        start = time.perf_counter()
+        cleaner(logs)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<9} {elapsed * 1000:>8.1f} ms  ({len(logs) / elapsed:,.0f} logs/s)")
+
+
+if __name__ == "__main__":
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,151 @@
+import datetime
+import numpy as np
+import pandas as pd
+
+FITBIT_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+NAP_HOURS = 3
+
+# levels.summary entries read into <level>_count / <level>_minutes style columns
+STAGE_LEVELS = ("deep", "light", "rem", "wake")
+CLASSIC_LEVELS = ("asleep", "awake", "restless")
+
+
+def nap_or_full(duration_hours, start_time, end_time):
+    sleep_type = "full"
+    nap_hours = NAP_HOURS
+    if (start_time.hour in range(8, 19, 1) and duration_hours <= nap_hours):
+        sleep_type = "nap"
+    elif start_time.date() == end_time.date() and start_time.hour in range(7, 19, 1) and duration_hours <= 6:
+        sleep_type = "nap"
+    elif start_time.date() == end_time.date() and duration_hours > nap_hours:
+        sleep_type = "full"
+    elif start_time.date() != end_time.date():
+        sleep_type = "full"
+    else:
+        sleep_type = "nap"
+    return sleep_type
+
+
+def nap_or_full_vectorized(duration_hours: pd.Series, start_time: pd.Series, end_time: pd.Series) -> np.ndarray:
+    """
+    Column-wise version of nap_or_full, evaluating the same rules in the same order.
+
+    :param duration_hours: rounded sleep durations in hours
+    :param start_time: datetime64 series of sleep start times
+    :param end_time: datetime64 series of sleep end times
+    :return: array of "nap" / "full" labels
+    """
+    start_hour = start_time.dt.hour
+    same_day = (start_time.dt.normalize() == end_time.dt.normalize()).to_numpy()
+    conditions = [
+        (start_hour.between(8, 18) & (duration_hours <= NAP_HOURS)).to_numpy(),
+        same_day & (start_hour.between(7, 18) & (duration_hours <= 6)).to_numpy(),
+        same_day & (duration_hours > NAP_HOURS).to_numpy(),
+        ~same_day,
+    ]
+    return np.select(conditions, ["nap", "nap", "full", "full"], default="nap")
+
+
+def _summary_fields(summaries: list[dict], level: str) -> pd.DataFrame:
+    """
+    reads count/minutes of one sleep level from every log summary in a single columnar build
+
+    a level missing from every log comes out as columns of None, like the row-wise dict build did
+    """
+    if not any(level in summary for summary in summaries):
+        empty = pd.Series([None] * len(summaries), dtype=object)
+        return pd.DataFrame({"count": empty, "minutes": empty})
+    return pd.DataFrame.from_records([summary.get(level) or {} for summary in summaries],
+                                     columns=["count", "minutes"])
+
+
+def _format_hhmmss(duration_ms: pd.Series) -> pd.Series:
+    """formats millisecond durations exactly like str(datetime.timedelta(milliseconds=...))"""
+    total_seconds, millis = np.divmod(duration_ms.to_numpy(dtype=np.int64), 1000)
+    hours, remainder = np.divmod(total_seconds, 3600)
+    minutes, seconds = np.divmod(remainder, 60)
+    text = (pd.Series(hours, index=duration_ms.index).astype(str) + ":"
+            + pd.Series(minutes, index=duration_ms.index).astype(str).str.zfill(2) + ":"
+            + pd.Series(seconds, index=duration_ms.index).astype(str).str.zfill(2))
+    # anything over a day or with sub-second precision is rare enough to format one at a time
+    unusual = (hours >= 24) | (millis != 0) | (duration_ms.to_numpy() < 0)
+    if unusual.any():
+        text[unusual] = [str(datetime.timedelta(milliseconds=int(ms))) for ms in duration_ms[unusual]]
+    return text
+
+
+def _format_ymdhm(times: pd.Series) -> np.ndarray:
+    return np.char.replace(np.datetime_as_string(times.to_numpy(), unit="m"), "T", " ").astype(object)
+
+
+def _classic_level_counts(levels: pd.Series, is_classic: pd.Series) -> dict[str, pd.Series]:
+    """counts asleep/awake/restless segments of classic logs in one grouped pass over levels.data"""
+    segments = levels[is_classic].str.get("data").explode().dropna()
+    level_names = pd.Series([segment["level"] for segment in segments], index=segments.index, dtype=object)
+    counts = (level_names[level_names.isin(CLASSIC_LEVELS)]
+              .groupby(level=0).value_counts()
+              .unstack(fill_value=0)
+              .reindex(index=levels.index[is_classic], columns=list(CLASSIC_LEVELS), fill_value=0))
+
+    result = {}
+    for level in CLASSIC_LEVELS:
+        if is_classic.all():
+            result[level] = counts[level].astype(np.int64)
+        elif is_classic.any():
+            result[level] = counts[level].astype(float).reindex(levels.index)
+        else:
+            result[level] = pd.Series([None] * len(levels), index=levels.index, dtype=object)
+    return result
+
+
+def clean_sleep_data(sleep_entries: list[dict]) -> pd.DataFrame:
+    """
+    Cleans and formats the sleep data entries.
+
+    :param sleep_entries: List of sleep entries
+    :return: DataFrame of cleaned sleep entries
+    """
+    if len(sleep_entries) == 0:
+        return pd.DataFrame([])
+
+    logs = pd.DataFrame(sleep_entries)
+    levels = logs["levels"] if "levels" in logs else pd.Series([{}] * len(logs))
+    levels = levels.where(levels.notna(), pd.Series([{}] * len(logs)))
+    summaries = [level.get("summary", {}) for level in levels]
+
+    duration = logs["duration"].fillna(0).astype(np.int64) if "duration" in logs else pd.Series(0, index=logs.index)
+    start_time = pd.to_datetime(logs["startTime"], format=FITBIT_TIME_FORMAT)
+    end_time = pd.to_datetime(logs["endTime"], format=FITBIT_TIME_FORMAT)
+    sleep_log_type = logs["type"].fillna("unknown") if "type" in logs else pd.Series("unknown", index=logs.index)
+    rounded_hours = pd.Series(np.rint(duration / 3600000), index=logs.index)
+    level_counts = _classic_level_counts(levels, sleep_log_type == "classic")
+    summary = {level: _summary_fields(summaries, level) for level in STAGE_LEVELS + CLASSIC_LEVELS}
+
+    cleaned = {
+        "log_id": logs["logId"],
+        "date": pd.to_datetime(logs["dateOfSleep"], format="%Y-%m-%d").dt.date,
+        "duration_milliseconds": duration,
+        "duration_seconds": np.rint(duration / 1000).astype(np.int64),
+        "duration_minutes": np.rint(duration / 60000).astype(np.int64),
+        # python's round() to one decimal is exact where np.round is not, so keep it for identical output
+        "duration_hours": [round(ms / 3600000, 1) for ms in duration.tolist()],
+        "duration_hhmmss": _format_hhmmss(duration),
+        "sleep_type": nap_or_full_vectorized(rounded_hours, start_time, end_time),
+        "start_time": start_time,
+        "start_time_ymdhm": _format_ymdhm(start_time),
+        "end_time": end_time,
+        "end_time_ymdhm": _format_ymdhm(end_time),
+        "efficiency": logs["efficiency"],
+        "minutes_asleep": logs["minutesAsleep"],
+        "minutes_awake": logs["minutesAwake"],
+        "main_sleep": logs["isMainSleep"],
+    }
+    for level, prefix in zip(STAGE_LEVELS, ("deep_sleep", "light_sleep", "rem_sleep", "wake")):
+        cleaned[f"{prefix}_count"] = summary[level]["count"].to_numpy()
+        cleaned[f"{prefix}_minutes"] = summary[level]["minutes"].to_numpy()
+    for level in CLASSIC_LEVELS:
+        cleaned[f"{level}_count"] = level_counts[level]
+        cleaned[f"{level}_minutes"] = summary[level]["minutes"].to_numpy()
+    cleaned["sleep_log_type"] = sleep_log_type
+
+    return pd.DataFrame(cleaned, index=logs.index)
@@ -0,0 +1,273 @@
+import datetime
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable
+from log_setup import logger
+
+DEFAULT_API_BASE = "https://api.fitbit.com"
+MAX_RANGE_DAYS = 100  # longest date range the sleep endpoint accepts in one request
+HOURLY_QUOTA = 150  # Fitbit's per-user request quota
+SETTLE_DAYS = 3  # recent days can still change as the tracker syncs, so they are never cached
+
+
+def date_windows(start: datetime.date, end: datetime.date,
+                 max_days: int = MAX_RANGE_DAYS) -> list[tuple[datetime.date, datetime.date]]:
+    """splits an inclusive date range into consecutive windows of at most max_days days"""
+    windows = []
+    while start <= end:
+        window_end = min(start + datetime.timedelta(days=max_days - 1), end)
+        windows.append((start, window_end))
+        start = window_end + datetime.timedelta(days=1)
+    return windows
+
+
+class TokenBucket:
+    """Thread-safe token bucket, acquire() blocks until a request may be sent."""
+
+    def __init__(self, capacity: int, refill_per_second: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def hourly(cls, quota: int = HOURLY_QUOTA) -> "TokenBucket":
+        return cls(quota, quota / 3600)
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.refill_per_second)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.refill_per_second
+            logger.info(f"Fitbit request quota exhausted, waiting {wait:.0f}s")
+            time.sleep(wait)
+
+    def observe(self, remaining: int, reset_seconds: float):
+        """
+        lowers the tokens to the quota Fitbit reports as left, which also counts requests made by other
+        processes on the same credential. With nothing left the next acquire waits for the reset
+        """
+        with self._lock:
+            self._tokens = min(self._tokens, float(remaining))
+            if remaining < 1:
+                self._tokens = min(self._tokens, 1 - reset_seconds * self.refill_per_second)
+
+    def observe_headers(self, headers):
+        """observe() from the Fitbit-Rate-Limit-Remaining and Fitbit-Rate-Limit-Reset response headers"""
+        try:
+            remaining = int(headers["Fitbit-Rate-Limit-Remaining"])
+            reset_seconds = float(headers["Fitbit-Rate-Limit-Reset"])
+        except (KeyError, TypeError, ValueError):
+            return
+        self.observe(remaining, reset_seconds)
+
+
+_shared_bucket: TokenBucket | None = None
+_shared_bucket_lock = threading.Lock()
+
+
+def shared_bucket() -> TokenBucket:
+    """
+    the hourly bucket of the whole process, every fetcher, refresh and per-user worker thread shares it
+    since they all spend the quota of one Fitbit credential
+    """
+    global _shared_bucket
+    with _shared_bucket_lock:
+        if _shared_bucket is None:
+            _shared_bucket = TokenBucket.hourly()
+        return _shared_bucket
+
+
+def missing_windows(days: list[datetime.date], max_days: int = MAX_RANGE_DAYS) -> list[tuple[datetime.date, datetime.date]]:
+    """groups sorted days into contiguous runs and splits each run into API-legal windows"""
+    windows, run_start, previous = [], None, None
+    for day in days:
+        if run_start is not None and day != previous + datetime.timedelta(days=1):
+            windows.extend(date_windows(run_start, previous, max_days))
+            run_start = None
+        if run_start is None:
+            run_start = day
+        previous = day
+    if run_start is not None:
+        windows.extend(date_windows(run_start, previous, max_days))
+    return windows
+
+
+class SleepResponseCache:
+    """On-disk cache of sleep logs per dateOfSleep, only settled past days are stored."""
+
+    def __init__(self, cache_dir: Path, settle_days: int = SETTLE_DAYS):
+        self.cache_dir = cache_dir
+        self.settle_days = settle_days
+
+    def _path(self, day: datetime.date) -> Path:
+        return self.cache_dir / f"sleep_{day}.json"
+
+    def cacheable(self, day: datetime.date) -> bool:
+        return day < datetime.date.today() - datetime.timedelta(days=self.settle_days)
+
+    def get(self, day: datetime.date) -> list[dict] | None:
+        path = self._path(day)
+        if not path.exists():
+            return None
+        return json.loads(path.read_text())
+
+    def put(self, start: datetime.date, end: datetime.date, sleep: list[dict]):
+        """stores a window's response split by day, days without any sleep are cached as empty"""
+        by_day = {day: [] for day in (start + datetime.timedelta(days=i) for i in range((end - start).days + 1))}
+        for log in sleep:
+            by_day.setdefault(datetime.date.fromisoformat(log["dateOfSleep"]), []).append(log)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        for day, logs in by_day.items():
+            if not self.cacheable(day):
+                continue
+            path = self._path(day)
+            tmp_path = path.with_suffix(".tmp")
+            tmp_path.write_text(json.dumps(logs))
+            tmp_path.replace(path)
+
+
+def http_request(url: str) -> dict:
+    """unauthenticated GET, for pointing the fetcher at a local stub server"""
+    import requests
+    response = requests.get(url, timeout=30)
+    shared_bucket().observe_headers(response.headers)
+    response.raise_for_status()
+    return response.json()
+
+
+def fitbit_request(authd_client) -> Callable[[str], dict]:
+    """
+    request function of an authenticated fitbit.Fitbit client that feeds the rate limit headers of every
+    response to the shared bucket, which the client's own make_request drops
+    """
+    def request(url: str) -> dict:
+        # the OAuth client raises the same errors as Fitbit.make_request but hands back the whole response
+        response = authd_client.client.make_request(url, headers={'Accept-Language': authd_client.system})
+        shared_bucket().observe_headers(response.headers)
+        return response.json()
+    return request
+
+
+def _is_retryable(error: BaseException) -> bool:
+    import requests
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    try:
+        from fitbit.exceptions import HTTPServerError, HTTPTooManyRequests
+    except ImportError:
+        return False
+    return isinstance(error, (HTTPServerError, HTTPTooManyRequests))
+
+
+def _retry_wait(retry_state) -> float:
+    from tenacity import wait_exponential_jitter
+    # honour Fitbit's Retry-After on 429s, otherwise back off exponentially with jitter
+    retry_after = getattr(retry_state.outcome.exception(), "retry_after_secs", None)
+    if retry_after:
+        return float(retry_after)
+    return wait_exponential_jitter(initial=1, max=60)(retry_state)
+
+
+class SleepFetcher:
+    """Fetches Fitbit sleep logs for arbitrary date ranges.
+
+    Ranges are split into API-legal windows that are fetched concurrently, every
+    request goes through a shared token bucket and is retried with backoff, and
+    settled past days are served from an on-disk cache instead of the API.
+    """
+
+    def __init__(self, request_fn: Callable[[str], dict] | None = None, base_url: str | None = None,
+                 cache_dir: Path | None = None, max_workers: int = 4, bucket: TokenBucket | None = None,
+                 max_attempts: int = 5):
+        """
+        :param request_fn: callable taking a URL and returning the decoded JSON response,
+            defaults to an authenticated Fitbit client
+        :param base_url: API root, override to point at a stub server
+        :param cache_dir: directory for cached past-day responses, None disables caching
+        :param max_workers: number of windows fetched concurrently
+        :param bucket: rate limiter of the requests, defaults to the bucket shared by the whole process
+        :param max_attempts: attempts per window before giving up
+        """
+        self._request_fn = request_fn
+        self.base_url = (base_url or os.getenv("FITBIT_API_BASE", DEFAULT_API_BASE)).rstrip("/")
+        self.cache = SleepResponseCache(cache_dir) if cache_dir is not None else None
+        self.max_workers = max_workers
+        self.bucket = bucket or shared_bucket()
+        # tenacity pulls in tornado, so it is only imported once a fetcher is actually built
+        from tenacity import retry, retry_if_exception, stop_after_attempt
+        self._request_window = retry(
+            stop=stop_after_attempt(max_attempts),
+            wait=_retry_wait,
+            retry=retry_if_exception(_is_retryable),
+            before_sleep=lambda state: logger.warning(
+                f"Fitbit request failed ({state.outcome.exception()}), retry {state.attempt_number}"),
+            reraise=True,
+        )(self._request_window)
+
+    @property
+    def request_fn(self) -> Callable[[str], dict]:
+        if self._request_fn is None:
+            from .get_fitbit_sleep import get_fitbit_auth
+            self._request_fn = fitbit_request(get_fitbit_auth())
+        return self._request_fn
+
+    def _authenticate(self):
+        """builds the default Fitbit client once up front rather than racing to do it in the worker threads"""
+        _ = self.request_fn
+
+    def _request_window(self, start: datetime.date, end: datetime.date) -> list[dict]:
+        self.bucket.acquire()
+        response = self.request_fn(f"{self.base_url}/1.2/user/-/sleep/date/{start}/{end}.json")
+        if isinstance(response, dict):
+            return response.get("sleep", [])
+        return []
+
+    def _fetch_window(self, window: tuple[datetime.date, datetime.date]) -> list[dict]:
+        start, end = window
+        logger.info(f"Fetching Fitbit sleep {start} to {end}")
+        sleep = self._request_window(start, end)
+        if self.cache is not None:
+            self.cache.put(start, end, sleep)
+        return sleep
+
+    def fetch(self, start: datetime.date, end: datetime.date) -> list[dict]:
+        """
+        :return: sleep logs between start and end (inclusive), de-duplicated by logId
+        """
+        days = [start + datetime.timedelta(days=i) for i in range((end - start).days + 1)]
+        results, missing = [], []
+        for day in days:
+            cached = self.cache.get(day) if self.cache is not None else None
+            if cached is None:
+                missing.append(day)
+            else:
+                results.append(cached)
+        logger.info(f"Fitbit sleep {start} to {end}: {len(days) - len(missing)} days cached, "
+                    f"{len(missing)} to fetch")
+
+        if missing:
+            self._authenticate()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            results.extend(pool.map(self._fetch_window, missing_windows(missing)))
+
+        logs, seen = [], set()
+        for window_logs in results:
+            for log in window_logs:
+                log_id = log.get("logId")
+                if log_id is None or log_id not in seen:
+                    seen.add(log_id)
+                    logs.append(log)
+        return sorted(logs, key=lambda log: log["startTime"])
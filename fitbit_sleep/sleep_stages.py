@@ -0,0 +1,235 @@
+"""Run-length encoded sleep-stage timelines and the hypnogram queries built on them.
+
+Every log's ``levels.data`` and ``levels.shortData`` are laid out on a 30 second epoch
+grid, the short wake blips overlaid on the long stages, and stored as runs of integer
+stage codes in ``sleep_segments``, keyed by log_id and the run's offset from the log's
+start time. Queries only ever read those integer runs, and aggregate them in SQL.
+"""
+import datetime
+import sqlite3
+import sys
+import time
+import numpy as np
+import pandas as pd
+from log_setup import logger
+from .sleep_cleaner import FITBIT_TIME_FORMAT
+
+EPOCH_SECONDS = 30  # Fitbit scores sleep in 30 second epochs
+EPOCHS_PER_HOUR = 3600 // EPOCH_SECONDS
+
+# stored stage code -> level name, the index is the code
+STAGE_NAMES = ("wake", "light", "deep", "rem", "awake", "asleep", "restless")
+STAGE_CODES = {name: code for code, name in enumerate(STAGE_NAMES)}
+
+SEGMENT_COLUMNS = ["log_id", "start_offset", "seconds", "stage", "short"]
+
+
+def _epoch_seconds(stamps: pd.Series) -> np.ndarray:
+    return pd.to_datetime(stamps, format=FITBIT_TIME_FORMAT).to_numpy(dtype="datetime64[s]").astype(np.int64)
+
+
+def _ranges(starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """concatenation of arange(start, start + length) for every pair, without a python loop"""
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return offsets + np.arange(lengths.sum())
+
+
+def encode_segments(sleep_entries: list[dict]) -> pd.DataFrame:
+    """
+    Turns the levels.data and levels.shortData timelines of raw sleep logs into stage runs.
+
+    Runs are split at every hour after the log's start time, so per-hour queries never have to cut them.
+
+    :param sleep_entries: sleep logs as returned by the Fitbit API
+    :return: DataFrame with SEGMENT_COLUMNS, one row per run of a single stage
+    """
+    log_ids, log_starts = [], []
+    segment_logs, stamps, levels, seconds, short = [], [], [], [], []
+    for entry in sleep_entries:
+        entry_levels = entry.get("levels") or {}
+        log_ids.append(entry["logId"])
+        log_starts.append(entry["startTime"])
+        for is_short, key in ((0, "data"), (1, "shortData")):
+            for segment in entry_levels.get(key) or []:
+                segment_logs.append(len(log_ids) - 1)
+                stamps.append(segment["dateTime"])
+                levels.append(segment["level"])
+                seconds.append(segment["seconds"])
+                short.append(is_short)
+    if not segment_logs:
+        return pd.DataFrame({col: pd.Series(dtype=np.int64) for col in SEGMENT_COLUMNS})
+
+    codes = pd.Series(levels).map(STAGE_CODES)
+    known = codes.notna().to_numpy()
+    if not known.all():
+        logger.warning(f"Skipping {int((~known).sum())} sleep segments with unknown levels")
+    log_ids = np.asarray(log_ids, dtype=np.int64)
+    log_start = _epoch_seconds(pd.Series(log_starts))
+    log_index = np.asarray(segment_logs, dtype=np.int64)[known]
+    offset = (_epoch_seconds(pd.Series(stamps)[known]) - log_start[log_index]) // EPOCH_SECONDS
+    epochs = np.maximum(np.rint(np.asarray(seconds)[known] / EPOCH_SECONDS).astype(np.int64), 1)
+    codes = codes.to_numpy()[known].astype(np.int8)
+    short = np.asarray(short, dtype=np.int8)[known]
+
+    # anything logged before the log's own start time is cut off
+    epochs = epochs + np.minimum(offset, 0)
+    offset = np.maximum(offset, 0)
+    inside = epochs > 0
+    log_index, offset, epochs, codes, short = (a[inside] for a in (log_index, offset, epochs, codes, short))
+
+    # one grid per log, all grids laid end to end in a single array
+    grid_length = np.zeros(len(log_ids), dtype=np.int64)
+    np.maximum.at(grid_length, log_index, offset + epochs)
+    grid_base = np.cumsum(grid_length) - grid_length
+
+    stage = np.full(grid_length.sum(), -1, dtype=np.int8)
+    blip = np.zeros(grid_length.sum(), dtype=np.int8)
+    for layer in (short == 0, short == 1):  # short wakes are painted over the long stages
+        positions = _ranges(grid_base[log_index[layer]] + offset[layer], epochs[layer])
+        stage[positions] = np.repeat(codes[layer], epochs[layer])
+        blip[positions] = np.repeat(short[layer], epochs[layer])
+
+    grid_log = np.repeat(np.arange(len(log_ids)), grid_length)
+    grid_offset = np.arange(len(stage)) - grid_base[grid_log]
+    key = stage.astype(np.int16) * 2 + blip
+    run_start = np.flatnonzero(np.r_[True, (key[1:] != key[:-1]) | (grid_offset[1:] % EPOCHS_PER_HOUR == 0)])
+    run_length = np.diff(np.r_[run_start, len(stage)])
+    filled = stage[run_start] >= 0
+    run_start, run_length = run_start[filled], run_length[filled]
+
+    return pd.DataFrame({
+        "log_id": log_ids[grid_log[run_start]],
+        "start_offset": grid_offset[run_start] * EPOCH_SECONDS,
+        "seconds": run_length * EPOCH_SECONDS,
+        "stage": stage[run_start].astype(np.int64),
+        "short": blip[run_start].astype(np.int64),
+    })
+
+
+def count_short_wakes(sleep_entries: list[dict]) -> np.ndarray:
+    """
+    number of wake blips in every log's levels.shortData, in the order of the logs
+    counted from the raw entries since the stored runs merge touching blips and split them at every hour
+    """
+    return np.array([len((entry.get("levels") or {}).get("shortData") or []) for entry in sleep_entries],
+                    dtype=np.int64)
+
+
+def store_segments(db_conn: sqlite3.Connection, segments: pd.DataFrame, log_ids: list[int]):
+    """replaces the stored runs of the given logs, to be called inside the caller's transaction"""
+    db_conn.executemany("DELETE FROM sleep_segments WHERE log_id = ?", [(int(log_id),) for log_id in log_ids])
+    db_conn.executemany(
+        f"INSERT INTO sleep_segments ({', '.join(SEGMENT_COLUMNS)}) VALUES ({', '.join('?' * len(SEGMENT_COLUMNS))})",
+        list(zip(*(segments[col].tolist() for col in SEGMENT_COLUMNS))))
+
+
+def hypnogram(db_conn: sqlite3.Connection, log_id: int) -> pd.DataFrame:
+    """
+    :return: the stage timeline of one sleep log, one row per run with start, end, stage, seconds and short
+    """
+    segments = pd.read_sql_query(
+        "SELECT fs.start_time, s.start_offset, s.seconds, s.stage, s.short "
+        "FROM sleep_segments s JOIN fitbit_sleep fs ON fs.log_id = s.log_id "
+        "WHERE s.log_id = ? ORDER BY s.start_offset",
+        db_conn, params=(int(log_id),))
+    log_start = pd.to_datetime(segments.pop("start_time"))
+    segments["start"] = log_start + pd.to_timedelta(segments.pop("start_offset"), unit="s")
+    segments["end"] = segments["start"] + pd.to_timedelta(segments["seconds"], unit="s")
+    segments["stage"] = pd.Categorical.from_codes(segments["stage"], categories=list(STAGE_NAMES))
+    return segments[["start", "end", "stage", "seconds", "short"]]
+
+
+def _night_filter(start: datetime.date | None, end: datetime.date | None, main_only: bool,
+                  *extra: str) -> tuple[str, list]:
+    """WHERE clause over fitbit_sleep fs selecting the nights between start and end (inclusive)"""
+    conditions, params = list(extra), []
+    if start is not None:
+        conditions.append("fs.date >= ?")
+        params.append(str(start))
+    if end is not None:
+        conditions.append("fs.date <= ?")
+        params.append(str(end))
+    if main_only:
+        conditions.append("fs.main_sleep = 1")
+    return (f"WHERE {' AND '.join(conditions)}" if conditions else ""), params
+
+
+def time_in_stage_by_hour(db_conn: sqlite3.Connection, start: datetime.date | None = None,
+                          end: datetime.date | None = None, main_only: bool = True) -> pd.DataFrame:
+    """
+    Average minutes spent in each stage during each hour after the start of the night.
+
+    :param main_only: leave out naps and other non-main sleeps
+    :return: DataFrame indexed by hour of night (0 = first hour) with one column per stage
+    """
+    where, params = _night_filter(start, end, main_only)
+    totals = pd.read_sql_query(
+        "SELECT s.start_offset / 3600 AS hour_of_night, s.stage, SUM(s.seconds) AS seconds "
+        f"FROM fitbit_sleep fs JOIN sleep_segments s ON s.log_id = fs.log_id {where} "
+        "GROUP BY hour_of_night, s.stage",
+        db_conn, params=params)
+    nights_where, _ = _night_filter(start, end, main_only,
+                                    "EXISTS (SELECT 1 FROM sleep_segments s WHERE s.log_id = fs.log_id)")
+    nights = db_conn.execute(f"SELECT COUNT(*) FROM fitbit_sleep fs {nights_where}", params).fetchone()[0]
+    minutes = totals.pivot(index="hour_of_night", columns="stage", values="seconds").fillna(0) / 60 / max(nights, 1)
+    minutes.columns = [STAGE_NAMES[code] for code in minutes.columns]
+    return minutes
+
+
+def stage_totals(db_conn: sqlite3.Connection, start: datetime.date | None = None,
+                 end: datetime.date | None = None, main_only: bool = True, freq: str | None = None) -> pd.DataFrame:
+    """
+    Minutes per stage and number of short wakes for every night, or averaged over periods.
+
+    :param freq: pandas offset alias such as "W" or "MS" to average the nights per period, None keeps one row per night
+    :return: DataFrame indexed by date (or period start) with one column per stage plus short_wakes
+    """
+    where, params = _night_filter(start, end, main_only)
+    totals = pd.read_sql_query(
+        "SELECT fs.date, s.stage, SUM(s.seconds) AS seconds "
+        f"FROM fitbit_sleep fs JOIN sleep_segments s ON s.log_id = fs.log_id {where} "
+        "GROUP BY fs.date, s.stage",
+        db_conn, params=params, parse_dates=["date"])
+    short_wakes = pd.read_sql_query(
+        f"SELECT fs.date, SUM(fs.short_wakes) AS short_wakes FROM fitbit_sleep fs {where} GROUP BY fs.date",
+        db_conn, params=params, parse_dates=["date"], index_col="date")
+    minutes = totals.pivot(index="date", columns="stage", values="seconds").fillna(0) / 60
+    minutes.columns = [STAGE_NAMES[code] for code in minutes.columns]
+    minutes["short_wakes"] = short_wakes["short_wakes"]
+    if freq is not None:
+        minutes = minutes.resample(freq).mean().dropna(how="all")
+    return minutes
+
+
+def benchmark(years: int = 5):
+    """encodes, stores and queries synthetic sleep logs in an in-memory database"""
+    from pathlib import Path
+    from .sleep_benchmark import synthetic_sleep_logs
+    from .sleep_cleaner import clean_sleep_data
+    from .sleep_sync import upsert_sleep_logs
+
+    logs = synthetic_sleep_logs(years * 365)
+    db_conn = sqlite3.connect(":memory:")
+    db_conn.executescript((Path(__file__).parent.parent / "sql" / "create_tables.sql").read_text())
+
+    started = time.perf_counter()
+    segments = encode_segments(logs)
+    encoded = time.perf_counter() - started
+    upsert_sleep_logs(db_conn, clean_sleep_data(logs).assign(short_wakes=count_short_wakes(logs)), segments)
+    raw_segments = sum(len(log["levels"]["data"]) + len(log["levels"]["shortData"]) for log in logs)
+    print(f"encoded {raw_segments:,} raw segments of {len(logs):,} logs into {len(segments):,} runs "
+          f"in {encoded * 1000:.1f} ms")
+
+    main_log = db_conn.execute("SELECT log_id FROM fitbit_sleep WHERE main_sleep = 1 LIMIT 1").fetchone()[0]
+    for name, query in (("hypnogram", lambda: hypnogram(db_conn, main_log)),
+                        ("time in stage by hour", lambda: time_in_stage_by_hour(db_conn)),
+                        ("nightly stage totals", lambda: stage_totals(db_conn)),
+                        ("monthly stage averages", lambda: stage_totals(db_conn, freq="MS"))):
+        started = time.perf_counter()
+        query()
+        print(f"{name:<24} {(time.perf_counter() - started) * 1000:>8.1f} ms")
+
+
+if __name__ == "__main__":
+    logger.disabled = True
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
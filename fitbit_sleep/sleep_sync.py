@@ -0,0 +1,142 @@
+import datetime
+import sqlite3
+import pandas as pd
+from log_setup import logger, span
+from sql_cmds.sql_cmds import frame_to_rows
+from .get_fitbit_sleep import SLEEP_CACHE_DIR
+from .sleep_cleaner import clean_sleep_data
+from .sleep_fetcher import SleepFetcher
+from .sleep_stages import count_short_wakes, encode_segments, store_segments
+
+SYNC_SOURCE = "fitbit_sleep"
+OVERLAP_DAYS = 3  # re-read the last few synced days, the tracker may upload or edit them late
+INITIAL_DAYS = 90  # how far back the very first sync reaches
+
+
+def sync_watermark(db_conn: sqlite3.Connection, source: str = SYNC_SOURCE) -> datetime.date | None:
+    """returns the last day fully synced for a source, None if it has never been synced"""
+    try:
+        row = db_conn.execute("SELECT watermark FROM sync_state WHERE source = ?", (source,)).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return datetime.date.fromisoformat(row[0]) if row else None
+
+
+def set_sync_watermark(db_conn: sqlite3.Connection, watermark: datetime.date, source: str = SYNC_SOURCE):
+    db_conn.execute(
+        "INSERT INTO sync_state (source, watermark, synced_at) VALUES (?, ?, CURRENT_TIMESTAMP) "
+        "ON CONFLICT(source) DO UPDATE SET watermark = excluded.watermark, synced_at = excluded.synced_at",
+        (source, watermark.isoformat()))
+
+
+def drop_legacy_sleep_table(db_conn: sqlite3.Connection) -> bool:
+    """
+    drops a fitbit_sleep table written by the old replace-everything refresh, it has no log_id to upsert on
+    :return: True if the table was dropped and has to be recreated from create_tables.sql
+    """
+    columns = [row[1] for row in db_conn.execute("PRAGMA table_info(fitbit_sleep)")]
+    if not columns or "log_id" in columns:
+        return False
+    logger.info("Dropping legacy fitbit_sleep table without log_id, it will be backfilled by the next sync")
+    with db_conn:
+        db_conn.execute("DROP TABLE fitbit_sleep")
+        try:
+            db_conn.execute("DELETE FROM sync_state WHERE source = ?", (SYNC_SOURCE,))
+        except sqlite3.OperationalError:
+            pass  # sync_state is created alongside the new fitbit_sleep table
+    return True
+
+
+def add_short_wakes_column(db_conn: sqlite3.Connection) -> bool:
+    """
+    adds fitbit_sleep.short_wakes to a table created before it existed, estimated from the stored runs:
+    short runs that do not continue a short run ending where they start. Blips that touched were merged
+    into one run, so those are counted once until the log is synced again
+    :return: True if the column was added
+    """
+    columns = [row[1] for row in db_conn.execute("PRAGMA table_info(fitbit_sleep)")]
+    if not columns or "short_wakes" in columns:
+        return False
+    logger.info("Adding fitbit_sleep.short_wakes, estimated from the stored stage runs")
+    with db_conn:
+        db_conn.execute("ALTER TABLE fitbit_sleep ADD COLUMN short_wakes INTEGER")
+        db_conn.execute("""
+            UPDATE fitbit_sleep SET short_wakes = (
+                SELECT COUNT(*) FROM sleep_segments s
+                WHERE s.log_id = fitbit_sleep.log_id AND s.short = 1 AND NOT EXISTS (
+                    SELECT 1 FROM sleep_segments p
+                    WHERE p.log_id = s.log_id AND p.short = 1 AND p.start_offset + p.seconds = s.start_offset))
+            WHERE EXISTS (SELECT 1 FROM sleep_segments s WHERE s.log_id = fitbit_sleep.log_id)""")
+    return True
+
+
+def upsert_sleep_logs(db_conn: sqlite3.Connection, cleaned: pd.DataFrame, segments: pd.DataFrame | None = None) -> int:
+    """
+    inserts cleaned sleep logs, replacing any stored row with the same log_id
+    :param segments: encoded stage runs of the logs, replacing their stored runs in the same transaction
+    :return: number of rows written
+    """
+    if cleaned.empty:
+        return 0
+    # start_time is unique too, when two logs share one the newer (higher) logId wins
+    cleaned = cleaned.sort_values("log_id").drop_duplicates("start_time", keep="last")
+    cleaned = cleaned.assign(date=cleaned["date"].astype(str))
+    columns = list(cleaned.columns)
+    rows = frame_to_rows(cleaned, columns)
+    updates = ", ".join(f"{col} = excluded.{col}" for col in columns if col != "log_id")
+    upsert = (f"INSERT INTO fitbit_sleep ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+              f"ON CONFLICT(log_id) DO UPDATE SET {updates}")
+
+    start_col = columns.index("start_time")
+    with db_conn:
+        # a log deleted and re-recorded in the app comes back with a new logId for the same start time
+        replaced = [(row[start_col], row[0]) for row in rows]
+        db_conn.executemany("DELETE FROM sleep_segments WHERE log_id IN "
+                            "(SELECT log_id FROM fitbit_sleep WHERE start_time = ? AND log_id != ?)", replaced)
+        db_conn.executemany("DELETE FROM fitbit_sleep WHERE start_time = ? AND log_id != ?", replaced)
+        db_conn.executemany(upsert, rows)
+        if segments is not None:
+            log_ids = cleaned["log_id"].tolist()
+            store_segments(db_conn, segments[segments["log_id"].isin(log_ids)], log_ids)
+    return len(rows)
+
+
+def sync_fitbit_sleep(db_conn: sqlite3.Connection, fetcher: SleepFetcher | None = None,
+                      overlap_days: int = OVERLAP_DAYS, initial_days: int = INITIAL_DAYS,
+                      today: datetime.date | None = None) -> int:
+    """
+    Fetches only the days since the last sync (plus a small overlap) and upserts them by log_id.
+
+    Rows outside the fetched range are never touched, so the stored history keeps growing.
+
+    :param db_conn: connection to a database with the fitbit_sleep and sync_state tables
+    :param fetcher: SleepFetcher to use, defaults to the authenticated client and on-disk cache
+    :param overlap_days: already synced days to fetch again
+    :param initial_days: days to fetch when nothing has been synced yet
+    :return: number of sleep logs written
+    """
+    today = today or datetime.date.today()
+    watermark = sync_watermark(db_conn)
+    if watermark is None:
+        start = today - datetime.timedelta(days=initial_days)
+    else:
+        start = min(watermark - datetime.timedelta(days=overlap_days), today)
+    logger.info(f"Syncing Fitbit sleep from {start} (last synced through {watermark})")
+
+    fetcher = fetcher or SleepFetcher(cache_dir=SLEEP_CACHE_DIR)
+    with span("fetch") as fetch_span:
+        sleep_logs = fetcher.fetch(start, today)
+        fetch_span.rows = len(sleep_logs)
+    with span("clean", rows=len(sleep_logs)):
+        cleaned = clean_sleep_data(sleep_logs)
+        if not cleaned.empty:
+            cleaned["short_wakes"] = count_short_wakes(sleep_logs)
+    with span("encode_segments", rows=len(sleep_logs)):
+        segments = encode_segments(sleep_logs)
+    with span("upsert") as upsert_span:
+        written = upsert_span.rows = upsert_sleep_logs(db_conn, cleaned, segments)
+
+    with db_conn:
+        set_sync_watermark(db_conn, today)
+    logger.info(f"Upserted {written} Fitbit sleep logs, synced through {today}")
+    return written
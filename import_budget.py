@@ -0,0 +1,85 @@
+"""Import-time budget for the project packages.
+
+Run with ``python import_budget.py``. Each package is imported in a fresh interpreter
+under ``python -X importtime``, from an empty working directory. The check fails
+when any of the following happens:
+
+- the cold import goes over BUDGET_MS
+- a module in DEFERRED_MODULES is loaded, since those must wait until first use
+- the import leaves a file behind, because importing is supposed to do no I/O
+"""
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+PROJECT_DIR = Path(__file__).parent
+PACKAGES = ("log_setup", "sql_cmds", "daylio_prep", "fitbit_sleep")
+
+# cold import of every package together, numpy and pandas account for most of it
+BUDGET_MS = 1000
+
+# heavy or side-effecting dependencies that are only imported by the code that uses them
+DEFERRED_MODULES = ("streamlit", "altair", "plotly", "fitbit", "dotenv", "tenacity", "tornado", "requests", "bcrypt")
+
+REPEATS = 5
+
+_LINE_PATTERN = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| +(\S+)$")
+
+
+def measure_import(packages: tuple[str, ...] = PACKAGES) -> tuple[dict[str, tuple[int, int]], list[str]]:
+    """
+    imports the packages in a fresh interpreter from an empty directory
+    :return: self and cumulative microseconds of every module imported, and the files left behind
+    """
+    env = {**os.environ, "PYTHONPATH": str(PROJECT_DIR), "PYTHONDONTWRITEBYTECODE": "1"}
+    with tempfile.TemporaryDirectory() as cwd:
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {', '.join(packages)}"],
+                                cwd=cwd, env=env, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"importing {', '.join(packages)} failed:\n{result.stderr}")
+        created = sorted(str(path.relative_to(cwd)) for path in Path(cwd).rglob("*"))
+    modules = {}
+    for line in result.stderr.splitlines():
+        match = _LINE_PATTERN.match(line)
+        if match:
+            modules[match.group(3)] = (int(match.group(1)), int(match.group(2)))
+    return modules, created
+
+
+def run_budget(repeats: int = REPEATS) -> list[str]:
+    """
+    :return: one message per violated rule, empty when the import path is within budget
+    """
+    runs = [measure_import() for _ in range(repeats)]
+    modules, created = runs[-1]
+    totals = [sum(modules[package][1] for package in PACKAGES) / 1000 for modules, _ in runs]
+
+    print(f"{'package (in import order)':<28}{'median ms':>12}")
+    for package in PACKAGES:
+        print(f"{package:<28}{statistics.median(run[0][package][1] for run in runs) / 1000:>12.1f}")
+    total = statistics.median(totals)
+    print(f"{'total':<28}{total:>12.1f}   budget {BUDGET_MS} ms")
+
+    print("\nslowest modules by own import time:")
+    for name, (self_us, _) in sorted(modules.items(), key=lambda item: -item[1][0])[:10]:
+        print(f"  {self_us / 1000:>8.1f} ms  {name}")
+
+    failures = []
+    if total > BUDGET_MS:
+        failures.append(f"cold import takes {total:.0f} ms, over the {BUDGET_MS} ms budget")
+    loaded = sorted({name.split(".")[0] for name in modules} & set(DEFERRED_MODULES))
+    if loaded:
+        failures.append(f"imported eagerly: {', '.join(loaded)}")
+    if created:
+        failures.append(f"files written on import: {', '.join(created)}")
+    for failure in failures:
+        print(f"FAIL  {failure}")
+    return failures
+
+
+if __name__ == "__main__":
+    sys.exit(1 if run_budget() else 0)
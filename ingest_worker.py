@@ -0,0 +1,286 @@
+"""Background ingestion worker.
+
+Runs the Daylio and Fitbit ingests in their own process so the dashboard never waits
+on a refresh. Jobs are queued on a schedule or from the app's refresh button, and the
+ingest_jobs table serves as both their status and the lock that keeps two runs from
+overlapping, see sql_cmds/ingest_jobs.py.
+
+With --user the worker ingests into that user's database shard, from the user's own
+subfolder of the pickup folder. Run one worker per user, every shard has its own job
+table and lock, so the users' ingests run side by side and never wait on each other.
+
+    python ingest_worker.py              # run forever, on the default schedule
+    python ingest_worker.py --once       # run every job once and exit, e.g. from cron
+    python ingest_worker.py --user alice # ingest into alice's shard from pickup/alice
+"""
+import argparse
+import contextvars
+import sys
+import threading
+import time
+from pathlib import Path
+from daylio_prep import (DaylioPickup, file_sha256, DaylioTable, get_table_info, create_entry_tags, create_mood_groups,
+                         configured_pickup_dir)
+from sql_cmds import (create_tables, create_views, insert_prefs, create_db_conn, apply_delta, last_watermark,
+                      pref_watermark, record_baseline, record_skipped_run, BulkLoader, ingest_pragmas,
+                      refresh_rollups, execute_sql_script, store_spans, active_shard, ensure_shard, route_to)
+from sql_cmds.db_init import create_tables_script
+from sql_cmds.ingest_jobs import (LEASE_SECONDS, enqueue_job, claim_job, heartbeat, finish_job,
+                                  requested_within, pending_jobs, picked_backup, backup_taken, record_backup)
+from fitbit_sleep import sync_fitbit_sleep, drop_legacy_sleep_table, add_short_wakes_column
+from log_setup import logger, span, record_spans
+
+POLL_SECONDS = 5
+ONCE_TIMEOUT_SECONDS = 60 * 60  # how long --once waits for its jobs while another worker holds the lock
+# seconds between scheduled runs of every job, keyed like sql_cmds.ingest_jobs.JOB_NAMES
+DEFAULT_INTERVALS = {
+    "daylio": 60 * 60,
+    "fitbit_sleep": 6 * 60 * 60,
+}
+
+
+def daylio_data_prep(job_id: int | None = None, delta: bool = True, force: bool = False):
+    """
+    Extracts today's Daylio backup and loads it into the database.
+
+    :param job_id: ingest job being run, a job queued by pickup_daemon.py ingests the file it was queued for and
+        any other job the newest backup in the pickup folder
+    :param delta: apply only the rows that changed since the last run instead of dropping and reloading every table
+    :param force: in delta mode, diff every table even if the LAST_ENTRY_CREATION_TIME watermark has not moved,
+        or the same content was ingested before
+    """
+    logger.info("Starting Daylio data extraction process...")
+
+    if delta:
+        with span("create_tables"):
+            create_tables(create_db_conn(), reset=False)
+    picked = picked_backup(create_db_conn(), job_id) if delta and job_id is not None else None
+    if picked is not None and not picked[0].exists():
+        raise FileNotFoundError(f"{picked[0]} was picked up for ingest job {job_id} but no longer exists")
+    backup_path = picked[0] if picked is not None else None
+
+    shard = active_shard()
+    if shard is None:
+        pickup = DaylioPickup(backup_path=backup_path)
+    else:
+        pickup = DaylioPickup(pickup_dir=configured_pickup_dir() / shard.username, backup_path=backup_path,
+                              work_dir=shard.root)
+    content_hash = picked[1] if picked is not None else file_sha256(pickup.pickup_path)
+    if delta and not force:
+        with create_db_conn() as db_conn:
+            taken = backup_taken(db_conn, content_hash, job_id)
+            if taken is not None:
+                record_skipped_run(db_conn, last_watermark(db_conn))
+                logger.info(f"{pickup.pickup_path.name} has the same content as {taken}, which was already "
+                            f"ingested, skipping")
+                return
+
+    with span("decode") as decode_span:
+        decoded = pickup.decode_backup_streaming()
+        decode_span.rows = sum(len(rows) for rows in decoded.values() if isinstance(rows, list))
+    with span("write_store"):
+        store = pickup.save_to_store(decoded)
+    if pickup.export_json:
+        with span("save_json"):
+            pickup.save_to_json(decoded)
+    with span("archive") as archive_span:
+        archive_span.rows = pickup.archive_snapshot(decoded).new_objects
+    # every later step reads the working store, the decoded rows would only hold on to memory
+    del decoded
+
+    logger.info(f"Daylio data extraction process completed, tables stored in {store.store_dir}")
+    data_dir = Path.cwd() / "data"
+
+    prefs = store.read_records('prefs')
+    watermark = pref_watermark(prefs)
+    if delta and not force:
+        with create_db_conn() as db_conn:
+            if watermark is not None and watermark == last_watermark(db_conn):
+                record_skipped_run(db_conn, watermark)
+                logger.info("Backup watermark unchanged since last ingest, skipping table updates")
+                return
+
+    tables = [table.strip() for table in (
+        data_dir / 'tables_needed.txt').read_text().split('\n')]
+
+    logger.info(f"Tables to be processed: {', '.join(tables)}")
+
+    daylio_tables = []
+
+    for table_name in tables:
+        if table_name == 'prefs':
+            continue
+        with span(f"table:{table_name}") as table_span:
+            column_info = get_table_info(table_name)
+            logger.info(f"Creating table {table_name} with {len(column_info)} columns")
+            daylio_table = DaylioTable.from_store(store, table_name, column_info)
+            table_span.rows = len(daylio_table.table)
+        daylio_tables.append(daylio_table)
+        if daylio_table.name == 'dayEntries':
+            columns = get_table_info('entry_tags')
+            with span("create_entry_tags") as tags_span:
+                daylio_tables.append(
+                    create_entry_tags(daylio_table, columns)
+                )
+                tags_span.rows = len(daylio_tables[-1].table)
+
+    mood_groups_columns = get_table_info('mood_groups')
+    daylio_tables.append(
+        create_mood_groups(mood_groups_columns)
+    )
+    
+    if delta:
+        db_conn = create_db_conn()
+        with ingest_pragmas(db_conn), db_conn:
+            with span("apply_delta") as delta_span:
+                result = apply_delta(db_conn, daylio_tables, watermark)
+                delta_span.rows = result.inserted + result.updated + result.deleted
+            with span("refresh_rollups") as rollup_span:
+                rollup_span.rows = refresh_rollups(db_conn)
+        logger.info(f"Delta ingest run {result.run_id} applied: {result.inserted} inserted, "
+                    f"{result.updated} updated, {result.deleted} deleted")
+    else:
+        create_tables()
+
+        db_conn = create_db_conn()
+        with ingest_pragmas(db_conn), db_conn:
+            with span("bulk_load") as load_span:
+                load_span.rows = sum(BulkLoader(db_conn).load(daylio_tables).values())
+            record_baseline(db_conn, daylio_tables, watermark)
+            with span("refresh_rollups") as rollup_span:
+                rollup_span.rows = refresh_rollups(db_conn, full=True)
+
+
+    with span("insert_prefs"):
+        insert_prefs(prefs)
+    # scheduled and manual runs of a backup the daemon skipped as a duplicate see it was taken
+    record_backup(create_db_conn(), content_hash, pickup.pickup_path, job_id)
+
+
+def update_fitbit_sleep(job_id: int | None = None):
+    logger.info("Starting Fitbit sleep data update...")
+    
+    db_conn = create_db_conn()
+    drop_legacy_sleep_table(db_conn)
+    with span("create_tables"):
+        create_tables(db_conn, reset=False)
+    add_short_wakes_column(db_conn)
+
+    written = sync_fitbit_sleep(db_conn)
+    if written == 0:
+        logger.warning("No new Fitbit sleep data found.")
+
+    logger.info("Fitbit sleep data update completed.")
+
+
+# every job is called with the id of its ingest_jobs row
+JOBS = {
+    "daylio": daylio_data_prep,
+    "fitbit_sleep": update_fitbit_sleep,
+}
+
+
+def run_job(job_id: int, job: str, trace_memory: bool = True) -> bool:
+    """
+    runs a claimed job, keeping its lease alive from a heartbeat thread, and releases the lock when done
+    the timings of its stages are stored in stage_metrics, whether it succeeded or not
+    :param trace_memory: record the peak memory of every stage, slows allocation-heavy stages down
+    :return: True if the job succeeded
+    """
+    done = threading.Event()
+
+    def keep_alive():
+        while not done.wait(LEASE_SECONDS / 5):
+            heartbeat(create_db_conn(), job_id)
+
+    logger.info(f"Running ingest job {job_id} ({job})")
+    started = time.perf_counter()
+    # run in a copy of this context, so the heartbeat goes to the same user's shard as the job
+    beater = threading.Thread(target=contextvars.copy_context().run, args=(keep_alive,),
+                              name=f"ingest-heartbeat-{job_id}", daemon=True)
+    beater.start()
+    error = None
+    with record_spans(trace_memory) as recording:
+        try:
+            with span(job):
+                JOBS[job](job_id=job_id)
+                with span("create_views"):
+                    create_views(create_db_conn())
+        except Exception as e:
+            logger.exception(f"Ingest job {job_id} ({job}) failed")
+            error = f"{type(e).__name__}: {e}"
+        finally:
+            done.set()
+            beater.join()
+    store_spans(create_db_conn(), job_id, job, recording.spans)
+    finish_job(create_db_conn(), job_id, error)
+    logger.info(f"Ingest job {job_id} ({job}) {'failed' if error else 'succeeded'} "
+                f"in {time.perf_counter() - started:.1f}s")
+    return error is None
+
+
+def schedule_due_jobs(intervals: dict[str, int]):
+    """queues every job whose last run was requested more than its interval ago"""
+    db_conn = create_db_conn()
+    for job, interval in intervals.items():
+        if not requested_within(db_conn, job, interval):
+            enqueue_job(db_conn, job, trigger='schedule')
+
+
+def run_worker(intervals: dict[str, int] = DEFAULT_INTERVALS, poll_seconds: float = POLL_SECONDS,
+               once: bool = False, trace_memory: bool = True, once_timeout: float = ONCE_TIMEOUT_SECONDS):
+    """
+    claims and runs queued jobs until interrupted
+    :param intervals: seconds between scheduled runs per job
+    :param once: queue every job, run the queue dry and return instead of looping. Jobs another worker holds
+        the lock for, or runs itself, are waited for
+    :param trace_memory: record the peak memory of every stage with tracemalloc
+    :param once_timeout: seconds --once waits for its jobs to finish
+    :raises TimeoutError: when jobs queued by --once are still pending after once_timeout
+    """
+    db_conn = create_db_conn()
+    execute_sql_script(db_conn, str(create_tables_script))
+    queued = [enqueue_job(db_conn, job) for job in intervals] if once else []
+    deadline = time.monotonic() + once_timeout
+    logger.info(f"Ingest worker started, jobs: {', '.join(f'{job} every {s}s' for job, s in intervals.items())}")
+    while True:
+        if not once:
+            schedule_due_jobs(intervals)
+        claimed = claim_job(db_conn, list(intervals))
+        if claimed is not None:
+            run_job(*claimed, trace_memory=trace_memory)
+            continue
+        if once:
+            pending = pending_jobs(db_conn, queued)
+            if not pending:
+                return
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"Jobs {pending} were still pending after {once_timeout:.0f}s")
+            logger.info(f"Waiting for jobs {pending}, another worker holds the ingest lock")
+        time.sleep(poll_seconds)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs the Daylio and Fitbit ingests in the background")
+    parser.add_argument("--once", action="store_true", help="run every job once and exit")
+    parser.add_argument("--jobs", nargs="+", choices=list(JOBS), default=list(JOBS), help="jobs this worker runs")
+    parser.add_argument("--poll", type=float, default=POLL_SECONDS, help="seconds between queue checks")
+    parser.add_argument("--timeout", type=float, default=ONCE_TIMEOUT_SECONDS,
+                        help="seconds --once waits for its jobs while another worker holds the lock")
+    parser.add_argument("--no-trace-memory", action="store_true",
+                        help="skip tracemalloc, stage metrics then have no peak memory")
+    parser.add_argument("--user", help="ingest into this user's database shard, the single database when left out")
+    args = parser.parse_args()
+    from dotenv import load_dotenv
+    load_dotenv()
+    try:
+        with route_to(args.user):
+            if args.user:
+                ensure_shard(args.user)
+            run_worker({job: DEFAULT_INTERVALS[job] for job in args.jobs}, args.poll, args.once,
+                       not args.no_trace_memory, args.timeout)
+    except KeyboardInterrupt:
+        logger.info("Ingest worker stopped")
+    except TimeoutError as error:
+        logger.error(str(error))
+        sys.exit(1)
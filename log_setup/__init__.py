@@ -1 +1,2 @@
-from .logger_instance import logger
\ No newline at end of file
+from .logger_instance import logger
+from .spans import Span, span, record_spans
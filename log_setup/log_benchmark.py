@@ -0,0 +1,64 @@
+"""Benchmark of the synchronous and the queued SQLite log handlers.
+
+Run with ``python -m log_setup.log_benchmark [records] [threads]``. Measures how long
+the logging threads spend in logger calls, which is what the pipeline and the
+Streamlit script threads pay, and the total time until every record is committed.
+"""
+import logging
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from .logging_setup import SQLiteHandler, QueuedSQLiteHandler
+
+
+def run(handler: logging.Handler, records: int, threads: int) -> tuple[list[float], float]:
+    """
+    :return: per-call latencies in seconds and the seconds until every record was committed
+    """
+    bench_logger = logging.getLogger(f"log_benchmark.{id(handler)}")
+    bench_logger.propagate = False
+    bench_logger.setLevel(logging.DEBUG)
+    bench_logger.addHandler(handler)
+    latencies = [[] for _ in range(threads)]
+
+    def log(thread_latencies: list[float]):
+        for i in range(records // threads):
+            started = time.perf_counter()
+            bench_logger.info(f"Processed table {i} with {i * 7} rows")
+            thread_latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=log, args=(thread_latencies,)) for thread_latencies in latencies]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    handler.flush()
+    total = time.perf_counter() - started
+    handler.close()
+    bench_logger.removeHandler(handler)
+    return [latency for thread_latencies in latencies for latency in thread_latencies], total
+
+
+def benchmark(records: int = 5000, threads: int = 4):
+    print(f"{records:,} records from {threads} threads")
+    print(f"{'handler':<22}{'median us':>11}{'p99 us':>10}{'max ms':>9}{'total s':>9}{'rows':>8}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, handler_class in (("SQLiteHandler", SQLiteHandler), ("QueuedSQLiteHandler", QueuedSQLiteHandler)):
+            db_path = str(Path(tmp_dir) / f"{name}.db")
+            latencies, total = run(handler_class(db_path), records, threads)
+            latencies.sort()
+            with sqlite3.connect(db_path) as conn:
+                rows = conn.execute("SELECT COUNT(*) FROM logs").fetchone()[0]
+            print(f"{name:<22}{statistics.median(latencies) * 1e6:>11.1f}"
+                  f"{latencies[int(len(latencies) * 0.99)] * 1e6:>10.1f}{latencies[-1] * 1e3:>9.2f}"
+                  f"{total:>9.2f}{rows:>8,}")
+
+
+if __name__ == "__main__":
+    benchmark(*(int(arg) for arg in sys.argv[1:3]))
@@ -1,12 +1,46 @@
 import logging
+import queue
 import sqlite3
-from datetime import datetime
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
 from logging import Handler, LogRecord
 
+INSERT_LOG = '''
+    INSERT INTO logs (created, level, message, pathname, lineno, funcname)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_FLUSH_INTERVAL = 1.0  # seconds a record may wait in the queue before its batch is written
+DEFAULT_RETENTION_DAYS = 30
+RETENTION_CHECK_SECONDS = 3600
+
+
+def record_row(record: LogRecord) -> tuple:
+    return (
+        datetime.fromtimestamp(record.created).isoformat(),
+        record.levelname,
+        record.getMessage(),
+        record.pathname,
+        record.lineno,
+        record.funcName
+    )
+
+
 class SQLiteHandler(Handler):
+    """Writes every record to the logs table as it is emitted, committing each one."""
+
     def __init__(self, db_path='app_logs.db'):
         super().__init__()
-        self.conn = sqlite3.connect(db_path)
+        self.db_path = db_path
+        self.conn = None  # opened by the first record, so setting up the logger does no I/O
+
+    def _connect(self):
+        # emit() is serialized by the handler lock, so the connection can be shared across threads
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
         self._ensure_table()
 
     def _ensure_table(self):
@@ -21,37 +55,152 @@ class SQLiteHandler(Handler):
                 funcname TEXT
             )
         ''')
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_logs_created ON logs (created)")
         self.conn.commit()
 
     def emit(self, record: LogRecord):
         try:
-            msg = self.format(record)  # only gets message, not full metadata unless included in formatter
-            self.conn.execute('''
-                INSERT INTO logs (created, level, message, pathname, lineno, funcname)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (
-                datetime.fromtimestamp(record.created).isoformat(),
-                record.levelname,
-                record.getMessage(),
-                record.pathname,
-                record.lineno,
-                record.funcName
-            ))
+            if self.conn is None:
+                self._connect()
+            self.conn.execute(INSERT_LOG, record_row(record))
             self.conn.commit()
         except Exception:
             self.handleError(record)
 
+
+class QueuedSQLiteHandler(SQLiteHandler):
+    """SQLiteHandler that never writes on the logging thread.
+
+    emit() only puts the record's row on a bounded queue. A background writer thread
+    owns the connection and inserts the rows in batches, one commit per batch, once
+    batch_size rows are waiting or flush_interval has passed. It also deletes rows
+    older than retention_days, at startup and every hour after that.
+
+    When the queue is full, overflow='drop' discards the new record and counts it,
+    and the count is written to the table as a warning. overflow='block' makes the
+    logging thread wait for room instead.
+    """
+
+    def __init__(self, db_path='app_logs.db', queue_size: int = DEFAULT_QUEUE_SIZE,
+                 batch_size: int = DEFAULT_BATCH_SIZE, flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+                 overflow: str = 'drop', retention_days: int | None = DEFAULT_RETENTION_DAYS):
+        """
+        :param queue_size: records that may wait for the writer before overflow applies
+        :param batch_size: rows written per transaction at most
+        :param flush_interval: seconds the writer waits for a batch to fill up
+        :param overflow: 'drop' or 'block', what emit does when the queue is full
+        :param retention_days: age after which rows are deleted, None keeps everything
+        """
+        super().__init__(db_path)
+        if overflow not in ('drop', 'block'):
+            raise ValueError(f"overflow must be 'drop' or 'block', not {overflow!r}")
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.retention_days = retention_days
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._next_retention = 0.0
+
+    def _start_writer(self):
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run_writer, name="sqlite-log-writer", daemon=True)
+                self._writer.start()
+
+    def emit(self, record: LogRecord):
+        try:
+            if self._writer is None:
+                self._start_writer()
+            row = record_row(record)
+            if self.overflow == 'block':
+                self._queue.put(row)
+                return
+            try:
+                self._queue.put_nowait(row)
+            except queue.Full:
+                with self._writer_lock:
+                    self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def flush(self, timeout: float = 10.0):
+        """blocks until every record emitted so far has been committed"""
+        if self._writer is None or not self._writer.is_alive():
+            return
+        written = threading.Event()
+        self._queue.put(written)
+        written.wait(timeout)
+
+    def close(self):
+        if self._writer is not None and self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join(timeout=10.0)
+        super().close()
+
+    def _run_writer(self):
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self._ensure_table()
+        stopping = False
+        while not stopping:
+            rows, waiting = [], []
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+                deadline = time.monotonic() + self.flush_interval
+                while True:
+                    if item is None:
+                        stopping = True
+                    elif isinstance(item, threading.Event):
+                        waiting.append(item)
+                    else:
+                        rows.append(item)
+                    if stopping or waiting or len(rows) >= self.batch_size:
+                        break
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                pass
+            self._write(rows)
+            for event in waiting:
+                event.set()
+        self.conn.close()
+
+    def _write(self, rows: list[tuple]):
+        with self._writer_lock:
+            dropped, self.dropped = self.dropped, 0
+        if dropped:
+            rows.append((datetime.now().isoformat(), 'WARNING', f"Dropped {dropped} log records, the log queue was full",
+                         __file__, 0, '_write'))
+        try:
+            if rows:
+                with self.conn:
+                    self.conn.executemany(INSERT_LOG, rows)
+            if self.retention_days is not None and time.monotonic() >= self._next_retention:
+                cutoff = (datetime.now() - timedelta(days=self.retention_days)).isoformat()
+                with self.conn:
+                    self.conn.execute("DELETE FROM logs WHERE created < ?", (cutoff,))
+                self._next_retention = time.monotonic() + RETENTION_CHECK_SECONDS
+        except Exception:
+            # never let a failed batch stop the writer, report it the way logging reports handler errors
+            traceback.print_exc()
+
+
 def setup_logger(name="daylio_logger", db_path='daylio_app_logs.db'):
     logger = logging.getLogger(name)
     logger.setLevel(logging.DEBUG)
+    for handler in logger.handlers:
+        handler.close()
     logger.handlers.clear()  # Avoid duplicates on reruns in Streamlit
 
     # Console Handler
     console_handler = logging.StreamHandler()
     console_handler.setFormatter(logging.Formatter('%(asctime)s [%(levelname)s] %(filename)s: %(message)s'))
-    
-    # SQLite Handler
-    sqlite_handler = SQLiteHandler(db_path=db_path)
+
+    # SQLite Handler, written from a background thread so logging never waits on a commit
+    sqlite_handler = QueuedSQLiteHandler(db_path=db_path)
     sqlite_handler.setFormatter(logging.Formatter('%(message)s'))  # Store only the message in DB
 
     logger.addHandler(console_handler)
@@ -0,0 +1,99 @@
+"""Structured timing and memory spans for the ingest pipeline stages.
+
+Wrap a stage in ``with span("decode") as s:`` and set ``s.rows`` once the row count is
+known. Inside ``record_spans(...)`` every finished span is collected with its wall
+time, CPU time and peak traced memory, ready to be stored in the stage_metrics table.
+Outside a recording a span only costs two clock reads.
+
+Peak memory comes from tracemalloc, which slows allocation-heavy code down noticeably,
+so it is only traced while a recording that asked for it is open. Peaks of nested
+spans are tracked separately, and a parent's peak always includes its children's.
+"""
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+
+
+@dataclass
+class Span:
+    stage: str
+    parent: str | None = None
+    started_at: datetime = field(default_factory=datetime.now)
+    wall_seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    peak_bytes: int | None = None  # peak traced memory above the level at the start of the span
+    rows: int | None = None
+    _start_memory: int = 0
+    _observed_peak: int = 0
+
+
+class SpanRecording:
+    """Spans finished on one thread between entering and leaving record_spans."""
+
+    def __init__(self, trace_memory: bool):
+        self.trace_memory = trace_memory
+        self.spans: list[Span] = []
+        self.open: list[Span] = []
+
+
+_local = threading.local()
+
+
+@contextmanager
+def record_spans(trace_memory: bool = True):
+    """
+    collects every span finished on this thread while the block runs
+    :param trace_memory: measure peak memory with tracemalloc, at the cost of slower allocations
+    :return: the SpanRecording, its spans are complete once the block exits
+    """
+    recording = SpanRecording(trace_memory)
+    previous = getattr(_local, "recording", None)
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    _local.recording = recording
+    try:
+        yield recording
+    finally:
+        _local.recording = previous
+        if started_tracing:
+            tracemalloc.stop()
+
+
+def _traced_peak(recording: SpanRecording) -> int:
+    """records the peak since the last reset on every open span and starts a new peak window"""
+    peak = tracemalloc.get_traced_memory()[1]
+    for open_span in recording.open:
+        open_span._observed_peak = max(open_span._observed_peak, peak)
+    tracemalloc.reset_peak()
+    return peak
+
+
+@contextmanager
+def span(stage: str, rows: int | None = None):
+    """
+    times a pipeline stage, set the yielded span's rows attribute if the count is only known at the end
+    """
+    recording = getattr(_local, "recording", None)
+    current = Span(stage, parent=recording.open[-1].stage if recording and recording.open else None, rows=rows)
+    tracing = recording is not None and recording.trace_memory and tracemalloc.is_tracing()
+    if tracing:
+        _traced_peak(recording)
+        current._start_memory = current._observed_peak = tracemalloc.get_traced_memory()[0]
+    if recording is not None:
+        recording.open.append(current)
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield current
+    finally:
+        current.wall_seconds = time.perf_counter() - wall
+        current.cpu_seconds = time.process_time() - cpu
+        if recording is not None:
+            if tracing:
+                _traced_peak(recording)
+                current.peak_bytes = current._observed_peak - current._start_memory
+            recording.open.remove(current)
+            recording.spans.append(current)
@@ -1,86 +1,49 @@
-from pathlib import Path
-from daylio_prep import DaylioPickup, DaylioTable, get_table_info, create_entry_tags, create_mood_groups
-from sql_cmds import create_tables, create_views, insert_prefs, create_db_conn
-from fitbit_sleep import get_fitbit_sleep_data, clean_sleep_data
-import json
+from sql_cmds import (create_db_conn, read_mood_rollup, read_top_tags, get_query_cache, JOB_NAMES, enqueue_job,
+                      job_status, route_session)
+import datetime
 import pandas as pd
 import streamlit as st
 import altair as alt
 
 
-def daylio_data_prep():
-    from log_setup import logger
-    logger.info("Starting Daylio data extraction process...")
-
-    pickup = DaylioPickup()
-    pickup.extract_backup()
-    pickup.save_to_json(pickup.decode_backup_to_json())
-    pickup.archive_json()
-
-    logger.info("Daylio data extraction process completed.")
-
-    data_dir = Path.cwd() / "data"
-    daylio_data_path = data_dir / "daylio.json"
-    logger.info(f"Daylio data saved to {daylio_data_path}")
-
-    daylio_data = json.loads(daylio_data_path.read_text())
-    logger.info(f"Daylio data loaded from {daylio_data_path}")
-
-    tables = [table.strip() for table in (
-        data_dir / 'tables_needed.txt').read_text().split('\n')]
-
-    logger.info(f"Tables to be processed: {", ".join(tables)}")
-
-    daylio_tables = []
-
-    for table_name in tables:
-        if table_name == 'prefs':
-            continue
-        daylio_table_df = pd.DataFrame(daylio_data[table_name])
-        column_info = get_table_info(table_name)
-        logger.info(
-            f"Creating table {table_name} with {len(daylio_table_df)} rows and {len(column_info)} columns")
-        daylio_table = DaylioTable(table_name, daylio_table_df, column_info)
-        daylio_tables.append(daylio_table)
-        if daylio_table.name == 'dayEntries':
-            columns = get_table_info('entry_tags')
-            daylio_tables.append(
-                create_entry_tags(daylio_table, columns)
-            )
-
-    mood_groups_columns = get_table_info('mood_groups')
-    daylio_tables.append(
-        create_mood_groups(mood_groups_columns)
-    )
-    
-    create_tables()
+def _age(seconds: int) -> str:
+    if seconds < 3600:
+        return f"{seconds // 60} minutes ago"
+    if seconds < 86400:
+        return f"{seconds // 3600} hours ago"
+    return f"{seconds // 86400} days ago"
 
-    for table in daylio_tables:
-        with create_db_conn() as db_conn:
-            table.to_sql(db_conn)
-            logger.info(f"Table {table.name} written to database")
-            db_conn.commit()
-            
 
-    insert_prefs(daylio_data['prefs'])
+# a refresh queued longer than this without a worker taking it means no worker serves this database
+WORKER_WAIT_SECONDS = 120
 
 
-def update_fitbit_sleep():
-    from log_setup import logger
-    logger.info("Starting Fitbit sleep data update...")
-    
-    sleep_data = get_fitbit_sleep_data()
-    if len(sleep_data) == 0:
-        logger.warning("No Fitbit sleep data found. Skipping update.")
+def show_freshness_banner(status: pd.DataFrame, worker_command: str = "python ingest_worker.py"):
+    """
+    one line on how fresh the displayed data is and what the ingest worker is doing
+    :param worker_command: command that starts a worker for the database shown
+    """
+    if status.empty:
+        st.info(f"No data has been ingested yet. Start the worker with `{worker_command}`.")
         return
-
-    cleaned_sleep_data = clean_sleep_data(sleep_data)
-
-    with create_db_conn() as db_conn:
-        cleaned_sleep_data.to_sql('fitbit_sleep', db_conn, if_exists='replace', index=False)
-        logger.info("Fitbit sleep data updated in database.")
-
-    logger.info("Fitbit sleep data update completed.")
+    parts = []
+    for row in status.itertuples():
+        synced = _age(int(row.success_age_seconds)) if pd.notna(row.success_age_seconds) else "never"
+        parts.append(f"{row.job}: last refreshed {synced}, latest run {row.status}")
+    failed = status[status["status"] == "failed"]
+    if not failed.empty:
+        st.warning(" · ".join(parts) + "\n\n" + "\n\n".join(f"{row.job} failed: {row.error}"
+                                                               for row in failed.itertuples()))
+    elif status["status"].eq("running").any():
+        st.info("Refreshing in the background, showing the last good data. " + " · ".join(parts))
+    elif (status["status"].eq("queued") & (status["request_age_seconds"] > WORKER_WAIT_SECONDS)).any():
+        st.warning(f"No ingest worker has taken the refresh yet, is one running for this database? Start it with "
+                   f"`{worker_command}`. Showing the last good data. " + " · ".join(parts))
+    elif status["status"].eq("queued").any():
+        st.info(f"Waiting for the ingest worker (`{worker_command}`), showing the last good data. "
+                + " · ".join(parts))
+    else:
+        st.caption(" · ".join(parts))
 
 
 def create_streamlit_app():
@@ -92,29 +55,49 @@ def create_streamlit_app():
     # if "user" not in st.session_state or st.session_state["user"] is None:
     #     st.warning("Please log in from the Login page.")
     #     st.stop()
+    # a logged-in user reads their own shard, without a login the single database as before
+    shard = route_session(st.session_state)
     
-    
+    # the ingest runs in ingest_worker.py, a new session only asks for a refresh and renders what is there
     if "initialized" not in st.session_state:
-        logger.info("Initializing Daylio Mood Dashboard...")
-        daylio_data_prep()
-        update_fitbit_sleep()
-        create_views()
-        logger.info("Initialization complete.")
+        logger.info("Requesting a background refresh for the new session...")
+        for job in JOB_NAMES:
+            enqueue_job(create_db_conn(), job)
         st.session_state["initialized"] = True
 
     logger.info("Generating dashboard...")
     st.title("Daylio Mood Dashboard")
-    
-    with create_db_conn() as db_conn:
-        last_update = pd.read_sql("SELECT LAST_ENTRY_CREATION_TIME from prefs", db_conn).iloc[0, 0]
+
+    query_cache = get_query_cache()
+    banner_col, refresh_col = st.columns([5, 1])
+    with banner_col:
+        worker_command = f"python ingest_worker.py --user {shard.username}" if shard else "python ingest_worker.py"
+        # not cached, the age of the last refresh is computed by the query and has to move on every rerun
+        show_freshness_banner(job_status(create_db_conn(read_only=True)), worker_command)
+    if refresh_col.button("Refresh"):
+        for job in JOB_NAMES:
+            enqueue_job(create_db_conn(), job)
+        st.rerun()
+
+    try:
+        last_update = query_cache.fetchall("SELECT LAST_ENTRY_CREATION_TIME from prefs")[0][0]
+    except IndexError:
+        st.stop()  # nothing ingested yet, the banner says so
     
     st.subheader(f"Last Data Update: {last_update}")
     
-    st.subheader("📈 Daily Mood Average (Last 90 Days)")
-    logger.info("Loading daily mood averages from database...")
-    with create_db_conn() as db_conn:
-        df_avg = pd.read_sql("SELECT * FROM v_daily_avgs", db_conn)
-    df_avg['day'] = pd.to_datetime(df_avg['day'])
+    windows = {"Last 30 Days": 30, "Last 90 Days": 90, "Last Year": 365, "All Time": None}
+    grains = {"day": "Daily", "week": "Weekly", "month": "Monthly"}
+    window_col, grain_col = st.columns(2)
+    window = window_col.selectbox("Time Window", list(windows), index=1)
+    grain = grain_col.radio("Resolution", list(grains), horizontal=True, format_func=grains.get)
+    window_start = (datetime.date.today() - datetime.timedelta(days=windows[window])
+                    if windows[window] is not None else None)
+
+    st.subheader(f"📈 {grains[grain]} Mood Average ({window})")
+    logger.info("Loading mood averages from rollups...")
+    df_avg = query_cache.call(read_mood_rollup, grain, window_start)
+    df_avg = df_avg.rename(columns={'period': 'day'})
 
     # Altair chart with trend line
     logger.info("Creating Altair chart for daily mood averages...")
@@ -135,9 +118,8 @@ def create_streamlit_app():
     # mood entries
     if st.checkbox("Show Mood Entries"):
         logger.info("Loading mood entries from database...")
-        query = "SELECT * from v_entry_details where date(day) > date('now', '-14 days') order by entry_datetime desc"
-        with create_db_conn() as conn:
-            df_moods = pd.read_sql(query, conn)
+        query = "SELECT * from v_entry_details where day >= date('now', '-13 days') order by entry_datetime desc"
+        df_moods = query_cache.read_df(query)
         
         df_moods['day'] = pd.to_datetime(df_moods['day'])
         st.subheader("📅 Mood Entries (Last 14 Days)")
@@ -146,9 +128,8 @@ def create_streamlit_app():
     
 
     st.subheader("🏷️ Top Activities (Interactive Drilldown)")
-    logger.info("Loading activity summary from database...")
-    with create_db_conn() as conn:
-        df_acts = pd.read_sql("SELECT * FROM v_activity_summary", conn)
+    logger.info("Loading activity summary from rollups...")
+    df_acts = query_cache.call(read_top_tags, window_start)
 
     # Altair requires no NaNs in category columns
     logger.info("Creating interactive activity drilldown...")
@@ -174,6 +155,10 @@ def create_streamlit_app():
 
     st.altair_chart(chart, use_container_width=True)
 
+    with st.sidebar.expander("Query cache"):
+        st.metric("Hit rate", f"{query_cache.hit_rate():.0%}")
+        st.dataframe(query_cache.stats(), hide_index=True)
+
 
 if __name__ == "__main__":
     create_streamlit_app()
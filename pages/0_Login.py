@@ -1,6 +1,6 @@
 import streamlit as st
 import bcrypt
-from sql_cmds import create_db_conn, execute_sql_command
+from sql_cmds import directory_connection, execute_sql_command, ensure_shard, user_role
 from log_setup import logger
 from streamlit_extras.switch_page_button import switch_page
 
@@ -22,21 +22,22 @@ def authenticate_user(username: str, password: str) -> bool:
     :param password: Password to authenticate
     :return: True if authentication is successful, False otherwise
     """
-    print(type(username), type(password))
-    with create_db_conn() as conn:
-        query = "SELECT password_hash FROM users WHERE username = ?"
-        result = execute_sql_command(conn, query, False, (username))
-        
-        if result:
-            stored_password = result[0][0]
-            return bcrypt.checkpw(password.encode('utf-8'), stored_password.encode('utf-8'))
-        else:
-            return False
+    query = "SELECT password_hash FROM users WHERE username = ?"
+    result = execute_sql_command(directory_connection(read_only=True), query, False, username)
+
+    if result:
+        stored_password = result[0][0]
+        return bcrypt.checkpw(password.encode('utf-8'), stored_password.encode('utf-8'))
+    else:
+        return False
 
 if st.button("Login"):
     if username and password:
         if authenticate_user(username, password):
             st.session_state["user"] = username
+            st.session_state["role"] = user_role(username)
+            # every page reads the logged-in user's own database shard from here on
+            ensure_shard(username)
             st.success("Login successful!")
             logger.info(f"User {username} logged in successfully.")
             # switch_page('Mood Dashboard')
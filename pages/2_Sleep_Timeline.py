@@ -1,10 +1,13 @@
-from sql_cmds import create_db_conn, read_sql_view_to_df
+from sql_cmds import get_query_cache, read_sql_view_to_df, route_session
+from fitbit_sleep import hypnogram, time_in_stage_by_hour
 import streamlit as st
 import plotly.express as px
 
+route_session(st.session_state)
 view = "v_sleep_main_per_day"
 
-df = read_sql_view_to_df(create_db_conn(), view)
+query_cache = get_query_cache()
+df = query_cache.call(read_sql_view_to_df, view)
 st.title("Sleep Timeline")
 
 fig_bar = px.bar(
@@ -40,4 +43,22 @@ with bar_col:
     
 with pie_col:
     st.write("This pie chart shows the proportion of different sleep quality labels.")
-    st.plotly_chart(fig_pie, use_container_width=True)
\ No newline at end of file
+    st.plotly_chart(fig_pie, use_container_width=True)
+
+st.header("Sleep Stages")
+nights = df.sort_values("date", ascending=False)
+if nights.empty:
+    st.write("No sleep-stage data has been synced yet.")
+else:
+    night = st.selectbox("Night", nights["date"].tolist())
+    night_stages = query_cache.call(hypnogram, int(nights.loc[nights["date"] == night, "log_id"].iloc[0]))
+    fig_hypnogram = px.timeline(night_stages, x_start="start", x_end="end", y="stage", color="stage",
+                                title=f"Hypnogram for {night}")
+    st.plotly_chart(fig_hypnogram, use_container_width=True)
+
+    by_hour = query_cache.call(time_in_stage_by_hour).reset_index().melt(
+        id_vars="hour_of_night", var_name="stage", value_name="minutes")
+    fig_by_hour = px.bar(by_hour, x="hour_of_night", y="minutes", color="stage",
+                         title="Average Minutes per Stage by Hour of Night",
+                         labels={"hour_of_night": "Hour of Night", "minutes": "Minutes"})
+    st.plotly_chart(fig_by_hour, use_container_width=True)
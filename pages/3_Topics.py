@@ -1,9 +1,12 @@
 
 import streamlit as st
-import sqlite3
 from datetime import datetime
-from sql_cmds import create_db_conn, execute_sql_command
+from sql_cmds import (create_db_conn, execute_sql_command, get_query_cache, route_session, read_topics, search_topics,
+                      next_cursor, highlight_html, strip_highlights)
 
+PAGE_SIZE = 20
+
+route_session(st.session_state)
 st.title("📝 Topics to Discuss")
 
 # Add a new topic
@@ -11,26 +14,38 @@ with st.form("add_topic"):
     new_topic = st.text_input("Topic (short description)")
     new_details = st.text_area("Details (optional)")
     if st.form_submit_button("Add Topic") and new_topic.strip():
-        conn = create_db_conn()
-        execute_sql_command(conn, "INSERT INTO topics (topic, details) VALUES (?, ?)", True, (new_topic.strip(), new_details.strip() or None))
+        execute_sql_command(create_db_conn(), "INSERT INTO topics (topic, details) VALUES (?, ?)", True, (new_topic.strip(), new_details.strip() or None))
         st.success("Topic added!")
 
 # View selection
 view = st.radio("View:", ["Open Topics", "Covered Topics"])
+query = st.text_input("Search topics", placeholder="Words in the topic or its details")
+covered = view == "Covered Topics"
+
+# only one page of topics is read per rerun, the cursors of the pages before it are kept to page back
+listing = (view, query.strip())
+if st.session_state.get("topics_listing") != listing:
+    st.session_state["topics_listing"] = listing
+    st.session_state["topics_cursors"] = [None]
+cursors = st.session_state["topics_cursors"]
 
-if view == "Open Topics":
-    conn = create_db_conn()
-    rows = execute_sql_command(conn, "SELECT id, topic, details, created_at FROM topics WHERE covered = 0 ORDER BY created_at DESC", False)
+query_cache = get_query_cache()
+if query.strip():
+    page = query_cache.call(search_topics, query.strip(), covered, PAGE_SIZE, cursors[-1])
+    page["date"] = page["covered_at"] if covered else page["created_at"]
+    cursor = next_cursor(page, PAGE_SIZE, key='score')
 else:
-    conn = create_db_conn()
-    rows = execute_sql_command(conn, "SELECT id, topic, details, covered_at FROM topics WHERE covered = 1 ORDER BY covered_at DESC", False)
+    page = query_cache.call(read_topics, covered, PAGE_SIZE, cursors[-1])
+    cursor = next_cursor(page, PAGE_SIZE, key='date')
 
 # Display topics
-if rows:
-    for row in rows:
-        tid, topic, details, date = row
-        with st.expander(f"{topic} ({date[:10]})"):
-            new_details = st.text_area("Details", value=details or "", key=f"details_{tid}")
+if not page.empty:
+    for row in page.itertuples():
+        tid, date = row.id, row.date
+        with st.expander(f"{strip_highlights(row.topic)} ({str(date)[:10] if date else 'undated'})"):
+            if query.strip():
+                st.markdown(highlight_html(row.details), unsafe_allow_html=True)
+            new_details = st.text_area("Details", value=strip_highlights(row.details), key=f"details_{tid}")
             col1, col2 = st.columns([1, 1])
 
             with col1:
@@ -41,6 +56,13 @@ if rows:
             with col2:
                 if view == "Open Topics":
                     if st.button("✅ Mark as Covered", key=f"cover_{tid}"):
-                        execute_sql_command(create_db_conn(), "UPDATE topics SET covered = 1, covered_at = ? WHERE id = ?", True, (datetime.now().isoformat(), tid))
+                        execute_sql_command(create_db_conn(), "UPDATE topics SET covered = 1, covered_at = ? WHERE id = ?", True, (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), tid))
 else:
     st.info("No topics to show.")
+
+previous_col, page_col, next_col = st.columns([1, 2, 1])
+if len(cursors) > 1:
+    previous_col.button("Previous page", on_click=cursors.pop)
+page_col.caption(f"Page {len(cursors)}")
+if cursor is not None:
+    next_col.button("Next page", on_click=cursors.append, args=(cursor,))
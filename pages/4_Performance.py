@@ -0,0 +1,48 @@
+from sql_cmds import get_query_cache, read_stage_metrics, JOB_NAMES, route_session
+import streamlit as st
+import altair as alt
+
+route_session(st.session_state)
+st.title("Ingest Performance")
+
+query_cache = get_query_cache()
+job = st.selectbox("Job", JOB_NAMES)
+last_runs = st.slider("Runs", min_value=5, max_value=200, value=50, step=5)
+metrics = query_cache.call(read_stage_metrics, job, last_runs)
+
+if metrics.empty:
+    st.info("No runs of this job have been recorded yet.")
+    st.stop()
+
+# the job's own span covers the whole run, every other span is one stage of it
+metrics["peak_mb"] = metrics["peak_bytes"] / 1024 ** 2
+totals = metrics[metrics["stage"] == job]
+stages = metrics[metrics["stage"] != job]
+
+st.subheader("Total Run Time")
+st.altair_chart(alt.Chart(totals).mark_line(point=True).encode(
+    x=alt.X("run_started:T", title="Run"),
+    y=alt.Y("wall_seconds:Q", title="Seconds"),
+    tooltip=["job_id", "wall_seconds", "cpu_seconds", "peak_mb"]
+), use_container_width=True)
+
+st.subheader("Stage Durations Across Runs")
+st.altair_chart(alt.Chart(stages).mark_line(point=True).encode(
+    x=alt.X("run_started:T", title="Run"),
+    y=alt.Y("wall_seconds:Q", title="Seconds"),
+    color="stage:N",
+    tooltip=["job_id", "stage", "wall_seconds", "cpu_seconds", "rows"]
+), use_container_width=True)
+
+st.subheader("Peak Memory per Stage")
+st.altair_chart(alt.Chart(stages).mark_line(point=True).encode(
+    x=alt.X("run_started:T", title="Run"),
+    y=alt.Y("peak_mb:Q", title="Peak MiB"),
+    color="stage:N",
+    tooltip=["job_id", "stage", "peak_mb", "rows"]
+), use_container_width=True)
+
+st.subheader("Latest Run")
+latest = stages[stages["job_id"] == stages["job_id"].max()]
+st.dataframe(latest[["stage", "parent", "wall_seconds", "cpu_seconds", "peak_mb", "rows"]],
+             hide_index=True, use_container_width=True)
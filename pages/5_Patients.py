@@ -0,0 +1,44 @@
+from sql_cmds import route_session, patients_of, fan_out_frame, read_mood_rollup
+import datetime
+import streamlit as st
+import altair as alt
+
+route_session(st.session_state)
+st.title("Patients")
+
+provider = st.session_state.get("user")
+if provider is None or st.session_state.get("role") != "provider":
+    st.info("Log in as a provider to see your patients.")
+    st.stop()
+
+patients = patients_of(provider)
+if not patients:
+    st.info("No patients are assigned to you yet.")
+    st.stop()
+
+windows = {"Last 30 Days": 30, "Last 90 Days": 90, "Last Year": 365, "All Time": None}
+grains = {"day": "Daily", "week": "Weekly", "month": "Monthly"}
+window_col, grain_col = st.columns(2)
+window = window_col.selectbox("Time Window", list(windows), index=2)
+grain = grain_col.radio("Resolution", list(grains), index=1, horizontal=True, format_func=grains.get)
+window_start = (datetime.date.today() - datetime.timedelta(days=windows[window])
+                if windows[window] is not None else None)
+# every patient's shard is read in parallel, through that shard's own query cache
+moods = fan_out_frame(patients, read_mood_rollup, grain, window_start)
+
+if moods.empty:
+    st.info("None of your patients have data in this time window.")
+    st.stop()
+
+st.subheader(f"Average Mood, {window}")
+st.altair_chart(alt.Chart(moods).mark_line(point=True).encode(
+    x=alt.X("period:T", title="Period"),
+    y=alt.Y("avg_mood_value:Q", title="Average Mood"),
+    color=alt.Color("user:N", title="Patient"),
+    tooltip=["user", "period", "entries", "avg_mood_value"]
+), use_container_width=True)
+
+st.subheader("Latest Period")
+latest = moods.sort_values("period").groupby("user").tail(1)
+st.dataframe(latest.rename(columns={"user": "Patient", "period": "Period", "entries": "Entries",
+                                   "avg_mood_value": "Average Mood"}), hide_index=True)
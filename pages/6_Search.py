@@ -0,0 +1,58 @@
+from sql_cmds import (route_session, create_db_conn, get_query_cache, search_entries, search_topics, count_matches,
+                      next_cursor, highlight_html)
+import time
+import streamlit as st
+
+PAGE_SIZE = 20
+
+route_session(st.session_state)
+st.title("Search")
+
+query = st.text_input("Search your journal and topics", placeholder="e.g. coffee with friends")
+scopes = {"entries_fts": "Journal", "topics_fts": "Topics"}
+scope = st.radio("In", list(scopes), horizontal=True, format_func=scopes.get)
+
+if not query.strip():
+    st.stop()
+
+# results are keyset paginated, the cursors of the pages before the current one are kept to page back
+search = (query.strip(), scope)
+if st.session_state.get("search") != search:
+    st.session_state["search"] = search
+    st.session_state["search_cursors"] = [None]
+cursors = st.session_state["search_cursors"]
+
+query_cache = get_query_cache()
+started = time.perf_counter()
+if scope == "entries_fts":
+    results = query_cache.call(search_entries, query.strip(), PAGE_SIZE, cursors[-1])
+else:
+    results = query_cache.call(search_topics, query.strip(), None, PAGE_SIZE, cursors[-1])
+# a count through the index takes a millisecond or two, it is not worth a cache entry
+matches = count_matches(create_db_conn(read_only=True), scope, query.strip())
+elapsed_ms = (time.perf_counter() - started) * 1000
+
+st.caption(f"{matches} matches in {elapsed_ms:.1f} ms")
+if results.empty:
+    st.info("Nothing matches every word of the search.")
+    st.stop()
+
+for row in results.itertuples():
+    if scope == "entries_fts":
+        mood = f" · {row.mood}" if isinstance(row.mood, str) else ""
+        st.markdown(f"**{row.date:%Y-%m-%d %H:%M}**{mood}  \n{highlight_html(row.title)}", unsafe_allow_html=True)
+        st.markdown(highlight_html(row.snippet), unsafe_allow_html=True)
+    else:
+        status = "covered" if row.covered else "open"
+        st.markdown(f"**{highlight_html(row.topic)}** · {status}, added {str(row.created_at)[:10]}",
+                    unsafe_allow_html=True)
+        st.markdown(highlight_html(row.details), unsafe_allow_html=True)
+    st.divider()
+
+cursor = next_cursor(results, PAGE_SIZE)
+previous_col, page_col, next_col = st.columns([1, 2, 1])
+if len(cursors) > 1:
+    previous_col.button("Previous page", on_click=cursors.pop)
+page_col.caption(f"Page {len(cursors)} of {max(1, -(-matches // PAGE_SIZE))}")
+if cursor is not None:
+    next_col.button("Next page", on_click=cursors.append, args=(cursor,))
@@ -0,0 +1,56 @@
+from sql_cmds import get_mood_analytics, route_session
+import streamlit as st
+import altair as alt
+import pandas as pd
+
+route_session(st.session_state)
+st.title("Mood Insights")
+
+# computed over the whole history once per ingest, every widget below only slices the cached arrays
+analytics = get_mood_analytics()
+if analytics.shape[0] == 0:
+    st.info("There are no mood entries yet.")
+    st.stop()
+
+st.subheader("What Goes With a Better Mood")
+min_entries = st.slider("Only tags on at least this many entries", min_value=1, max_value=100, value=10)
+impact = analytics.tag_impact
+impact = impact[impact["entries"] >= min_entries]
+shown = pd.concat([impact.head(15), impact.tail(15)]).drop_duplicates("tag_id")
+st.altair_chart(alt.Chart(shown).mark_bar().encode(
+    x=alt.X("difference:Q", title="Mood with the tag minus without it"),
+    y=alt.Y("tag:N", sort="-x", title="Tag"),
+    color=alt.condition("datum.difference > 0", alt.value("#4c9a2a"), alt.value("#c0392b")),
+    tooltip=["tag", "tag_group", "entries", alt.Tooltip("mood_with:Q", format=".2f"),
+             alt.Tooltip("mood_without:Q", format=".2f"), alt.Tooltip("z:Q", format=".1f")],
+), use_container_width=True)
+
+st.subheader("Tags That Go Together")
+top_n = st.slider("Most used tags", min_value=5, max_value=40, value=20, step=5)
+matrix = analytics.cooccurrence_frame(top_n).rename_axis("tag_a").reset_index().melt(
+    id_vars="tag_a", var_name="tag_b", value_name="entries")
+st.altair_chart(alt.Chart(matrix).mark_rect().encode(
+    x=alt.X("tag_b:N", sort=None, title=None),
+    y=alt.Y("tag_a:N", sort=None, title=None),
+    color=alt.Color("entries:Q", title="Entries"),
+    tooltip=["tag_a", "tag_b", "entries"],
+), use_container_width=True)
+st.dataframe(analytics.cooccurring_pairs(min_entries).head(20)[["tag_a", "tag_b", "entries", "lift"]],
+             hide_index=True)
+
+st.subheader("Rolling Mood")
+window = st.radio("Window", [7, 30, 90], horizontal=True, format_func=lambda days: f"{days} days")
+rolling = analytics.rolling((window,)).dropna(subset=[f"mean_{window}d"])
+st.altair_chart(alt.Chart(rolling).mark_line().encode(
+    x=alt.X("day:T", title="Day"),
+    y=alt.Y(f"mean_{window}d:Q", title="Average mood", scale=alt.Scale(zero=False)),
+    tooltip=["day:T", alt.Tooltip(f"mean_{window}d:Q", format=".2f"), alt.Tooltip(f"std_{window}d:Q", format=".2f")],
+), use_container_width=True)
+
+st.subheader("Longest Streaks")
+streaks = analytics.streaks()
+best_col, worst_col = st.columns(2)
+best_col.caption("Good days in a row")
+best_col.dataframe(streaks[streaks["kind"] == "best"].drop(columns="kind"), hide_index=True)
+worst_col.caption("Bad days in a row")
+worst_col.dataframe(streaks[streaks["kind"] == "worst"].drop(columns="kind"), hide_index=True)
@@ -0,0 +1,188 @@
+"""Backup pickup daemon.
+
+Watches the pickup folder (DAYLIO_PICKUP_DIR) with watchdog and queues a daylio
+ingest job as soon as a new backup_*.daylio file has finished writing. The ingest
+itself is run by ``ingest_worker.py``, which ingests exactly the file recorded for
+the job in pickup_files.
+
+A file counts as finished once SETTLE_SECONDS have passed without a filesystem event
+for it, its size stopped changing and it opens as a zip archive. Browsers that
+download to a temporary name and rename it afterwards trigger on the rename. When
+several backups finish together only the newest one is queued. Files are
+de-duplicated by content hash in the pickup_files table, so a backup downloaded twice
+or renamed is only ingested once.
+
+With --user the daemon watches that user's subfolder of the pickup folder and queues
+into the user's database shard, for an ``ingest_worker.py --user`` to run.
+
+    python pickup_daemon.py                  # watch until interrupted
+    python pickup_daemon.py --once           # queue the newest backup if it is new, then exit
+    python pickup_daemon.py --user alice     # watch pickup/alice for alice's backups
+"""
+import argparse
+import fnmatch
+import threading
+import time
+import zipfile as zf
+from pathlib import Path
+from watchdog.events import FileSystemEvent, FileSystemEventHandler
+from watchdog.observers import Observer
+from daylio_prep import configured_pickup_dir, find_newest_backup, file_sha256
+from daylio_prep.daylio_pickup import BACKUP_GLOB, backup_sort_key
+from sql_cmds import create_db_conn, execute_sql_script, ensure_shard, route_to
+from sql_cmds.db_init import create_tables_script
+from sql_cmds.ingest_jobs import enqueue_pickup
+from log_setup import logger
+
+SETTLE_SECONDS = 2.0
+POLL_SECONDS = 0.5
+
+
+def is_backup_name(path: str | Path) -> bool:
+    return fnmatch.fnmatch(Path(path).name, BACKUP_GLOB)
+
+
+def is_complete(path: Path, size: int) -> bool:
+    """
+    whether a backup finished writing, its size has to match the one seen when it settled and it has to be a readable zip
+    """
+    try:
+        return path.stat().st_size == size and zf.is_zipfile(path)
+    except OSError:
+        return False
+
+
+class BackupEventHandler(FileSystemEventHandler):
+    """Collects the backup files that were created, written to or renamed into the pickup folder."""
+
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+        self.pending: dict[Path, float] = {}  # path -> monotonic time of its last event
+
+    def _touch(self, path: str):
+        if is_backup_name(path):
+            with self.lock:
+                self.pending[Path(path)] = time.monotonic()
+
+    def on_created(self, event: FileSystemEvent):
+        if not event.is_directory:
+            self._touch(event.src_path)
+
+    def on_modified(self, event: FileSystemEvent):
+        if not event.is_directory:
+            self._touch(event.src_path)
+
+    def on_closed(self, event: FileSystemEvent):
+        self._touch(event.src_path)
+
+    def on_moved(self, event: FileSystemEvent):
+        if not event.is_directory:
+            self._touch(event.dest_path)
+
+    def settled(self, settle_seconds: float) -> list[Path]:
+        """
+        :return: pending files without an event for settle_seconds, they are no longer pending afterwards
+        """
+        cutoff = time.monotonic() - settle_seconds
+        with self.lock:
+            quiet = [path for path, last_event in self.pending.items() if last_event <= cutoff]
+            for path in quiet:
+                del self.pending[path]
+        return quiet
+
+    def retry(self, path: Path):
+        with self.lock:
+            self.pending.setdefault(path, time.monotonic())
+
+
+def queue_backup(path: Path) -> int | None:
+    """
+    queues an ingest for a finished backup
+    :return: id of the queued job, None if the same content was picked up before
+    """
+    job_id = enqueue_pickup(create_db_conn(), file_sha256(path), path)
+    if job_id is not None:
+        logger.info(f"Picked up {path.name} ({path.stat().st_size / 1e6:.1f} MB), queued ingest job {job_id}")
+    return job_id
+
+
+def process_settled(handler: BackupEventHandler, settle_seconds: float = SETTLE_SECONDS) -> int | None:
+    """
+    queues the newest of the backups that finished writing, unfinished ones are checked again later
+    :return: id of the queued job, None if nothing new was queued
+    """
+    finished = []
+    for path in handler.settled(settle_seconds):
+        if not path.exists():
+            continue
+        size = path.stat().st_size
+        # the size is read again after a short wait, a writer that paused longer than settle_seconds shows up here
+        time.sleep(min(settle_seconds, 0.2))
+        if is_complete(path, size):
+            finished.append(path)
+        else:
+            handler.retry(path)
+    if not finished:
+        return None
+    newest = max(finished, key=backup_sort_key)
+    skipped = [path.name for path in finished if path != newest]
+    if skipped:
+        logger.info(f"Only queueing the newest backup {newest.name}, skipping {', '.join(skipped)}")
+    return queue_backup(newest)
+
+
+def run_daemon(folder: Path | None = None, settle_seconds: float = SETTLE_SECONDS, poll_seconds: float = POLL_SECONDS,
+               stop: threading.Event | None = None):
+    """
+    watches the pickup folder until interrupted or until `stop` is set
+    the newest backup already in the folder is queued at startup, if it was not picked up before
+    """
+    folder = Path(folder or configured_pickup_dir())
+    if not folder.is_dir():
+        raise FileNotFoundError(f"pickup directory {folder} does not exist")
+    execute_sql_script(create_db_conn(), str(create_tables_script))
+
+    handler = BackupEventHandler()
+    observer = Observer()
+    observer.schedule(handler, str(folder), recursive=False)
+    observer.start()
+    logger.info(f"Watching {folder} for {BACKUP_GLOB} files")
+    try:
+        newest = find_newest_backup(folder)
+        if newest is not None:
+            handler.retry(newest)
+        stop = stop or threading.Event()
+        while not stop.wait(poll_seconds):
+            process_settled(handler, settle_seconds)
+    finally:
+        observer.stop()
+        observer.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Queue Daylio ingests for new backups in the pickup folder")
+    parser.add_argument("--dir", type=Path, help="folder to watch, defaults to DAYLIO_PICKUP_DIR")
+    parser.add_argument("--user", help="queue into this user's database shard, watching the user's pickup subfolder")
+    parser.add_argument("--once", action="store_true", help="queue the newest backup if it is new and exit")
+    parser.add_argument("--settle", type=float, default=SETTLE_SECONDS,
+                        help="seconds a file has to go without changes to count as finished")
+    args = parser.parse_args()
+    folder = args.dir or (configured_pickup_dir() / args.user if args.user else configured_pickup_dir())
+    with route_to(args.user):
+        if args.user:
+            ensure_shard(args.user)
+        if args.once:
+            execute_sql_script(create_db_conn(), str(create_tables_script))
+            newest = find_newest_backup(folder)
+            if newest is None:
+                logger.warning("No backup file to pick up")
+            elif not zf.is_zipfile(newest):
+                logger.warning(f"{newest.name} is not a complete backup yet")
+            else:
+                queue_backup(newest)
+        else:
+            try:
+                run_daemon(folder, args.settle)
+            except KeyboardInterrupt:
+                logger.info("Pickup daemon stopped")
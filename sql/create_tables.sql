@@ -1,17 +1,3 @@
-DROP TABLE IF EXISTS customMoods; 
-DROP TABLE IF EXISTS tags ;
-DROP TABLE IF EXISTS dayEntries ;
-DROP TABLE IF EXISTS goals ;
-DROP TABLE IF EXISTS prefs ;
-DROP TABLE IF EXISTS tag_groups ;
-DROP TABLE IF EXISTS goalEntries ;
-DROP TABLE IF EXISTS calendar ;
-DROP TABLE IF EXISTS mood_groups ;
-DROP TABLE IF EXISTS entry_tags   ;  
-DROP TABLE IF EXISTS fitbit_sleep ;
-    
-    
-    
     -- create customMoods table
 
     CREATE TABLE IF NOT EXISTS customMoods (
@@ -112,7 +98,13 @@ DROP TABLE IF EXISTS fitbit_sleep ;
         MonthYear TEXT,
         QuarterYear TEXT,
         IsWeekend BOOLEAN,
-        IsWeekday BOOLEAN
+        IsWeekday BOOLEAN,
+        DayOfYear INTEGER,
+        IsoYear INTEGER,
+        IsoWeekday INTEGER,
+        FiscalYear INTEGER,
+        FiscalQuarter INTEGER,
+        FiscalQuarterYear TEXT
     );
 
 
@@ -125,14 +117,16 @@ DROP TABLE IF EXISTS fitbit_sleep ;
 
 
 
-    CREATE TABLE entry_tags (
+    CREATE TABLE IF NOT EXISTS entry_tags (
         entry_id INTEGER,
-        tag TEXT,
-        FOREIGN KEY (entry_id) REFERENCES dayEntries(id)
+        tag INTEGER,
+        FOREIGN KEY (entry_id) REFERENCES dayEntries(id),
+        FOREIGN KEY (tag) REFERENCES tags(id)
     );
 
-CREATE TABLE fitbit_sleep (
+CREATE TABLE IF NOT EXISTS fitbit_sleep (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
+    log_id INTEGER NOT NULL UNIQUE,
     date TEXT NOT NULL,
     duration_milliseconds INTEGER,
     duration_seconds INTEGER,
@@ -162,7 +156,26 @@ CREATE TABLE fitbit_sleep (
     awake_minutes INTEGER,
     restless_count INTEGER,
     restless_minutes INTEGER,
-    sleep_log_type TEXT
+    sleep_log_type TEXT,
+    short_wakes INTEGER  -- number of levels.shortData wake blips, counted from the raw log
+);
+
+CREATE INDEX IF NOT EXISTS idx_fitbit_sleep_date ON fitbit_sleep (date);
+
+-- run-length encoded stage timeline of each sleep log, see fitbit_sleep/sleep_stages.py for the codes
+CREATE TABLE IF NOT EXISTS sleep_segments (
+    log_id INTEGER NOT NULL,
+    start_offset INTEGER NOT NULL,  -- seconds after fitbit_sleep.start_time, runs never cross an hour
+    seconds INTEGER NOT NULL,
+    stage INTEGER NOT NULL,
+    short INTEGER NOT NULL DEFAULT 0,  -- 1 for wake blips from levels.shortData
+    PRIMARY KEY (log_id, start_offset)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS sync_state (
+    source TEXT PRIMARY KEY,
+    watermark DATE NOT NULL,
+    synced_at DATETIME DEFAULT CURRENT_TIMESTAMP
 );
 
 CREATE TABLE IF NOT EXISTS topics (
@@ -183,4 +196,287 @@ CREATE TABLE IF NOT EXISTS users (
     role TEXT DEFAULT 'user',
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
     last_login DATETIME
-);
\ No newline at end of file
+);
+
+-- patients whose shards a provider may read, only kept in the directory database, see sql_cmds/shard_router.py
+CREATE TABLE IF NOT EXISTS provider_patients (
+    provider TEXT NOT NULL,
+    patient TEXT NOT NULL,
+    assigned_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (provider, patient),
+    FOREIGN KEY (provider) REFERENCES users(username),
+    FOREIGN KEY (patient) REFERENCES users(username)
+) WITHOUT ROWID;
+
+-- delta ingestion bookkeeping, kept across full reloads
+
+CREATE TABLE IF NOT EXISTS ingest_runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    mode TEXT NOT NULL,
+    watermark INTEGER,
+    inserted INTEGER DEFAULT 0,
+    updated INTEGER DEFAULT 0,
+    deleted INTEGER DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS ingest_row_hashes (
+    table_name TEXT NOT NULL,
+    pk TEXT NOT NULL,
+    row_hash TEXT NOT NULL,
+    PRIMARY KEY (table_name, pk)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS ingest_changes (
+    run_id INTEGER NOT NULL,
+    table_name TEXT NOT NULL,
+    pk TEXT NOT NULL,
+    op TEXT NOT NULL,
+    FOREIGN KEY (run_id) REFERENCES ingest_runs(id)
+);
+
+-- first appearance, last change and deletion of every synced row, see sql_cmds/row_history.py
+CREATE TABLE IF NOT EXISTS row_history (
+    table_name TEXT NOT NULL,
+    pk TEXT NOT NULL,
+    first_seen DATE NOT NULL,
+    last_changed DATE NOT NULL,
+    versions INTEGER NOT NULL DEFAULT 1,
+    deleted_on DATE,
+    PRIMARY KEY (table_name, pk)
+) WITHOUT ROWID;
+
+-- background ingestion jobs, status is 'queued', 'running', 'succeeded' or 'failed'
+-- a running job is the ingest lock, it is held for as long as its worker keeps heartbeat_at fresh
+CREATE TABLE IF NOT EXISTS ingest_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job TEXT NOT NULL,
+    trigger TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    requested_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    started_at DATETIME,
+    heartbeat_at DATETIME,
+    finished_at DATETIME,
+    worker TEXT,
+    error TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_ingest_jobs_status ON ingest_jobs (status, job);
+
+-- one row per pipeline stage of every ingest job, written by sql_cmds/stage_metrics.py
+CREATE TABLE IF NOT EXISTS stage_metrics (
+    job_id INTEGER,
+    job TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    parent TEXT,
+    started_at DATETIME NOT NULL,
+    wall_seconds REAL NOT NULL,
+    cpu_seconds REAL NOT NULL,
+    peak_bytes INTEGER,
+    rows INTEGER,
+    FOREIGN KEY (job_id) REFERENCES ingest_jobs(id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_stage_metrics_job_id ON stage_metrics (job_id);
+
+-- backup files seen by pickup_daemon.py, keyed by content so a re-downloaded or renamed copy is not ingested twice
+CREATE TABLE IF NOT EXISTS pickup_files (
+    content_hash TEXT PRIMARY KEY,
+    file_name TEXT NOT NULL,
+    file_path TEXT,  -- where the file was picked up, the job queued for it ingests exactly this file
+    size_bytes INTEGER,
+    seen_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    job_id INTEGER,
+    FOREIGN KEY (job_id) REFERENCES ingest_jobs(id)
+);
+
+
+-- pre-aggregated dashboard rollups, grain is 'day', 'week' (period = Monday) or 'month' (period = 1st)
+-- rows are rebuilt by sql_cmds/rollups.py for the days the triggers below mark as dirty
+
+CREATE TABLE IF NOT EXISTS mood_rollups (
+    grain TEXT NOT NULL,
+    period DATE NOT NULL,
+    entries INTEGER NOT NULL,
+    mood_sum INTEGER NOT NULL,
+    avg_mood_value REAL,
+    PRIMARY KEY (grain, period)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS mood_group_rollups (
+    grain TEXT NOT NULL,
+    period DATE NOT NULL,
+    mood_group_id INTEGER NOT NULL,
+    mood_group_name TEXT,
+    entries INTEGER NOT NULL,
+    PRIMARY KEY (grain, period, mood_group_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS tag_rollups (
+    grain TEXT NOT NULL,
+    period DATE NOT NULL,
+    tag_id INTEGER NOT NULL,
+    tag_name TEXT,
+    tag_group TEXT,
+    entries INTEGER NOT NULL,
+    PRIMARY KEY (grain, period, tag_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS rollup_dirty_days (
+    day DATE PRIMARY KEY
+) WITHOUT ROWID;
+
+
+-- the delta engine writes an update as a delete plus an insert, so these cover every change it makes
+-- full rewrites of a table suspend them and mark the days dirty in one pass, see rollup_triggers_suspended
+
+CREATE TRIGGER IF NOT EXISTS trg_dayEntries_insert_rollup AFTER INSERT ON dayEntries
+BEGIN
+    INSERT OR IGNORE INTO rollup_dirty_days (day) VALUES (date(NEW.date));
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_dayEntries_delete_rollup AFTER DELETE ON dayEntries
+BEGIN
+    INSERT OR IGNORE INTO rollup_dirty_days (day) VALUES (date(OLD.date));
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_dayEntries_update_rollup AFTER UPDATE ON dayEntries
+BEGIN
+    INSERT OR IGNORE INTO rollup_dirty_days (day) VALUES (date(OLD.date)), (date(NEW.date));
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_entry_tags_insert_rollup AFTER INSERT ON entry_tags
+BEGIN
+    INSERT OR IGNORE INTO rollup_dirty_days (day) SELECT date(date) FROM dayEntries WHERE id = NEW.entry_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_entry_tags_delete_rollup AFTER DELETE ON entry_tags
+BEGIN
+    INSERT OR IGNORE INTO rollup_dirty_days (day) SELECT date(date) FROM dayEntries WHERE id = OLD.entry_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_customMoods_insert_rollup AFTER INSERT ON customMoods
+BEGIN
+    INSERT OR IGNORE INTO rollup_dirty_days (day) SELECT DISTINCT date(date) FROM dayEntries WHERE mood = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_customMoods_delete_rollup AFTER DELETE ON customMoods
+BEGIN
+    INSERT OR IGNORE INTO rollup_dirty_days (day) SELECT DISTINCT date(date) FROM dayEntries WHERE mood = OLD.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_mood_groups_insert_rollup AFTER INSERT ON mood_groups
+BEGIN
+    INSERT OR IGNORE INTO rollup_dirty_days (day)
+    SELECT DISTINCT date(de.date) FROM customMoods cm JOIN dayEntries de ON de.mood = cm.id
+    WHERE cm.mood_group_id = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_mood_groups_delete_rollup AFTER DELETE ON mood_groups
+BEGIN
+    INSERT OR IGNORE INTO rollup_dirty_days (day)
+    SELECT DISTINCT date(de.date) FROM customMoods cm JOIN dayEntries de ON de.mood = cm.id
+    WHERE cm.mood_group_id = OLD.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_tags_insert_rollup AFTER INSERT ON tags
+BEGIN
+    INSERT OR IGNORE INTO rollup_dirty_days (day)
+    SELECT DISTINCT date(de.date) FROM entry_tags et JOIN dayEntries de ON de.id = et.entry_id
+    WHERE et.tag = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_tags_delete_rollup AFTER DELETE ON tags
+BEGIN
+    INSERT OR IGNORE INTO rollup_dirty_days (day)
+    SELECT DISTINCT date(de.date) FROM entry_tags et JOIN dayEntries de ON de.id = et.entry_id
+    WHERE et.tag = OLD.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_tag_groups_insert_rollup AFTER INSERT ON tag_groups
+BEGIN
+    INSERT OR IGNORE INTO rollup_dirty_days (day)
+    SELECT DISTINCT date(de.date) FROM tags t
+    JOIN entry_tags et ON et.tag = t.id
+    JOIN dayEntries de ON de.id = et.entry_id
+    WHERE t.id_tag_group = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_tag_groups_delete_rollup AFTER DELETE ON tag_groups
+BEGIN
+    INSERT OR IGNORE INTO rollup_dirty_days (day)
+    SELECT DISTINCT date(de.date) FROM tags t
+    JOIN entry_tags et ON et.tag = t.id
+    JOIN dayEntries de ON de.id = et.entry_id
+    WHERE t.id_tag_group = OLD.id;
+END;
+
+
+-- full-text search over journal notes and topics, see sql_cmds/search.py
+-- both are external-content tables, the text is only stored once and the triggers keep the index in sync
+-- with every insert, update and delete, whether it comes from an ingest or a topic edit
+
+CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5(
+    note_title, note, content='dayEntries', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS topics_fts USING fts5(
+    topic, details, content='topics', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_dayEntries_insert_fts AFTER INSERT ON dayEntries
+BEGIN
+    INSERT INTO entries_fts (rowid, note_title, note) VALUES (NEW.id, NEW.note_title, NEW.note);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_dayEntries_delete_fts AFTER DELETE ON dayEntries
+BEGIN
+    INSERT INTO entries_fts (entries_fts, rowid, note_title, note) VALUES ('delete', OLD.id, OLD.note_title, OLD.note);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_dayEntries_update_fts AFTER UPDATE OF id, note_title, note ON dayEntries
+BEGIN
+    INSERT INTO entries_fts (entries_fts, rowid, note_title, note) VALUES ('delete', OLD.id, OLD.note_title, OLD.note);
+    INSERT INTO entries_fts (rowid, note_title, note) VALUES (NEW.id, NEW.note_title, NEW.note);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_topics_insert_fts AFTER INSERT ON topics
+BEGIN
+    INSERT INTO topics_fts (rowid, topic, details) VALUES (NEW.id, NEW.topic, NEW.details);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_topics_delete_fts AFTER DELETE ON topics
+BEGIN
+    INSERT INTO topics_fts (topics_fts, rowid, topic, details) VALUES ('delete', OLD.id, OLD.topic, OLD.details);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_topics_update_fts AFTER UPDATE OF id, topic, details ON topics
+BEGIN
+    INSERT INTO topics_fts (topics_fts, rowid, topic, details) VALUES ('delete', OLD.id, OLD.topic, OLD.details);
+    INSERT INTO topics_fts (rowid, topic, details) VALUES (NEW.id, NEW.topic, NEW.details);
+END;
+
+-- the topics page lists open and covered topics newest first, one keyset page at a time. Topics without a
+-- timestamp sort as '' so the keyset comparison never meets a NULL, see sql_cmds.search.read_topics
+DROP INDEX IF EXISTS idx_topics_open;
+DROP INDEX IF EXISTS idx_topics_covered;
+CREATE INDEX IF NOT EXISTS idx_topics_open_key ON topics (covered, COALESCE(created_at, ''), id);
+CREATE INDEX IF NOT EXISTS idx_topics_covered_key ON topics (covered, COALESCE(covered_at, ''), id);
+
+-- indexes behind the view predicates and joins, checked by python -m sql_cmds.query_plans
+-- dates are stored as 'YYYY-MM-DD HH:MM:SS' text, so views filter on the bare column to use them
+
+CREATE INDEX IF NOT EXISTS idx_dayEntries_date ON dayEntries (date, datetime);
+CREATE INDEX IF NOT EXISTS idx_dayEntries_mood ON dayEntries (mood);
+-- an entry carries a tag at most once, duplicates loaded before the unique index existed are dropped once
+DELETE FROM entry_tags
+WHERE NOT EXISTS (SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_entry_tags_entry_tag')
+  AND rowid NOT IN (SELECT MIN(rowid) FROM entry_tags GROUP BY entry_id, tag);
+DROP INDEX IF EXISTS idx_entry_tags_entry_id;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_entry_tags_entry_tag ON entry_tags (entry_id, tag);
+CREATE INDEX IF NOT EXISTS idx_entry_tags_tag ON entry_tags (tag, entry_id);
+CREATE INDEX IF NOT EXISTS idx_customMoods_mood_group_id ON customMoods (mood_group_id);
+CREATE INDEX IF NOT EXISTS idx_tags_id_tag_group ON tags (id_tag_group);
+CREATE INDEX IF NOT EXISTS idx_goalEntries_goalId ON goalEntries (goalId, date);
+CREATE INDEX IF NOT EXISTS idx_calendar_Date ON calendar (Date);
+CREATE INDEX IF NOT EXISTS idx_fitbit_sleep_main ON fitbit_sleep (date, duration_minutes) WHERE sleep_type != 'nap';
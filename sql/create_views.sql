@@ -13,19 +13,17 @@ DROP VIEW IF EXISTS v_topics_summary ;
 CREATE VIEW v_activity_summary AS
 WITH ranked_activities AS (
     SELECT
-        tg.name AS [group],
-        t.name AS [activity],
-        COUNT(t.name) AS [count],
+        tag_group AS [group],
+        tag_name AS [activity],
+        SUM(entries) AS [count],
         ROW_NUMBER() OVER (
-            PARTITION BY tg.name
-            ORDER BY COUNT(t.name) DESC
+            PARTITION BY tag_group
+            ORDER BY SUM(entries) DESC
         ) AS rank
-    FROM dayEntries AS de
-    LEFT JOIN entry_tags AS et ON de.id = et.entry_id
-    LEFT JOIN tags AS t ON et.tag = t.id
-    LEFT JOIN tag_groups AS tg ON t.id_tag_group = tg.id
-    WHERE date(de.date) > date('now', '-90 days')
-    GROUP BY tg.name, t.name
+    FROM tag_rollups
+    WHERE grain = 'day'
+      AND period > date('now', '-90 days')
+    GROUP BY tag_id
 )
 SELECT [group], activity, [count]
 FROM ranked_activities
@@ -47,35 +45,31 @@ SELECT
     FROM dayEntries as de
     join customMoods as cm on de.mood = cm.id
     join mood_groups as mg on cm.mood_group_id = mg.id
-    where date(de.date) > date('now', '-90 days')
+    -- same window as date(de.date) > date('now', '-90 days'), but on the bare column so idx_dayEntries_date is used
+    where de.date >= date('now', '-89 days')
     order by de.date, de.datetime;
 
 CREATE VIEW v_daily_avgs
 AS
-Select
-day,
-round(avg(mood_value),2) as avg_mood_value
-FROM
-   ( SELECT
-       day
-    ,mood_value
-    FROM v_entry_details)
-group by day
-order by day desc;
+SELECT
+    period AS day,
+    avg_mood_value
+FROM mood_rollups
+WHERE grain = 'day'
+  AND period > date('now', '-90 days')
+ORDER BY day DESC;
 
 
 CREATE VIEW v_sleep_summary
 AS
 SELECT
-    t.name as [sleep_status],
-    COUNT(t.name) AS [count]
-FROM dayEntries AS de
-LEFT JOIN entry_tags as et on de.id = et.entry_id
-LEFT JOIN tags AS t ON et.tag = t.id
-LEFT JOIN tag_groups AS tg ON t.id_tag_group = tg.id
-where date(de.date) > date('now', '-90 days')
-AND tg.name = 'Sleep'
-group by t.name;
+    tag_name AS [sleep_status],
+    SUM(entries) AS [count]
+FROM tag_rollups
+WHERE grain = 'day'
+  AND period > date('now', '-90 days')
+  AND tag_group = 'Sleep'
+GROUP BY tag_id;
 
 CREATE VIEW v_sleep_trend
 AS
@@ -88,11 +82,12 @@ SELECT
         when t.name = 'bad sleep' then 1
         else 0
     END AS [value]
+-- CROSS JOIN pins dayEntries as the outer loop, so the date window drives the join rather than the tag ids
 FROM dayEntries AS de
-LEFT JOIN entry_tags as et on de.id = et.entry_id
-LEFT JOIN tags AS t ON et.tag = t.id
-where  t.id in (75, 76, 77, 152)
-and date(de.date) > date('now', '-90 days')
+CROSS JOIN entry_tags as et on de.id = et.entry_id
+JOIN tags AS t ON et.tag = t.id
+where  et.tag in (75, 76, 77, 152)
+and de.date >= date('now', '-89 days')
 group by de.date, t.name;
 
 CREATE VIEW v_goal_summary AS
@@ -142,6 +137,7 @@ ORDER BY g.goal_id, cal.MonthYear;
 CREATE VIEW v_sleep_main_per_day AS
 SELECT 
     [date],
+    log_id,
     duration_hours,
     CASE
         WHEN duration_hours <= 2 THEN 0
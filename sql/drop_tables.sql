@@ -0,0 +1,16 @@
+DROP TABLE IF EXISTS customMoods; 
+DROP TABLE IF EXISTS tags ;
+DROP TABLE IF EXISTS dayEntries ;
+DROP TABLE IF EXISTS entries_fts ;
+DROP TABLE IF EXISTS goals ;
+DROP TABLE IF EXISTS prefs ;
+DROP TABLE IF EXISTS tag_groups ;
+DROP TABLE IF EXISTS goalEntries ;
+DROP TABLE IF EXISTS calendar ;
+DROP TABLE IF EXISTS mood_groups ;
+DROP TABLE IF EXISTS entry_tags   ;  
+DROP TABLE IF EXISTS ingest_row_hashes ;
+DROP TABLE IF EXISTS mood_rollups ;
+DROP TABLE IF EXISTS mood_group_rollups ;
+DROP TABLE IF EXISTS tag_rollups ;
+DROP TABLE IF EXISTS rollup_dirty_days ;
@@ -1,2 +1,15 @@
 from .db_init import create_tables, create_views, insert_prefs
-from .sql_cmds import create_db_conn, read_sql_view_to_df, execute_sql_command, execute_sql_script
\ No newline at end of file
+from .sql_cmds import create_db_conn, read_sql_view_to_df, execute_sql_command, execute_sql_script
+from .connection_pool import ConnectionPool, get_connection, pool_stats, close_pools
+from .query_cache import QueryCache, get_query_cache
+from .delta_ingest import apply_delta, last_watermark, pref_watermark, record_baseline, record_skipped_run
+from .bulk_loader import BulkLoader, apply_ingest_pragmas, ingest_pragmas
+from .rollups import refresh_rollups, read_mood_rollup, read_top_tags
+from .ingest_jobs import JOB_NAMES, enqueue_job, claim_job, finish_job, job_status
+from .stage_metrics import store_spans, read_stage_metrics
+from .row_history import RowHistory, read_row_history
+from .shard_router import (route_to, route_session, active_shard, shard_for, ensure_shard, directory_connection,
+                           user_role, patients_of, assign_patient, fan_out, fan_out_frame)
+from .search import (search_entries, search_topics, count_matches, read_topics, next_cursor, ensure_search_index,
+                     highlight_html, strip_highlights)
+from .mood_analytics import MoodAnalytics, get_mood_analytics, ingest_generation
@@ -1,4 +1,5 @@
-from sql_cmds import create_db_conn, execute_sql_command
+from sql_cmds import directory_connection, ensure_shard, execute_sql_command, execute_sql_script
+from sql_cmds.db_init import create_tables_script
 from enum import Enum
 import bcrypt
 
@@ -7,14 +8,17 @@ class UserRole(Enum):
     USER = 'user'
     PROVIDER = 'provider'
 
-def add_user(username: str, name: str, password: str, role: UserRole, db_path: str = "data/daylio.db"):
-    
+def add_user(username: str, name: str, password: str, role: UserRole):
+    """adds a user to the directory database and creates the database shard their data is ingested into"""
     hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
     
     sql_cmd = "INSERT INTO users (username, name, password_hash, role) VALUES (?, ?, ?, ?)"
     user_data = (username, name, hashed_password, role.value)
     
-    execute_sql_command(create_db_conn(db_path), sql_cmd, True, user_data)
+    db_conn = directory_connection()
+    execute_sql_script(db_conn, str(create_tables_script))
+    execute_sql_command(db_conn, sql_cmd, True, user_data)
+    ensure_shard(username)
 
 # TODO: Run script to add users, create login page, and set up authentication
 if __name__ == "__main__":
@@ -39,4 +43,6 @@ if __name__ == "__main__":
             name=login["name"],
             password=login["password"],
             role=login["role"]
-        )
\ No newline at end of file
+        )
+    # providers only see the shards of the patients assigned to them, with sql_cmds.assign_patient
+    # assign_patient("therapist", "<patient username>")
\ No newline at end of file
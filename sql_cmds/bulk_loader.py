@@ -0,0 +1,136 @@
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Iterator
+from log_setup import logger, span
+
+from .sql_cmds import frame_to_rows
+from .search import search_index_suspended
+from .rollups import rollup_triggers_suspended
+
+DEFAULT_BATCH_SIZE = 5000
+
+# pragmas applied for the duration of an ingest, cache_size is negative so it is read as KiB (64 MiB)
+INGEST_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -65536,
+    'temp_store': 'MEMORY',
+}
+# stored in the database file rather than the connection, the pooled connections open every database in WAL anyway
+PERSISTENT_PRAGMAS = ('journal_mode',)
+
+
+def apply_ingest_pragmas(db_conn: sqlite3.Connection, pragmas: dict | None = None):
+    """applies ingest-time pragmas, must be called outside of an open transaction"""
+    for name, value in (INGEST_PRAGMAS if pragmas is None else pragmas).items():
+        db_conn.execute(f"PRAGMA {name} = {value}")
+        logger.debug(f"PRAGMA {name} set to {value}")
+
+
+@contextmanager
+def ingest_pragmas(db_conn: sqlite3.Connection, pragmas: dict | None = None) -> Iterator[None]:
+    """
+    applies ingest-time pragmas for the block and restores the connection's previous values after it, the pooled
+    connection of a thread serves its later queries too. Must be entered and left outside of an open transaction
+    """
+    pragmas = INGEST_PRAGMAS if pragmas is None else pragmas
+    previous = {name: db_conn.execute(f"PRAGMA {name}").fetchone()[0]
+                for name in pragmas if name not in PERSISTENT_PRAGMAS}
+    apply_ingest_pragmas(db_conn, pragmas)
+    try:
+        yield
+    finally:
+        apply_ingest_pragmas(db_conn, previous)
+
+
+class BulkLoader:
+    """Loads DaylioTables into the typed tables declared in create_tables.sql.
+
+    Every table is emptied and refilled inside a single transaction with batched
+    executemany inserts, so the PRIMARY KEY and FOREIGN KEY definitions survive
+    the load and a failure leaves the database untouched.
+    """
+
+    def __init__(self, db_conn: sqlite3.Connection, batch_size: int = DEFAULT_BATCH_SIZE,
+                 pragmas: dict | None = None):
+        self.db_conn = db_conn
+        self.batch_size = batch_size
+        self.pragmas = INGEST_PRAGMAS if pragmas is None else pragmas
+
+    def _insert_table(self, table) -> int:
+        columns = [x.name for x in table.column_info]
+        col_list = ", ".join(f'"{col}"' for col in columns)
+        placeholders = ", ".join("?" for _ in columns)
+        insert = f'INSERT INTO "{table.name}" ({col_list}) VALUES ({placeholders})'
+
+        with search_index_suspended(self.db_conn, table.name), rollup_triggers_suspended(self.db_conn, table.name):
+            self.db_conn.execute(f'DELETE FROM "{table.name}"')
+            for start in range(0, len(table.table), self.batch_size):
+                batch = table.table.iloc[start:start + self.batch_size]
+                self.db_conn.executemany(insert, frame_to_rows(batch, columns))
+        return len(table.table)
+
+    def load(self, tables: list) -> dict[str, int]:
+        """
+        writes all given tables in one transaction
+        :param tables: DaylioTable objects, written in the order given
+        :return: number of rows written per table
+        """
+        counts = {}
+        start = time.perf_counter()
+        with ingest_pragmas(self.db_conn, self.pragmas), self.db_conn:
+            for table in tables:
+                with span(f"write:{table.name}") as write_span:
+                    counts[table.name] = write_span.rows = self._insert_table(table)
+                logger.info(f"Table {table.name}: {counts[table.name]} rows loaded")
+        elapsed = time.perf_counter() - start
+        total = sum(counts.values())
+        logger.info(f"Bulk load committed {total} rows across {len(counts)} tables in {elapsed:.2f}s "
+                    f"({total / elapsed if elapsed else 0:,.0f} rows/s)")
+        return counts
+
+
+def benchmark(n_rows: int = 100_000, batch_size: int = DEFAULT_BATCH_SIZE):
+    """compares rows/sec of pandas' to_sql(if_exists='replace') against BulkLoader on synthetic dayEntries"""
+    import tempfile
+    from pathlib import Path
+    from types import SimpleNamespace
+    import numpy as np
+    import pandas as pd
+    from .sql_cmds import execute_sql_script
+
+    create_tables_script = Path(__file__).parent.parent / "sql" / "create_tables.sql"
+    rng = np.random.default_rng(0)
+    stamps = pd.to_datetime(1_500_000_000_000 + np.arange(n_rows) * 3_600_000, unit='ms')
+    df = pd.DataFrame({
+        'id': np.arange(n_rows),
+        'datetime': stamps,
+        'mood': rng.integers(1, 6, n_rows),
+        'note': np.where(rng.random(n_rows) < 0.3, 'a short journal note', None),
+        'note_title': None,
+        'date': stamps.normalize(),
+    })
+    columns = [SimpleNamespace(name=col) for col in df.columns]
+    table = SimpleNamespace(name='dayEntries', table=df, column_info=columns)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        with sqlite3.connect(Path(tmp) / "pandas.db") as db_conn:
+            start = time.perf_counter()
+            df.to_sql('dayEntries', db_conn, if_exists='replace', index=False)
+            db_conn.commit()
+            pandas_seconds = time.perf_counter() - start
+
+        db_conn = sqlite3.connect(Path(tmp) / "bulk.db")
+        execute_sql_script(db_conn, str(create_tables_script))
+        start = time.perf_counter()
+        BulkLoader(db_conn, batch_size).load([table])
+        bulk_seconds = time.perf_counter() - start
+        db_conn.close()
+
+    print(f"pandas to_sql : {n_rows / pandas_seconds:>12,.0f} rows/s ({pandas_seconds:.2f}s)")
+    print(f"BulkLoader    : {n_rows / bulk_seconds:>12,.0f} rows/s ({bulk_seconds:.2f}s)")
+
+
+if __name__ == "__main__":
+    benchmark()
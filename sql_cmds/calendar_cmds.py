@@ -1,5 +1,25 @@
+"""Rolling calendar dimension joined by the goal views.
+
+The calendar is built column-wise from a date range with the ``.dt`` accessors, and
+``extend_calendar`` only appends the days the calendar table is missing, so a daily
+ingest adds a single row instead of rebuilding years of them.
+
+Run ``python -m sql_cmds.calendar_cmds [years ...]`` to benchmark the vectorized builder
+against the original row-wise one.
+"""
+import sqlite3
+import time
 import pandas as pd
-from datetime import datetime
+from datetime import datetime, timedelta
+from log_setup import logger
+
+CALENDAR_START = '2018-01-01'
+FISCAL_YEAR_START_MONTH = 1  # 1 makes fiscal years match calendar years, e.g. 10 for October to September
+CALENDAR_COLUMNS = [
+    'TimeStamp', 'Date', 'Day', 'DayName', 'Week', 'Month', 'MonthName', 'Quarter', 'Year', 'MonthYear',
+    'QuarterYear', 'IsWeekend', 'IsWeekday', 'DayOfYear', 'IsoYear', 'IsoWeekday', 'FiscalYear', 'FiscalQuarter',
+    'FiscalQuarterYear'
+]
 
 
 def is_weekend(day: int):
@@ -16,7 +36,103 @@ def is_weekday(day: int):
         return False
 
 
-def create_rolling_calendar(start='2018-01-01', end=datetime.today().strftime('%Y-%m-%d')):
+def create_rolling_calendar(start=CALENDAR_START, end=None, fiscal_start_month: int = FISCAL_YEAR_START_MONTH):
+    """
+    :param start: first day of the calendar
+    :param end: last day of the calendar, today when None
+    :param fiscal_start_month: month the fiscal year starts in, fiscal years are named after the year they end in
+    :return: one row per day with the columns of the calendar table
+    """
+    if not 1 <= fiscal_start_month <= 12:
+        raise ValueError(f"fiscal_start_month must be between 1 and 12, not {fiscal_start_month}")
+    end = end or datetime.today().strftime('%Y-%m-%d')
+    dates = pd.Series(pd.date_range(start, end))
+    dt = dates.dt
+    iso = dt.isocalendar()
+    # strftime('%w') numbering, Sunday is 0
+    day = (dt.dayofweek + 1) % 7
+    month_name = dt.month_name()
+    year = dt.year
+    fiscal_month = (dt.month - fiscal_start_month) % 12
+    fiscal_year = year + (dt.month >= fiscal_start_month).astype(int) * (fiscal_start_month > 1)
+    fiscal_quarter = fiscal_month // 3 + 1
+
+    df = pd.DataFrame({
+        'TimeStamp': dates,
+        'Date': dates,
+        'Day': day,
+        'DayName': dt.day_name(),
+        'Week': iso['week'].astype(int),
+        'Month': dt.month,
+        'MonthName': month_name,
+        'Quarter': dt.quarter,
+        'Year': year,
+        'MonthYear': month_name + "-" + year.astype(str),
+        'QuarterYear': "Q" + dt.quarter.astype(str) + "-" + year.astype(str),
+        'IsWeekend': (day == 0) | (day == 6),
+        'IsWeekday': (day > 0) & (day < 6),
+        'DayOfYear': dt.dayofyear,
+        'IsoYear': iso['year'].astype(int),
+        'IsoWeekday': iso['day'].astype(int),
+        'FiscalYear': fiscal_year,
+        'FiscalQuarter': fiscal_quarter,
+        'FiscalQuarterYear': "FQ" + fiscal_quarter.astype(str) + "-FY" + fiscal_year.astype(str),
+    })
+    return df
+
+
+def _calendar_is_current(db_conn: sqlite3.Connection, fiscal_start_month: int) -> bool:
+    """whether the stored calendar has every column and was built with the same fiscal year start"""
+    columns = {row[1] for row in db_conn.execute("PRAGMA table_info(calendar)")}
+    if not set(CALENDAR_COLUMNS) <= columns:
+        return False
+    # the fiscal attributes only depend on the month, so twelve rows at most tell the setting apart
+    stored = set(db_conn.execute("SELECT DISTINCT Month, FiscalYear - Year, FiscalQuarter FROM calendar"))
+    expected = {(month, int(month >= fiscal_start_month > 1), (month - fiscal_start_month) % 12 // 3 + 1)
+                for month in range(1, 13)}
+    return stored <= expected
+
+
+def extend_calendar(db_conn: sqlite3.Connection, start=CALENDAR_START, end=None,
+                    fiscal_start_month: int = FISCAL_YEAR_START_MONTH) -> int:
+    """
+    appends the days between start and end that the calendar table does not have yet. The table is rebuilt
+    when it predates a column or was built with another fiscal_start_month
+    :param end: last day the calendar has to cover, today when None
+    :return: number of days added
+    """
+    if not _calendar_is_current(db_conn, fiscal_start_month):
+        logger.info("Rebuilding the calendar table for new columns or another fiscal year start")
+        with db_conn:
+            db_conn.execute("DROP TABLE IF EXISTS calendar")
+        from .db_init import create_tables_script
+        db_conn.executescript(create_tables_script.read_text())
+
+    end = pd.Timestamp(end or datetime.today().strftime('%Y-%m-%d'))
+    start = pd.Timestamp(start)
+    first, last = db_conn.execute("SELECT MIN(TimeStamp), MAX(TimeStamp) FROM calendar").fetchone()
+    if first is None:
+        missing = [(start, end)]
+    else:
+        first, last = pd.Timestamp(first), pd.Timestamp(last)
+        missing = [(start, first - timedelta(days=1)), (last + timedelta(days=1), end)]
+
+    added = 0
+    for range_start, range_end in missing:
+        if range_start > range_end:
+            continue
+        days = create_rolling_calendar(range_start, range_end, fiscal_start_month)
+        days.to_sql('calendar', db_conn, if_exists='append', index=False)
+        added += len(days)
+    db_conn.commit()
+    if added:
+        logger.info(f"Added {added} days to the calendar table")
+    return added
+
+
+def _create_rolling_calendar_rowwise(start=CALENDAR_START, end=None):
+    """the original row-by-row builder, kept as the benchmark baseline"""
+    end = end or datetime.today().strftime('%Y-%m-%d')
     df = pd.DataFrame({"TimeStamp": pd.date_range(start, end)})
     df['Date'] = pd.to_datetime(df['TimeStamp'])
     df["Day"] = df.TimeStamp.apply(lambda x: x.to_pydatetime().date().strftime('%w'))
@@ -31,3 +147,60 @@ def create_rolling_calendar(start='2018-01-01', end=datetime.today().strftime('%
     df['IsWeekend'] = df.Date.apply(lambda x: is_weekend(x.weekday()))
     df['IsWeekday'] = df.Date.apply(lambda x: is_weekday(x.weekday()))
     return df
+
+
+def benchmark(years: list[int], repeats: int = 3) -> pd.DataFrame:
+    """
+    times both builders and a daily extend of an existing calendar table over ranges ending today
+    :return: one row per range with the best of `repeats` timings in milliseconds
+    """
+    def best_ms(fn) -> float:
+        timings = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            fn()
+            timings.append((time.perf_counter() - started) * 1000)
+        return min(timings)
+
+    rows = []
+    today = datetime.today()
+    for span_years in years:
+        start = (today - timedelta(days=round(365.25 * span_years))).strftime('%Y-%m-%d')
+        rowwise = _create_rolling_calendar_rowwise(start)
+        vectorized = create_rolling_calendar(start)
+        # the old builder stored Day as a '%w' string, and passed weekday() (Monday is 0) to is_weekend,
+        # flagging Sunday and Monday, everything else has to match exactly
+        shared = [column for column in rowwise.columns if column not in ('IsWeekend', 'IsWeekday')]
+        rowwise['Day'] = rowwise['Day'].astype(int)
+        pd.testing.assert_frame_equal(rowwise[shared], vectorized[shared], check_dtype=False)
+
+        db_conn = sqlite3.connect(':memory:')
+        from .db_init import create_tables_script
+        db_conn.executescript(create_tables_script.read_text())
+        full_load_ms = best_ms(lambda: (db_conn.execute("DELETE FROM calendar"), extend_calendar(db_conn, start)))
+        yesterday = (today - timedelta(days=1)).strftime('%Y-%m-%d')
+
+        def extend_one_day():
+            db_conn.execute("DELETE FROM calendar WHERE Date > ?", (f"{yesterday} 00:00:00",))
+            extend_calendar(db_conn, start)
+        extend_ms = best_ms(extend_one_day)
+        db_conn.close()
+
+        rows.append({
+            'years': span_years,
+            'days': len(vectorized),
+            'rowwise_ms': best_ms(lambda: _create_rolling_calendar_rowwise(start)),
+            'vectorized_ms': best_ms(lambda: create_rolling_calendar(start)),
+            'full_load_ms': full_load_ms,
+            'extend_1_day_ms': extend_ms,
+        })
+    result = pd.DataFrame(rows)
+    result['speedup'] = result['rowwise_ms'] / result['vectorized_ms']
+    return result
+
+
+if __name__ == "__main__":
+    import sys
+    logger.disabled = True
+    spans = [int(arg) for arg in sys.argv[1:]] or [1, 10, 30, 50]
+    print(benchmark(spans).to_string(index=False, float_format=lambda value: f"{value:.1f}"))
@@ -0,0 +1,150 @@
+"""Per-thread pooled SQLite connections.
+
+Every thread gets one long-lived connection per database file and mode, opened on
+first use and handed back on every later request. Writer connections switch the
+database to WAL so Streamlit readers never block the ingester (and vice versa), and
+every connection waits on a busy timeout instead of failing with "database is locked".
+Pages read through ``mode=ro`` connections, which can never take a write lock.
+"""
+import sqlite3
+import threading
+from pathlib import Path
+from log_setup import logger
+
+DEFAULT_DB_PATH = "data/daylio.db"
+BUSY_TIMEOUT_SECONDS = 10.0
+STATEMENT_CACHE_SIZE = 256  # prepared statements kept per connection, least recently used are finalized first
+
+
+class PooledConnection(sqlite3.Connection):
+    """Connection owned by a ConnectionPool, close() leaves it open for the next caller on the thread."""
+
+    def close(self):
+        pass
+
+    def _close(self):
+        super().close()
+
+
+class ConnectionPool:
+    """Hands out one connection per thread to a single database file."""
+
+    def __init__(self, db_path: str | Path, read_only: bool = False, timeout: float = BUSY_TIMEOUT_SECONDS,
+                 cached_statements: int = STATEMENT_CACHE_SIZE):
+        """
+        :param db_path: database file, relative paths are resolved against the working directory
+        :param read_only: open connections with mode=ro, writes fail with sqlite3.OperationalError
+        :param timeout: seconds a statement waits on a locked database before failing
+        :param cached_statements: size of every connection's prepared-statement cache
+        """
+        self.db_path = Path(db_path).resolve()
+        self.read_only = read_only
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: dict[threading.Thread, PooledConnection] = {}
+
+    def _connect(self) -> PooledConnection:
+        if self.read_only:
+            target, uri = f"{self.db_path.as_uri()}?mode=ro", True
+        else:
+            target, uri = str(self.db_path), False
+        # check_same_thread is off only so a dead thread's connection can be closed from another one,
+        # a connection is never handed to more than one thread
+        conn = sqlite3.connect(target, timeout=self.timeout, uri=uri, factory=PooledConnection,
+                               cached_statements=self.cached_statements, check_same_thread=False)
+        if self.read_only:
+            conn.execute("PRAGMA query_only = ON")
+        else:
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
+    def _prune(self):
+        """closes the connections of threads that have exited, e.g. finished Streamlit script runs"""
+        for thread in [thread for thread in self._connections if not thread.is_alive()]:
+            self._connections.pop(thread)._close()
+
+    def connection(self) -> sqlite3.Connection:
+        """returns the calling thread's connection, opening it on first use"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            with self._lock:
+                self.hits += 1
+            return conn
+        conn = self._connect()
+        with self._lock:
+            self.misses += 1
+            self._prune()
+            self._connections[threading.current_thread()] = conn
+        self._local.conn = conn
+        logger.debug(f"Opened {'read-only' if self.read_only else 'read-write'} connection to {self.db_path}")
+        return conn
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "db_path": str(self.db_path),
+                "read_only": self.read_only,
+                "hits": self.hits,
+                "misses": self.misses,
+                "open": len(self._connections),
+            }
+
+    def close_all(self) -> int:
+        """
+        closes the calling thread's connection and those of threads that have exited. Threads that are still
+        running keep theirs, they may be in the middle of using it, it is closed once they exit
+        :return: number of connections left open by running threads
+        """
+        current = threading.current_thread()
+        with self._lock:
+            self._prune()
+            conn = self._connections.pop(current, None)
+            if conn is not None:
+                conn._close()
+            self._local.conn = None
+            return len(self._connections)
+
+
+_pools: dict[tuple[Path, bool], ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path: str | Path = DEFAULT_DB_PATH, read_only: bool = False) -> ConnectionPool:
+    key = (Path(db_path).resolve(), read_only)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(db_path, read_only)
+        return _pools[key]
+
+
+def get_connection(db_path: str | Path = DEFAULT_DB_PATH, read_only: bool = False) -> sqlite3.Connection:
+    """
+    pooled connection of the calling thread
+    :param read_only: a mode=ro connection, for pages and anything else that only reads
+    :return:
+    """
+    return get_pool(db_path, read_only).connection()
+
+
+def pool_stats() -> list[dict]:
+    """hit/miss counters and open connections of every pool"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    return [pool.stats() for pool in pools]
+
+
+def close_pools():
+    """
+    closes the calling thread's pooled connections and those of exited threads, e.g. before replacing or deleting
+    a database file, see ConnectionPool.close_all
+    """
+    with _pools_lock:
+        pools = list(_pools.values())
+    left_open = sum(pool.close_all() for pool in pools)
+    if left_open:
+        logger.warning(f"{left_open} pooled connection(s) of running threads stay open until their threads exit")
@@ -2,36 +2,68 @@ from datetime import datetime
 from log_setup import logger
 
 from .sql_cmds import create_db_conn, execute_sql_script, Path, execute_sql_command
-from .calendar_cmds import create_rolling_calendar
+from .calendar_cmds import extend_calendar
+from .search import ensure_search_index
 
 home_dir = Path(__file__).parent.parent
 data_dir = home_dir / "data"
-db_path = data_dir / "daylio.db"
 sql_dir = home_dir / "sql"
+drop_tables_script = sql_dir / "drop_tables.sql"
 create_tables_script = sql_dir / "create_tables.sql"
 create_views_script = sql_dir / "create_views.sql"
 
 
 
-def create_tables(db_conn=create_db_conn(str(db_path))):
+def migrate_entry_tags(db_conn):
+    """
+    rebuilds an entry_tags table created with a TEXT tag column, so joins against tags.id can use an index
+    :return: True if the table was rebuilt
+    """
+    columns = {row[1]: row[2] for row in db_conn.execute("PRAGMA table_info(entry_tags)")}
+    if columns.get('tag', '').upper() != 'TEXT':
+        return False
+    logger.info("Migrating entry_tags.tag from TEXT to INTEGER")
+    with db_conn:
+        db_conn.execute("ALTER TABLE entry_tags RENAME TO entry_tags_text")
+        db_conn.execute("""
+            CREATE TABLE entry_tags (
+                entry_id INTEGER,
+                tag INTEGER,
+                FOREIGN KEY (entry_id) REFERENCES dayEntries(id),
+                FOREIGN KEY (tag) REFERENCES tags(id)
+            )""")
+        db_conn.execute("INSERT INTO entry_tags (entry_id, tag) SELECT entry_id, CAST(tag AS INTEGER) FROM entry_tags_text")
+        db_conn.execute("DROP TABLE entry_tags_text")
+    return True
+
+
+def create_tables(db_conn=None, reset: bool = True):
+    db_conn = db_conn or create_db_conn()
+    if reset:
+        logger.info("Executing script to drop existing daylio tables")
+        execute_sql_script(db_conn, str(drop_tables_script))
+    else:
+        migrate_entry_tags(db_conn)
+
     logger.info("Executing script to create sql tables in db")
     execute_sql_script(db_conn, str(create_tables_script))
 
-    logger.info("Creating rolling calendar to-date and loading into sql db")
-    rolling_calendar = create_rolling_calendar()
+    logger.info("Extending the rolling calendar to-date")
+    extend_calendar(db_conn)
+
+    # a database from before the search tables gets its notes and topics indexed once
+    ensure_search_index(db_conn)
 
-    rolling_calendar.to_sql('calendar', db_conn, if_exists="replace", index=False)
-    
     db_conn.commit()
-    db_conn.close()
     
-def create_views(db_conn=create_db_conn(str(db_path))):
+def create_views(db_conn=None):
+    db_conn = db_conn or create_db_conn()
     logger.info("Executing script to create requisite views for data charting")
     execute_sql_script(db_conn, str(create_views_script))
     db_conn.commit()
-    db_conn.close()
     
-def insert_prefs(prefs_dict, db_conn=create_db_conn(str(db_path))):
+def insert_prefs(prefs_dict, db_conn=None):
+    db_conn = db_conn or create_db_conn()
     insert_query = '''
     INSERT INTO prefs 
     (AUTO_BACKUP_IS_ON, LAST_DAYS_IN_ROWS_NUMBER, DAYS_IN_ROW_LONGEST_CHAIN, LAST_ENTRY_CREATION_TIME) 
@@ -47,6 +79,5 @@ def insert_prefs(prefs_dict, db_conn=create_db_conn(str(db_path))):
     
     logger.info("Creating and inserting 'prefs' table and values")
     
+    execute_sql_command(db_conn, "DELETE FROM prefs")
     execute_sql_command(db_conn, insert_query, True, vals)
-    db_conn.commit()
-    db_conn.close()
@@ -0,0 +1,221 @@
+import hashlib
+import json
+import sqlite3
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from log_setup import logger, span
+
+from .sql_cmds import frame_to_rows
+from .row_history import record_delta_history
+from .search import search_index_suspended
+from .rollups import rollup_triggers_suspended
+
+# primary key columns for every table the delta engine keeps in sync
+PRIMARY_KEYS = {
+    'customMoods': ('id',),
+    'tags': ('id',),
+    'tag_groups': ('id',),
+    'dayEntries': ('id',),
+    'goals': ('id',),
+    'goalEntries': ('id',),
+    'entry_tags': ('entry_id', 'tag'),
+    'mood_groups': ('id',),
+}
+
+WATERMARK_PREF = 'LAST_ENTRY_CREATION_TIME'
+
+
+@dataclass
+class TableDelta:
+    """Rows that differ between a freshly built table and what is already stored"""
+    table_name: str
+    columns: list[str]
+    inserts: dict[str, tuple] = field(default_factory=dict)
+    updates: dict[str, tuple] = field(default_factory=dict)
+    deletes: list[str] = field(default_factory=list)
+    hashes: dict[str, str] = field(default_factory=dict)
+    baseline: bool = False
+
+    def __len__(self):
+        return len(self.inserts) + len(self.updates) + len(self.deletes)
+
+
+@dataclass
+class DeltaResult:
+    run_id: int
+    skipped: bool = False
+    tables: list[TableDelta] = field(default_factory=list)
+
+    @property
+    def inserted(self) -> int:
+        return sum(len(t.inserts) for t in self.tables)
+
+    @property
+    def updated(self) -> int:
+        return sum(len(t.updates) for t in self.tables)
+
+    @property
+    def deleted(self) -> int:
+        return sum(len(t.deletes) for t in self.tables)
+
+
+def pref_watermark(prefs: list[dict]) -> int | None:
+    """returns the raw LAST_ENTRY_CREATION_TIME pref (epoch ms) from the backup prefs"""
+    return next((pref['value'] for pref in prefs if pref['key'] == WATERMARK_PREF), None)
+
+
+def last_watermark(db_conn: sqlite3.Connection) -> int | None:
+    """returns the watermark of the last run that actually ingested data, if any"""
+    try:
+        row = db_conn.execute(
+            "SELECT watermark FROM ingest_runs WHERE mode != 'skipped' ORDER BY id DESC LIMIT 1"
+        ).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
+
+
+def _pk_key(row: tuple, pk_positions: list[int]) -> str:
+    return json.dumps([row[i] for i in pk_positions])
+
+
+def _row_hash(row: tuple) -> str:
+    return hashlib.blake2b(repr(row).encode('utf-8'), digest_size=16).hexdigest()
+
+
+def hash_table_rows(table) -> tuple[list[str], dict[str, tuple], dict[str, str]]:
+    """
+    converts a DaylioTable into sqlite rows keyed by primary key, along with a hash of each row
+    :return: columns, rows by key, hashes by key
+    """
+    columns = [x.name for x in table.column_info]
+    pk_positions = [columns.index(pk) for pk in PRIMARY_KEYS[table.name]]
+    rows, hashes = {}, {}
+    for row in frame_to_rows(table.table, columns):
+        key = _pk_key(row, pk_positions)
+        rows[key] = row
+        hashes[key] = _row_hash(row)
+    return columns, rows, hashes
+
+
+def _stored_hashes(db_conn: sqlite3.Connection, table_name: str) -> dict[str, str]:
+    cursor = db_conn.execute("SELECT pk, row_hash FROM ingest_row_hashes WHERE table_name = ?", (table_name,))
+    return dict(cursor.fetchall())
+
+
+def diff_table(db_conn: sqlite3.Connection, table) -> TableDelta:
+    """compares a freshly built DaylioTable against the stored row hashes"""
+    columns, rows, hashes = hash_table_rows(table)
+    stored = _stored_hashes(db_conn, table.name)
+    delta = TableDelta(table.name, columns, hashes=hashes)
+
+    if not stored:
+        # no baseline for this table yet, so every row is written from scratch
+        delta.baseline = True
+        delta.inserts = rows
+        return delta
+
+    for key, row_hash in hashes.items():
+        old_hash = stored.get(key)
+        if old_hash is None:
+            delta.inserts[key] = rows[key]
+        elif old_hash != row_hash:
+            delta.updates[key] = rows[key]
+    delta.deletes = [key for key in stored if key not in hashes]
+    return delta
+
+
+def _apply_table_delta(db_conn: sqlite3.Connection, delta: TableDelta, run_id: int):
+    pk_cols = PRIMARY_KEYS[delta.table_name]
+    table = f'"{delta.table_name}"'
+
+    # a baseline rewrites the whole table, its search index and dirty days are rebuilt once instead of row by row
+    with ExitStack() as suspended:
+        if delta.baseline:
+            suspended.enter_context(search_index_suspended(db_conn, delta.table_name))
+            suspended.enter_context(rollup_triggers_suspended(db_conn, delta.table_name))
+        if delta.baseline:
+            db_conn.execute(f"DELETE FROM {table}")
+        else:
+            where = " AND ".join(f'"{col}" = ?' for col in pk_cols)
+            removed = delta.deletes + list(delta.updates)
+            db_conn.executemany(f"DELETE FROM {table} WHERE {where}", [json.loads(key) for key in removed])
+
+        col_list = ", ".join(f'"{col}"' for col in delta.columns)
+        placeholders = ", ".join("?" for _ in delta.columns)
+        db_conn.executemany(f"INSERT INTO {table} ({col_list}) VALUES ({placeholders})",
+                            list(delta.inserts.values()) + list(delta.updates.values()))
+
+    db_conn.executemany(
+        "DELETE FROM ingest_row_hashes WHERE table_name = ? AND pk = ?",
+        [(delta.table_name, key) for key in delta.deletes])
+    db_conn.executemany(
+        "INSERT OR REPLACE INTO ingest_row_hashes (table_name, pk, row_hash) VALUES (?, ?, ?)",
+        [(delta.table_name, key, delta.hashes[key]) for key in (*delta.inserts, *delta.updates)])
+
+    changes = ([(run_id, delta.table_name, key, 'insert') for key in delta.inserts]
+               + [(run_id, delta.table_name, key, 'update') for key in delta.updates]
+               + [(run_id, delta.table_name, key, 'delete') for key in delta.deletes])
+    db_conn.executemany("INSERT INTO ingest_changes (run_id, table_name, pk, op) VALUES (?, ?, ?, ?)", changes)
+    record_delta_history(db_conn, delta)
+
+
+def _start_run(db_conn: sqlite3.Connection, mode: str, watermark: int | None) -> int:
+    cursor = db_conn.execute("INSERT INTO ingest_runs (mode, watermark) VALUES (?, ?)", (mode, watermark))
+    return cursor.lastrowid
+
+
+def record_skipped_run(db_conn: sqlite3.Connection, watermark: int | None) -> DeltaResult:
+    """logs a run that was skipped because the watermark had not moved"""
+    with db_conn:
+        run_id = _start_run(db_conn, 'skipped', watermark)
+    return DeltaResult(run_id, skipped=True)
+
+
+def apply_delta(db_conn: sqlite3.Connection, tables: list, watermark: int | None) -> DeltaResult:
+    """
+    applies only the inserts, updates and deletes between the given DaylioTables and the database,
+    recording each change in ingest_changes under a new ingest_runs entry
+    :param db_conn: connection to the daylio database
+    :param tables: DaylioTable objects to sync, tables without a known primary key are skipped
+    :param watermark: LAST_ENTRY_CREATION_TIME pref of the backup being ingested
+    :return:
+    """
+    with db_conn:
+        run_id = _start_run(db_conn, 'delta', watermark)
+        result = DeltaResult(run_id)
+        for table in tables:
+            if table.name not in PRIMARY_KEYS:
+                logger.warning(f"No primary key known for table {table.name}, skipping delta")
+                continue
+            with span(f"write:{table.name}") as write_span:
+                delta = diff_table(db_conn, table)
+                _apply_table_delta(db_conn, delta, run_id)
+                write_span.rows = len(delta)
+            result.tables.append(delta)
+            logger.info(f"Table {table.name}: {len(delta.inserts)} inserted, {len(delta.updates)} updated, "
+                        f"{len(delta.deletes)} deleted{' (baseline load)' if delta.baseline else ''}")
+        db_conn.execute("UPDATE ingest_runs SET inserted = ?, updated = ?, deleted = ? WHERE id = ?",
+                        (result.inserted, result.updated, result.deleted, run_id))
+    return result
+
+
+def record_baseline(db_conn: sqlite3.Connection, tables: list, watermark: int | None) -> int:
+    """
+    replaces the stored row hashes after a full reload so the next delta run starts from this state
+    :return: id of the logged run
+    """
+    with db_conn:
+        run_id = _start_run(db_conn, 'full', watermark)
+        inserted = 0
+        db_conn.execute("DELETE FROM ingest_row_hashes")
+        for table in tables:
+            if table.name not in PRIMARY_KEYS:
+                continue
+            _, _, hashes = hash_table_rows(table)
+            db_conn.executemany(
+                "INSERT OR REPLACE INTO ingest_row_hashes (table_name, pk, row_hash) VALUES (?, ?, ?)",
+                [(table.name, key, row_hash) for key, row_hash in hashes.items()])
+            inserted += len(hashes)
+        db_conn.execute("UPDATE ingest_runs SET inserted = ? WHERE id = ?", (inserted, run_id))
+    return run_id
@@ -0,0 +1,198 @@
+"""Status table and lock of the background ingestion jobs.
+
+The app enqueues jobs and reads their status, ``ingest_worker.py`` claims and runs
+them. At most one job is ever 'running', claiming happens inside a BEGIN IMMEDIATE
+transaction, so the running row doubles as a lock across processes. The lock is a
+lease: a worker that stops refreshing heartbeat_at, e.g. because it was killed,
+loses it after LEASE_SECONDS and its job is marked failed.
+"""
+import os
+import socket
+import sqlite3
+from pathlib import Path
+import pandas as pd
+from log_setup import logger
+
+from .db_init import create_tables_script
+from .sql_cmds import execute_sql_script
+
+LEASE_SECONDS = 300
+JOB_NAMES = ("daylio", "fitbit_sleep")  # run by ingest_worker.JOBS
+
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def enqueue_job(db_conn: sqlite3.Connection, job: str, trigger: str = 'manual') -> int:
+    """
+    requests a run of a job, unless one is already queued
+    :param trigger: 'manual' for runs requested from the app, 'schedule' for the worker's periodic runs,
+        'pickup' for new backups found by pickup_daemon.py
+    :return: id of the queued job
+    """
+    try:
+        queued = db_conn.execute("SELECT id FROM ingest_jobs WHERE job = ? AND status = 'queued'", (job,)).fetchone()
+    except sqlite3.OperationalError:
+        execute_sql_script(db_conn, str(create_tables_script))
+        queued = None
+    if queued:
+        return queued[0]
+    with db_conn:
+        cursor = db_conn.execute("INSERT INTO ingest_jobs (job, trigger) VALUES (?, ?)", (job, trigger))
+    logger.info(f"Queued {trigger} ingest job {cursor.lastrowid} ({job})")
+    return cursor.lastrowid
+
+
+def migrate_pickup_files(db_conn: sqlite3.Connection) -> bool:
+    """
+    adds pickup_files.file_path to a table created before it existed, the rows picked up until then have none
+    :return: True if the column was added
+    """
+    columns = [row[1] for row in db_conn.execute("PRAGMA table_info(pickup_files)")]
+    if not columns or "file_path" in columns:
+        return False
+    logger.info("Adding pickup_files.file_path")
+    with db_conn:
+        db_conn.execute("ALTER TABLE pickup_files ADD COLUMN file_path TEXT")
+    return True
+
+
+def enqueue_pickup(db_conn: sqlite3.Connection, content_hash: str, path: Path) -> int | None:
+    """
+    queues a daylio ingest for a newly picked up backup file, unless a file with the same content was picked up before
+    the job ingests exactly this file, see picked_backup
+    :return: id of the queued job, None for a duplicate
+    """
+    migrate_pickup_files(db_conn)
+    seen = db_conn.execute("SELECT file_name FROM pickup_files WHERE content_hash = ?", (content_hash,)).fetchone()
+    if seen:
+        logger.info(f"Skipping {path.name}, same content as the already picked up {seen[0]}")
+        return None
+    job_id = enqueue_job(db_conn, 'daylio', trigger='pickup')
+    record_backup(db_conn, content_hash, path, job_id)
+    return job_id
+
+
+def record_backup(db_conn: sqlite3.Connection, content_hash: str, path: Path, job_id: int | None):
+    """remembers which job takes a backup's content, the last job that took it wins"""
+    migrate_pickup_files(db_conn)
+    with db_conn:
+        db_conn.execute(
+            "INSERT INTO pickup_files (content_hash, file_name, file_path, size_bytes, job_id) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(content_hash) DO UPDATE SET file_name = excluded.file_name, "
+            "file_path = excluded.file_path, size_bytes = excluded.size_bytes, job_id = excluded.job_id",
+            (content_hash, path.name, str(path.resolve()), path.stat().st_size, job_id))
+
+
+def picked_backup(db_conn: sqlite3.Connection, job_id: int) -> tuple[Path, str] | None:
+    """
+    :return: path and content hash of the backup the pickup daemon queued a job for, the newest one when several
+        were picked up while it waited. None for jobs queued any other way, those take the newest backup
+    """
+    migrate_pickup_files(db_conn)
+    row = db_conn.execute(
+        "SELECT file_path, content_hash FROM pickup_files WHERE job_id = ? AND file_path IS NOT NULL "
+        "ORDER BY seen_at DESC, rowid DESC LIMIT 1", (job_id,)).fetchone()
+    return (Path(row[0]), row[1]) if row else None
+
+
+def backup_taken(db_conn: sqlite3.Connection, content_hash: str, job_id: int | None = None) -> str | None:
+    """
+    :return: name of a file with the same content that another job already ingested, or is queued to ingest.
+        None if the content is new or the job that took it failed
+    """
+    migrate_pickup_files(db_conn)
+    row = db_conn.execute(
+        "SELECT p.file_name FROM pickup_files p LEFT JOIN ingest_jobs j ON j.id = p.job_id "
+        "WHERE p.content_hash = ? AND p.job_id IS NOT ? AND COALESCE(j.status, 'succeeded') != 'failed'",
+        (content_hash, job_id)).fetchone()
+    return row[0] if row else None
+
+
+def claim_job(db_conn: sqlite3.Connection, jobs: list[str] | None = None) -> tuple[int, str] | None:
+    """
+    takes the ingest lock by moving the oldest queued job to 'running'
+    :param jobs: job names this worker can run, None for any
+    :return: (id, job) of the claimed job, None if nothing is queued or another job holds the lock
+    """
+    db_conn.execute("BEGIN IMMEDIATE")
+    try:
+        expired = db_conn.execute(
+            "UPDATE ingest_jobs SET status = 'failed', finished_at = CURRENT_TIMESTAMP, "
+            "error = 'worker stopped sending heartbeats' "
+            f"WHERE status = 'running' AND heartbeat_at < datetime('now', '-{LEASE_SECONDS} seconds')").rowcount
+        if expired:
+            logger.warning(f"Released the ingest lock of {expired} abandoned job(s)")
+        if db_conn.execute("SELECT 1 FROM ingest_jobs WHERE status = 'running'").fetchone():
+            db_conn.execute("COMMIT")
+            return None
+        job_filter = f" AND job IN ({', '.join('?' * len(jobs))})" if jobs is not None else ""
+        claimed = db_conn.execute(
+            f"SELECT id, job FROM ingest_jobs WHERE status = 'queued'{job_filter} ORDER BY id LIMIT 1",
+            jobs or ()).fetchone()
+        if claimed:
+            db_conn.execute(
+                "UPDATE ingest_jobs SET status = 'running', started_at = CURRENT_TIMESTAMP, "
+                "heartbeat_at = CURRENT_TIMESTAMP, worker = ? WHERE id = ?", (worker_name(), claimed[0]))
+        db_conn.execute("COMMIT")
+    except BaseException:
+        db_conn.execute("ROLLBACK")
+        raise
+    return tuple(claimed) if claimed else None
+
+
+def heartbeat(db_conn: sqlite3.Connection, job_id: int):
+    with db_conn:
+        db_conn.execute("UPDATE ingest_jobs SET heartbeat_at = CURRENT_TIMESTAMP WHERE id = ? AND status = 'running'",
+                        (job_id,))
+
+
+def finish_job(db_conn: sqlite3.Connection, job_id: int, error: str | None = None):
+    """releases the ingest lock, recording the job as failed when an error is given"""
+    with db_conn:
+        db_conn.execute(
+            "UPDATE ingest_jobs SET status = ?, finished_at = CURRENT_TIMESTAMP, error = ? WHERE id = ?",
+            ('failed' if error else 'succeeded', error, job_id))
+
+
+def pending_jobs(db_conn: sqlite3.Connection, job_ids: list[int]) -> list[int]:
+    """:return: ids of the given jobs that are still queued or running"""
+    if not job_ids:
+        return []
+    rows = db_conn.execute(
+        f"SELECT id FROM ingest_jobs WHERE id IN ({', '.join('?' * len(job_ids))}) "
+        "AND status IN ('queued', 'running') ORDER BY id", job_ids)
+    return [row[0] for row in rows]
+
+
+def requested_within(db_conn: sqlite3.Connection, job: str, seconds: int) -> bool:
+    """whether a run of a job has been requested in the last `seconds`, whatever became of it"""
+    return db_conn.execute(
+        f"SELECT 1 FROM ingest_jobs WHERE job = ? AND requested_at >= datetime('now', '-{int(seconds)} seconds')",
+        (job,)).fetchone() is not None
+
+
+def job_status(db_conn: sqlite3.Connection) -> pd.DataFrame:
+    """
+    :return: one row per job with the latest run's status and error, how many seconds ago it was requested, the
+        finish time (UTC) of the last successful run and how many seconds ago that was. Empty before the first job
+        was queued
+    """
+    try:
+        return pd.read_sql_query('''
+            SELECT job, status, error, last_success,
+                   CAST((julianday('now') - julianday(last_success)) * 86400 AS INTEGER) AS success_age_seconds,
+                   CAST((julianday('now') - julianday(requested_at)) * 86400 AS INTEGER) AS request_age_seconds
+            FROM (
+                SELECT j.job, j.status, j.error, j.requested_at,
+                       (SELECT MAX(s.finished_at) FROM ingest_jobs s
+                        WHERE s.job = j.job AND s.status = 'succeeded') AS last_success
+                FROM ingest_jobs j
+                WHERE j.id = (SELECT MAX(l.id) FROM ingest_jobs l WHERE l.job = j.job)
+            )
+            ORDER BY job
+        ''', db_conn, parse_dates=['last_success'])
+    except pd.errors.DatabaseError:
+        return pd.DataFrame(columns=['job', 'status', 'error', 'last_success', 'success_age_seconds',
+                                     'request_age_seconds'])
@@ -0,0 +1,339 @@
+"""Mood analytics over the whole history, computed in NumPy.
+
+Every entry's mood value and every (entry, tag) pair of entry_tags are read once into
+arrays, the tags as a sparse incidence matrix in coordinate form: one row index and
+one column index per pair. scipy is not a dependency, so the matrix products are
+bincounts over those index arrays, which only ever touch the pairs that exist:
+
+- tag impact: the average mood of the entries with a tag against those without it
+- co-occurrence: how often two tags are on the same entry, and the lift over chance
+- rolling statistics of the daily average mood
+- the longest runs of good and of bad days
+
+``get_mood_analytics`` keeps one MoodAnalytics per database and builds a new one only
+when the ingest generation moves, i.e. after an ingest or backfill that wrote rows.
+Skipped ingests and topic edits keep the cached results.
+
+Run ``python -m sql_cmds.mood_analytics [years ...]`` to time it against the same
+numbers computed with SQL joins on synthetic histories.
+"""
+import sqlite3
+import threading
+from functools import cached_property
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from log_setup import logger
+
+from .connection_pool import get_connection
+from .shard_router import active_db_path
+
+# daily average moods at or above / at or below these count towards good and bad streaks
+GOOD_DAY_MOOD = 4.0
+BAD_DAY_MOOD = 2.0
+ROLLING_WINDOWS = (7, 30)
+
+
+def ingest_generation(db_conn: sqlite3.Connection) -> int:
+    """:return: id of the last ingest run that wrote rows, 0 before the first one"""
+    return db_conn.execute("SELECT COALESCE(MAX(id), 0) FROM ingest_runs WHERE mode != 'skipped'").fetchone()[0]
+
+
+def _runs(mask: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """:return: start index and length of every run of True in a boolean array"""
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    return starts, np.flatnonzero(edges == -1) - starts
+
+
+class MoodAnalytics:
+    """Mood values and entry tags of one database, and the statistics computed from them."""
+
+    def __init__(self, db_conn: sqlite3.Connection, generation: int | None = None):
+        self.generation = ingest_generation(db_conn) if generation is None else generation
+        entries = pd.read_sql_query('''
+            SELECT de.id, de.date, cm.mood_value
+            FROM dayEntries de JOIN customMoods cm ON cm.id = de.mood
+            WHERE cm.mood_value IS NOT NULL
+            ORDER BY de.id
+        ''', db_conn)
+        tags = pd.read_sql_query('''
+            SELECT t.id, t.name, tg.name AS tag_group
+            FROM tags t LEFT JOIN tag_groups tg ON tg.id = t.id_tag_group
+            ORDER BY t.id
+        ''', db_conn)
+        pairs = np.array(db_conn.execute("SELECT entry_id, tag FROM entry_tags").fetchall(), dtype=np.int64).reshape(-1, 2)
+
+        self.entry_ids = entries['id'].to_numpy(np.int64)
+        self.days = pd.to_datetime(entries['date'].str[:10]).to_numpy().astype('datetime64[D]')
+        self.moods = entries['mood_value'].to_numpy(np.float64)
+        self.tag_ids = tags['id'].to_numpy(np.int64)
+        self.tag_names = tags['name'].to_numpy(object)
+        self.tag_groups = tags['tag_group'].to_numpy(object)
+
+        # pairs of entries without a mood or of unknown tags are dropped, repeated pairs count once
+        rows = np.searchsorted(self.entry_ids, pairs[:, 0])
+        cols = np.searchsorted(self.tag_ids, pairs[:, 1])
+        known = ((rows < len(self.entry_ids)) & (cols < len(self.tag_ids))
+                 & (self.entry_ids[np.minimum(rows, len(self.entry_ids) - 1)] == pairs[:, 0])
+                 & (self.tag_ids[np.minimum(cols, len(self.tag_ids) - 1)] == pairs[:, 1]))
+        cells = np.unique(rows[known] * len(self.tag_ids) + cols[known])
+        self.rows, self.cols = np.divmod(cells, max(len(self.tag_ids), 1))
+        logger.info(f"Mood analytics loaded: {len(self.entry_ids)} entries, {len(self.tag_ids)} tags, "
+                    f"{len(cells)} tagged pairs, generation {self.generation}")
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return len(self.entry_ids), len(self.tag_ids)
+
+    def _tag_frame(self, index: np.ndarray) -> pd.DataFrame:
+        return pd.DataFrame({'tag_id': self.tag_ids[index], 'tag': self.tag_names[index],
+                             'tag_group': self.tag_groups[index]})
+
+    @cached_property
+    def tag_impact(self) -> pd.DataFrame:
+        """
+        average mood of the entries with each tag against the entries without it, most positive first
+        z is the difference over its standard error, |z| above 2 is unlikely to be chance
+        """
+        n_entries, n_tags = self.shape
+        tagged_moods = self.moods[self.rows]
+        with_count = np.bincount(self.cols, minlength=n_tags).astype(np.float64)
+        with_sum = np.bincount(self.cols, weights=tagged_moods, minlength=n_tags)
+        with_squares = np.bincount(self.cols, weights=tagged_moods ** 2, minlength=n_tags)
+        without_count = n_entries - with_count
+        without_sum = self.moods.sum() - with_sum
+        without_squares = (self.moods ** 2).sum() - with_squares
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            with_mean = with_sum / with_count
+            without_mean = without_sum / without_count
+            with_var = with_squares / with_count - with_mean ** 2
+            without_var = without_squares / without_count - without_mean ** 2
+            error = np.sqrt(np.maximum(with_var, 0) / with_count + np.maximum(without_var, 0) / without_count)
+            difference = with_mean - without_mean
+            z = np.where(error > 0, difference / error, np.nan)
+
+        used = np.flatnonzero(with_count > 0)
+        impact = self._tag_frame(used).assign(
+            entries=with_count[used].astype(np.int64), mood_with=with_mean[used], mood_without=without_mean[used],
+            difference=difference[used], z=z[used])
+        return impact.sort_values(['difference', 'entries'], ascending=[False, False], ignore_index=True)
+
+    @cached_property
+    def cooccurrence(self) -> np.ndarray:
+        """
+        tags x tags matrix of the number of entries two tags share, the diagonal is every tag's own count
+        the product of the incidence matrix with its transpose, built from the pairs of tags on every entry
+        """
+        n_tags = self.shape[1]
+        # the pairs are sorted by entry, every entry's tags are a contiguous group
+        group_sizes = np.bincount(self.rows, minlength=self.shape[0])
+        group_sizes = group_sizes[group_sizes > 0]
+        group_starts = np.repeat(np.cumsum(group_sizes) - group_sizes, group_sizes)
+        sizes = np.repeat(group_sizes, group_sizes)
+        # every tag of an entry is paired with every tag of the same entry, itself included
+        first = np.repeat(np.arange(len(self.cols)), sizes)
+        offsets = np.arange(len(first)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        second = np.repeat(group_starts, sizes) + offsets
+        counts = np.bincount(self.cols[first] * n_tags + self.cols[second], minlength=n_tags * n_tags)
+        return counts.reshape(n_tags, n_tags)
+
+    def cooccurring_pairs(self, min_entries: int = 1) -> pd.DataFrame:
+        """
+        every pair of distinct tags that share at least min_entries entries, most frequent first
+        lift is how much more often the pair occurs than it would if the tags were independent
+        """
+        matrix = self.cooccurrence
+        a, b = np.nonzero(np.triu(matrix, k=1) >= min_entries)
+        together = matrix[a, b]
+        totals = np.diag(matrix).astype(np.float64)
+        lift = together * self.shape[0] / (totals[a] * totals[b])
+        pairs = pd.concat([self._tag_frame(a).add_suffix('_a'), self._tag_frame(b).add_suffix('_b')], axis=1)
+        pairs = pairs.assign(entries=together, lift=lift)
+        return pairs.sort_values(['entries', 'lift'], ascending=False, ignore_index=True)
+
+    def cooccurrence_frame(self, top_n: int = 20) -> pd.DataFrame:
+        """:return: the co-occurrence matrix of the top_n most used tags, labelled with their names"""
+        matrix = self.cooccurrence
+        top = np.argsort(-np.diag(matrix), kind='stable')[:top_n]
+        top = top[np.diag(matrix)[top] > 0]
+        names = self.tag_names[top]
+        return pd.DataFrame(matrix[np.ix_(top, top)], index=names, columns=names)
+
+    @cached_property
+    def daily(self) -> pd.DataFrame:
+        """
+        entries and average mood of every calendar day from the first entry to the last, days without
+        entries have 0 entries and no mood
+        """
+        if not len(self.days):
+            return pd.DataFrame({'day': pd.Series(dtype='datetime64[ns]'), 'entries': [], 'mood': []})
+        first, last = self.days.min(), self.days.max()
+        offsets = (self.days - first).astype(np.int64)
+        span = int((last - first).astype(np.int64)) + 1
+        entries = np.bincount(offsets, minlength=span)
+        with np.errstate(invalid='ignore'):
+            mood = np.bincount(offsets, weights=self.moods, minlength=span) / entries
+        return pd.DataFrame({'day': np.arange(first, last + 1), 'entries': entries, 'mood': mood})
+
+    def rolling(self, windows: tuple[int, ...] = ROLLING_WINDOWS) -> pd.DataFrame:
+        """
+        rolling mean and standard deviation of the entries' moods over the last `window` calendar days,
+        from running sums, so every window costs the same whatever its length
+        """
+        daily = self.daily.copy()
+        counts = daily['entries'].to_numpy(np.float64)
+        sums = np.nan_to_num(daily['mood'].to_numpy() * counts)
+        offsets = (self.days - self.days.min()).astype(np.int64) if len(self.days) else np.array([], np.int64)
+        squares = np.bincount(offsets, weights=self.moods ** 2, minlength=len(daily))
+
+        def trailing(values: np.ndarray, window: int) -> np.ndarray:
+            running = np.concatenate(([0.0], np.cumsum(values)))
+            return running[window:] - running[:-window] if window <= len(values) else np.array([])
+
+        for window in windows:
+            pad = min(window - 1, len(daily))
+            n = np.concatenate((np.full(pad, np.nan), trailing(counts, window)))
+            total = np.concatenate((np.full(pad, np.nan), trailing(sums, window)))
+            total_squares = np.concatenate((np.full(pad, np.nan), trailing(squares, window)))
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = total / n
+                std = np.sqrt(np.maximum(total_squares / n - mean ** 2, 0))
+            daily[f'mean_{window}d'] = mean
+            daily[f'std_{window}d'] = std
+        return daily
+
+    def streaks(self, top_n: int = 5, good: float = GOOD_DAY_MOOD, bad: float = BAD_DAY_MOOD) -> pd.DataFrame:
+        """
+        the top_n longest runs of consecutive days averaging at least `good`, and at most `bad`
+        a day without entries ends a streak
+        :return: kind ('best' or 'worst'), start, end, days and average mood of every streak
+        """
+        daily = self.daily
+        mood = daily['mood'].to_numpy()
+        streaks = []
+        for kind, mask in (('best', mood >= good), ('worst', mood <= bad)):
+            starts, lengths = _runs(mask)
+            order = np.lexsort((starts, -lengths))[:top_n]
+            starts, lengths = starts[order], lengths[order]
+            running = np.concatenate(([0.0], np.cumsum(np.nan_to_num(mood))))
+            streaks.append(pd.DataFrame({
+                'kind': kind,
+                'start': daily['day'].to_numpy()[starts],
+                'end': daily['day'].to_numpy()[starts + lengths - 1],
+                'days': lengths,
+                'avg_mood': (running[starts + lengths] - running[starts]) / lengths,
+            }))
+        return pd.concat(streaks, ignore_index=True)
+
+
+_analytics: dict[Path, MoodAnalytics] = {}
+_analytics_lock = threading.Lock()
+
+
+def get_mood_analytics(db_path: str | Path | None = None) -> MoodAnalytics:
+    """
+    process-wide analytics of a database, rebuilt only when its ingest generation moved
+    :param db_path: None for the routed user's shard
+    """
+    key = Path(db_path or active_db_path()).resolve()
+    db_conn = get_connection(key, read_only=True)
+    generation = ingest_generation(db_conn)
+    with _analytics_lock:
+        cached = _analytics.get(key)
+        if cached is not None and cached.generation == generation:
+            return cached
+        analytics = _analytics[key] = MoodAnalytics(db_conn, generation)
+        return analytics
+
+
+def _sql_tag_impact(db_conn: sqlite3.Connection) -> pd.DataFrame:
+    """tag impact the way a view would compute it, for the benchmark"""
+    return pd.read_sql_query('''
+        WITH moods AS (
+            SELECT de.id, cm.mood_value FROM dayEntries de JOIN customMoods cm ON cm.id = de.mood
+            WHERE cm.mood_value IS NOT NULL
+        ),
+        overall AS (SELECT COUNT(*) AS n, SUM(mood_value) AS total FROM moods),
+        tagged AS (
+            SELECT et.tag, COUNT(*) AS n, SUM(m.mood_value) AS total
+            FROM (SELECT DISTINCT entry_id, tag FROM entry_tags) et JOIN moods m ON m.id = et.entry_id
+            GROUP BY et.tag
+        )
+        SELECT t.tag AS tag_id, t.total * 1.0 / t.n - (o.total - t.total) * 1.0 / (o.n - t.n) AS difference
+        FROM tagged t, overall o
+        ORDER BY tag_id
+    ''', db_conn)
+
+
+def _sql_cooccurrence(db_conn: sqlite3.Connection) -> pd.DataFrame:
+    return pd.read_sql_query('''
+        WITH pairs AS (
+            SELECT DISTINCT et.entry_id, et.tag FROM entry_tags et
+            JOIN dayEntries de ON de.id = et.entry_id JOIN customMoods cm ON cm.id = de.mood
+            WHERE cm.mood_value IS NOT NULL
+        )
+        SELECT a.tag AS tag_a, b.tag AS tag_b, COUNT(*) AS entries
+        FROM pairs a JOIN pairs b ON a.entry_id = b.entry_id AND a.tag < b.tag
+        GROUP BY a.tag, b.tag
+    ''', db_conn)
+
+
+def benchmark(years_list: list[int], repeats: int = 3) -> pd.DataFrame:
+    """
+    times loading the arrays and computing tag impact, co-occurrence, rolling statistics and streaks
+    against tag impact and co-occurrence computed with SQL joins, on synthetic histories, and checks that
+    both give the same numbers
+    """
+    import statistics
+    import tempfile
+    import time
+    from .query_plans import synthetic_database
+
+    def timed(fn) -> tuple[float, object]:
+        samples, result = [], None
+        for _ in range(repeats):
+            started = time.perf_counter()
+            result = fn()
+            samples.append(time.perf_counter() - started)
+        return statistics.median(samples) * 1000, result
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for years in years_list:
+            db_conn = synthetic_database(str(Path(tmp) / f"analytics_{years}.db"), years)
+            load_ms, analytics = timed(lambda: MoodAnalytics(db_conn, 0))
+            impact_ms, impact = timed(lambda: MoodAnalytics.tag_impact.func(analytics))
+            cooc_ms, _ = timed(lambda: MoodAnalytics.cooccurrence.func(analytics))
+            pairs_ms, pairs = timed(lambda: analytics.cooccurring_pairs())
+            rolling_ms, _ = timed(lambda: analytics.rolling())
+            streaks_ms, _ = timed(lambda: analytics.streaks())
+            sql_impact_ms, sql_impact = timed(lambda: _sql_tag_impact(db_conn))
+            sql_cooc_ms, sql_pairs = timed(lambda: _sql_cooccurrence(db_conn))
+
+            merged = impact.merge(sql_impact, on='tag_id', suffixes=('', '_sql'))
+            assert len(merged) == len(sql_impact) and np.allclose(merged['difference'], merged['difference_sql'])
+            assert pairs['entries'].sum() == sql_pairs['entries'].sum() and len(pairs) == len(sql_pairs)
+            rows.append({
+                "years": years,
+                "entries": analytics.shape[0],
+                "tags": analytics.shape[1],
+                "pairs": len(analytics.rows),
+                "load_ms": load_ms,
+                "impact_ms": impact_ms,
+                "cooc_ms": cooc_ms + pairs_ms,
+                "rolling_ms": rolling_ms,
+                "streaks_ms": streaks_ms,
+                "sql_impact_ms": sql_impact_ms,
+                "sql_cooc_ms": sql_cooc_ms,
+            })
+            db_conn.close()
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    import sys
+    logger.disabled = True
+    print(benchmark([int(arg) for arg in sys.argv[1:]] or [1, 4, 16]).to_string(
+        index=False, float_format=lambda value: f"{value:.1f}"))
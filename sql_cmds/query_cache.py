@@ -0,0 +1,155 @@
+"""In-memory LRU cache of query results for the Streamlit pages.
+
+Results are keyed by the query, its parameters and the database generation. The
+generation is ``PRAGMA data_version`` read on a dedicated connection that never
+writes, so its value moves whenever any other connection, in this process or
+another, commits. An ingest or a topic edit therefore invalidates every cached
+result without the writers having to know the cache exists.
+"""
+import datetime
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Callable
+import pandas as pd
+from cachetools import LRUCache
+from log_setup import logger
+
+from .connection_pool import DEFAULT_DB_PATH, get_connection
+from .shard_router import active_db_path
+
+DEFAULT_MAXSIZE = 128
+
+
+class QueryStats:
+    """Hit/miss counters and latencies of one query."""
+
+    __slots__ = ("hits", "misses", "hit_seconds", "miss_seconds")
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.hit_seconds = 0.0
+        self.miss_seconds = 0.0
+
+    def record(self, hit: bool, seconds: float):
+        if hit:
+            self.hits += 1
+            self.hit_seconds += seconds
+        else:
+            self.misses += 1
+            self.miss_seconds += seconds
+
+
+class QueryCache:
+    """LRU cache of DataFrames and row lists read from one database file."""
+
+    def __init__(self, db_path: str | Path = DEFAULT_DB_PATH, maxsize: int = DEFAULT_MAXSIZE):
+        """
+        :param db_path: database the cached queries read
+        :param maxsize: number of results kept, the least recently used is evicted first
+        """
+        self.db_path = Path(db_path).resolve()
+        self._results = LRUCache(maxsize=maxsize)
+        self._stats: dict[str, QueryStats] = {}
+        self._lock = threading.Lock()
+        self._probe = None
+        self._generation = None
+
+    def generation(self) -> int:
+        """data_version of the probe connection, it changes whenever another connection commits"""
+        with self._lock:
+            if self._probe is None:
+                self._probe = sqlite3.connect(f"{self.db_path.as_uri()}?mode=ro", uri=True, check_same_thread=False)
+            generation = self._probe.execute("PRAGMA data_version").fetchone()[0]
+            if generation != self._generation:
+                if self._generation is not None:
+                    logger.info(f"Database changed, dropping {len(self._results)} cached query results")
+                self._results.clear()
+                self._generation = generation
+            return generation
+
+    def _lookup(self, name: str, key: tuple, compute: Callable):
+        started = time.perf_counter()
+        # the windowed views are relative to date('now'), so results also expire at midnight
+        key = (*key, self.generation(), datetime.date.today())
+        with self._lock:
+            result = self._results.get(key)
+        hit = result is not None
+        if not hit:
+            result = compute()
+            with self._lock:
+                self._results[key] = result
+        with self._lock:
+            self._stats.setdefault(name, QueryStats()).record(hit, time.perf_counter() - started)
+        # callers are free to modify what they get back, the cached copy stays untouched
+        return result.copy()
+
+    def read_df(self, query: str, params: tuple | list = (), parse_dates: list[str] | None = None) -> pd.DataFrame:
+        """
+        pd.read_sql_query through the cache
+        :return: a copy of the cached DataFrame
+        """
+        return self._lookup(
+            _query_name(query), ("df", query, tuple(params), tuple(parse_dates or ())),
+            lambda: pd.read_sql_query(query, self._connection(), params=params, parse_dates=parse_dates))
+
+    def fetchall(self, query: str, params: tuple | list = ()) -> list[tuple]:
+        return self._lookup(_query_name(query), ("rows", query, tuple(params)),
+                            lambda: self._connection().execute(query, params).fetchall())
+
+    def call(self, reader: Callable, *args, **kwargs):
+        """
+        calls reader(conn, *args, **kwargs) through the cache, for functions that build their own query
+        such as read_mood_rollup or hypnogram, the arguments must be hashable
+        """
+        name = f"{reader.__module__}.{reader.__qualname__}"
+        return self._lookup(name, ("call", name, args, tuple(sorted(kwargs.items()))),
+                            lambda: reader(self._connection(), *args, **kwargs))
+
+    def _connection(self) -> sqlite3.Connection:
+        return get_connection(self.db_path, read_only=True)
+
+    def stats(self) -> pd.DataFrame:
+        """
+        :return: one row per query with calls, hits, misses, hit rate and mean latency of hits and misses in ms
+        """
+        with self._lock:
+            rows = [(name, s.hits + s.misses, s.hits, s.misses, s.hits / (s.hits + s.misses),
+                     s.hit_seconds * 1000 / s.hits if s.hits else None,
+                     s.miss_seconds * 1000 / s.misses if s.misses else None)
+                    for name, s in self._stats.items()]
+        return pd.DataFrame(rows, columns=["query", "calls", "hits", "misses", "hit_rate", "hit_ms", "miss_ms"])
+
+    def hit_rate(self) -> float:
+        with self._lock:
+            hits = sum(s.hits for s in self._stats.values())
+            calls = hits + sum(s.misses for s in self._stats.values())
+        return hits / calls if calls else 0.0
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+
+def _query_name(query: str, width: int = 80) -> str:
+    name = re.sub(r"\s+", " ", query).strip()
+    return name if len(name) <= width else name[:width - 3] + "..."
+
+
+_caches: dict[Path, QueryCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_query_cache(db_path: str | Path | None = None) -> QueryCache:
+    """
+    process-wide cache of a database file, shared by every Streamlit session routed to it
+    :param db_path: None for the routed user's shard, every shard has a cache of its own
+    """
+    key = Path(db_path or active_db_path()).resolve()
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = QueryCache(key)
+        return _caches[key]
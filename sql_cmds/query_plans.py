@@ -0,0 +1,193 @@
+"""Query-plan regression suite for the views in sql/create_views.sql.
+
+Run with ``python -m sql_cmds.query_plans [years ...]``. Every view is planned with
+EXPLAIN QUERY PLAN and timed against synthetic databases holding increasing amounts
+of history. The run exits non-zero when a view scans a table that grows with history
+instead of searching it through an index.
+"""
+import datetime
+import re
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+import numpy as np
+from log_setup import logger
+
+from .calendar_cmds import extend_calendar
+from .rollups import refresh_rollups
+
+SQL_DIR = Path(__file__).parent.parent / "sql"
+
+# tables whose size grows with the length of the history, everything else is a small lookup table
+HISTORY_TABLES = {
+    'dayEntries', 'entry_tags', 'goalEntries', 'calendar', 'fitbit_sleep', 'sleep_segments',
+    'mood_rollups', 'mood_group_rollups', 'tag_rollups',
+}
+
+# views that read a fixed trailing window, their cost must not depend on the rest of the history
+WINDOWED_VIEWS = ('v_activity_summary', 'v_entry_details', 'v_daily_avgs', 'v_sleep_summary', 'v_sleep_trend')
+
+# history tables an all-time view is allowed to walk in full, and only ever through an index
+ALL_TIME_SCANS = {
+    'v_sleep_main_per_day': {'fitbit_sleep'},
+}
+
+DEFAULT_YEARS = (1, 4, 16)
+
+_SOURCE_PATTERN = re.compile(r"\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?", re.IGNORECASE)
+_STEP_PATTERN = re.compile(r"^(SCAN|SEARCH) (\w+)(?: USING (?:COVERING )?INDEX (\w+))?")
+_RANGE_PATTERN = re.compile(r"\w+[<>]=?\?")
+_KEYWORDS = {'on', 'where', 'join', 'left', 'inner', 'cross', 'group', 'order', 'using', 'limit'}
+
+
+def synthetic_database(db_path: str, years: int, seed: int = 0) -> sqlite3.Connection:
+    """
+    creates the full schema and views in db_path and fills it with `years` of history ending today
+    """
+    rng = np.random.default_rng(seed)
+    db_conn = sqlite3.connect(db_path)
+    db_conn.executescript((SQL_DIR / "create_tables.sql").read_text())
+
+    today = datetime.date.today()
+    first_day = today - datetime.timedelta(days=365 * years)
+    days = np.arange(np.datetime64(first_day), np.datetime64(today) + 1)
+
+    def stamp(values) -> list[str]:
+        return np.char.replace(np.datetime_as_string(values, unit='s'), 'T', ' ').tolist()
+
+    with db_conn:
+        db_conn.executemany("INSERT INTO mood_groups (id, name, value) VALUES (?, ?, ?)",
+                            [(i, f"group {i}", 6 - i) for i in range(1, 6)])
+        db_conn.executemany(
+            "INSERT INTO customMoods (id, custom_name, mood_value, mood_group_id, mood_group_order) VALUES (?, ?, ?, ?, ?)",
+            [(i, f"mood {i}", 6 - ((i - 1) % 5 + 1), (i - 1) % 5 + 1, i // 5) for i in range(1, 11)])
+        db_conn.executemany("INSERT INTO tag_groups (id, name) VALUES (?, ?)",
+                            [(i, 'Sleep' if i == 1 else f"tag group {i}") for i in range(1, 9)])
+        db_conn.executemany('INSERT INTO tags (id, name, "order", id_tag_group) VALUES (?, ?, ?, ?)',
+                            [(i, f"tag {i}", i, i % 8 + 1) for i in range(1, 161)])
+
+        entry_days = np.repeat(days, 3)
+        entry_times = entry_days.astype('datetime64[s]') + rng.integers(0, 86400, len(entry_days)).astype('timedelta64[s]')
+        entry_ids = np.arange(1, len(entry_days) + 1)
+        db_conn.executemany(
+            "INSERT INTO dayEntries (id, datetime, mood, note, note_title, date) VALUES (?, ?, ?, '', '', ?)",
+            zip(entry_ids.tolist(), stamp(entry_times), rng.integers(1, 11, len(entry_ids)).tolist(),
+                stamp(entry_days.astype('datetime64[s]'))))
+        # three different tags per entry, an entry carries a tag at most once
+        tagged = np.repeat(entry_ids, 3)
+        tags = (np.repeat(rng.integers(0, 160, len(entry_ids)), 3) + np.tile([0, 53, 106], len(entry_ids))) % 160 + 1
+        db_conn.executemany("INSERT INTO entry_tags (entry_id, tag) VALUES (?, ?)", zip(tagged.tolist(), tags.tolist()))
+
+        db_conn.executemany(
+            "INSERT INTO goals (id, goal_id, created_at, id_tag, name, date) VALUES (?, ?, ?, ?, ?, ?)",
+            [(i, i, f"{first_day} 00:00:00", i * 10, f"goal {i}", f"{first_day} 00:00:00") for i in range(1, 13)])
+        goal_days = days[rng.random(len(days)) < 0.7]
+        db_conn.executemany("INSERT INTO goalEntries (id, goalId, date) VALUES (?, ?, ?)",
+                            zip(range(1, len(goal_days) + 1), rng.integers(1, 13, len(goal_days)).tolist(),
+                                stamp(goal_days.astype('datetime64[s]'))))
+
+        sleep_minutes = rng.integers(240, 600, len(days))
+        db_conn.executemany(
+            "INSERT INTO fitbit_sleep (log_id, date, duration_minutes, duration_hours, sleep_type, start_time, main_sleep) "
+            "VALUES (?, ?, ?, ?, 'full', ?, 1)",
+            zip(range(1, len(days) + 1), np.datetime_as_string(days).tolist(), sleep_minutes.tolist(),
+                np.round(sleep_minutes / 60, 1).tolist(), stamp(days.astype('datetime64[s]') - np.timedelta64(2, 'h'))))
+
+    extend_calendar(db_conn, start=str(first_day), end=str(today))
+    refresh_rollups(db_conn, full=True)
+    db_conn.executescript((SQL_DIR / "create_views.sql").read_text())
+    return db_conn
+
+
+def view_names(db_conn: sqlite3.Connection) -> list[str]:
+    return [row[0] for row in db_conn.execute("SELECT name FROM sqlite_master WHERE type = 'view' ORDER BY name")]
+
+
+def _source_tables(db_conn: sqlite3.Connection, view_name: str) -> dict[str, str]:
+    """maps every alias and table name used in a view's SQL, and in the views it reads, to its table"""
+    views = dict(db_conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'view'").fetchall())
+    sources, pending = {}, [view_name]
+    while pending:
+        for table, alias in _SOURCE_PATTERN.findall(views[pending.pop()]):
+            if table in views and table not in sources:
+                pending.append(table)
+            sources[table] = table
+            if alias and alias.lower() not in _KEYWORDS:
+                sources[alias] = table
+    return sources
+
+
+def view_plan(db_conn: sqlite3.Connection, view_name: str) -> list[str]:
+    return [row[3] for row in db_conn.execute(f"EXPLAIN QUERY PLAN SELECT * FROM {view_name}")]
+
+
+def history_scans(db_conn: sqlite3.Connection, view_name: str) -> list[str]:
+    """
+    :return: the plan steps in which a view walks a whole history table, empty if the view is clean
+
+    a windowed view must also enter the history through a range search, otherwise it is driven
+    by a lookup table and reads every matching row of the history before the window is applied
+    """
+    sources = _source_tables(db_conn, view_name)
+    scans, first_history_step = [], None
+    for step in view_plan(db_conn, view_name):
+        match = _STEP_PATTERN.match(step)
+        if match is None:
+            continue
+        table = sources.get(match.group(2), match.group(2))
+        if table not in HISTORY_TABLES:
+            continue
+        first_history_step = first_history_step or step
+        if match.group(1) != 'SCAN':
+            continue
+        allowed = view_name not in WINDOWED_VIEWS and table in ALL_TIME_SCANS.get(view_name, ()) and match.group(3)
+        if not allowed:
+            scans.append(step)
+    if (view_name in WINDOWED_VIEWS and not scans and first_history_step
+            and not _RANGE_PATTERN.search(first_history_step)):
+        scans.append(f"not driven by its window: {first_history_step}")
+    return scans
+
+
+def time_view(db_conn: sqlite3.Connection, view_name: str, repeats: int = 5) -> float:
+    """median seconds to read every row of a view"""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        db_conn.execute(f"SELECT * FROM {view_name}").fetchall()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def run_suite(years: tuple = DEFAULT_YEARS) -> list[str]:
+    """
+    plans and times every view against a synthetic database per history length
+    :return: one message per full scan found, empty when every view passed
+    """
+    failures, timings = [], {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n_years in years:
+            db_conn = synthetic_database(str(Path(tmp_dir) / f"plans_{n_years}y.db"), n_years)
+            for view_name in view_names(db_conn):
+                for step in history_scans(db_conn, view_name):
+                    failures.append(f"{view_name} ({n_years}y): {step}")
+                timings.setdefault(view_name, []).append(time_view(db_conn, view_name))
+            db_conn.close()
+
+    print(f"{'view':<26}" + "".join(f"{f'{n}y':>10}" for n in years) + f"{'growth':>9}")
+    for view_name, view_timings in timings.items():
+        growth = view_timings[-1] / view_timings[0] if view_timings[0] else float('nan')
+        windowed = " (windowed)" if view_name in WINDOWED_VIEWS else ""
+        print(f"{view_name:<26}" + "".join(f"{t * 1000:>8.2f}ms" for t in view_timings)
+              + f"{growth:>8.1f}x{windowed}")
+    for failure in failures:
+        print(f"FULL SCAN  {failure}")
+    return failures
+
+
+if __name__ == "__main__":
+    logger.disabled = True
+    sys.exit(1 if run_suite(tuple(int(arg) for arg in sys.argv[1:]) or DEFAULT_YEARS) else 0)
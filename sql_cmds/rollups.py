@@ -0,0 +1,171 @@
+import datetime
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Iterator
+import pandas as pd
+from log_setup import logger
+
+from .sql_cmds import triggers_suspended
+
+ROLLUP_TABLES = ('mood_rollups', 'mood_group_rollups', 'tag_rollups')
+
+# coarser grains: expression giving the period start of a day, and the modifier to the next period
+PERIOD_GRAINS = {
+    'week': ("date({col}, 'weekday 0', '-6 days')", '+7 days'),
+    'month': ("date({col}, 'start of month')", '+1 month'),
+}
+
+# daily rows are built from the entries of the dirty days, dates are stored as 'YYYY-MM-DD HH:MM:SS' text
+# so the range join on de.date can use idx_dayEntries_date
+_DAILY_SOURCE = '''
+    FROM rollup_dirty_days d
+    JOIN dayEntries de ON de.date >= d.day AND de.date < date(d.day, '+1 day')
+'''
+
+_DAILY_INSERTS = {
+    'mood_rollups': f'''
+        INSERT INTO mood_rollups (grain, period, entries, mood_sum, avg_mood_value)
+        SELECT 'day', d.day, COUNT(*), SUM(cm.mood_value), ROUND(AVG(cm.mood_value), 2)
+        {_DAILY_SOURCE}
+        JOIN customMoods cm ON de.mood = cm.id
+        JOIN mood_groups mg ON cm.mood_group_id = mg.id
+        GROUP BY d.day
+    ''',
+    'mood_group_rollups': f'''
+        INSERT INTO mood_group_rollups (grain, period, mood_group_id, mood_group_name, entries)
+        SELECT 'day', d.day, mg.id, mg.name, COUNT(*)
+        {_DAILY_SOURCE}
+        JOIN customMoods cm ON de.mood = cm.id
+        JOIN mood_groups mg ON cm.mood_group_id = mg.id
+        GROUP BY d.day, mg.id
+    ''',
+    'tag_rollups': f'''
+        INSERT INTO tag_rollups (grain, period, tag_id, tag_name, tag_group, entries)
+        SELECT 'day', d.day, t.id, t.name, tg.name, COUNT(*)
+        {_DAILY_SOURCE}
+        JOIN entry_tags et ON et.entry_id = de.id
+        JOIN tags t ON et.tag = t.id
+        LEFT JOIN tag_groups tg ON t.id_tag_group = tg.id
+        GROUP BY d.day, t.id
+    ''',
+}
+
+# coarser rows are re-summed from the daily rows of every period touching a dirty day
+_PERIOD_INSERTS = {
+    'mood_rollups': '''
+        INSERT INTO mood_rollups (grain, period, entries, mood_sum, avg_mood_value)
+        SELECT :grain, p.period, SUM(r.entries), SUM(r.mood_sum), ROUND(SUM(r.mood_sum) * 1.0 / SUM(r.entries), 2)
+        {source}
+        GROUP BY p.period
+    ''',
+    'mood_group_rollups': '''
+        INSERT INTO mood_group_rollups (grain, period, mood_group_id, mood_group_name, entries)
+        SELECT :grain, p.period, r.mood_group_id, MAX(r.mood_group_name), SUM(r.entries)
+        {source}
+        GROUP BY p.period, r.mood_group_id
+    ''',
+    'tag_rollups': '''
+        INSERT INTO tag_rollups (grain, period, tag_id, tag_name, tag_group, entries)
+        SELECT :grain, p.period, r.tag_id, MAX(r.tag_name), MAX(r.tag_group), SUM(r.entries)
+        {source}
+        GROUP BY p.period, r.tag_id
+    ''',
+}
+
+
+@contextmanager
+def rollup_triggers_suspended(db_conn: sqlite3.Connection, table_name: str) -> Iterator[None]:
+    """
+    suspends the dirty-day triggers of a table for a rewrite of all of its rows. The days it may have touched are
+    marked dirty in one statement at the end instead of row by row: every day with entries now, and every day
+    that had rollup rows before. Must run inside the caller's `with db_conn:` block, see triggers_suspended
+    """
+    with triggers_suspended(db_conn, table_name, "_rollup") as suspended:
+        yield
+        if suspended:
+            days = " UNION ".join(f"SELECT period FROM {table} WHERE grain = 'day'" for table in ROLLUP_TABLES)
+            db_conn.execute(f"INSERT OR IGNORE INTO rollup_dirty_days (day) "
+                            f"SELECT date(date) FROM dayEntries UNION {days}")
+
+
+def refresh_rollups(db_conn: sqlite3.Connection, full: bool = False) -> int:
+    """
+    rebuilds the daily, weekly and monthly rollup rows of every day marked dirty since the last refresh
+    :param full: rebuild every rollup from scratch, e.g. after a full reload
+    :return: number of days refreshed
+    """
+    start = time.perf_counter()
+    with db_conn:
+        if full:
+            for table in ROLLUP_TABLES:
+                db_conn.execute(f"DELETE FROM {table}")
+            db_conn.execute("DELETE FROM rollup_dirty_days")
+            db_conn.execute("INSERT INTO rollup_dirty_days (day) SELECT DISTINCT date(date) FROM dayEntries")
+
+        days = db_conn.execute("SELECT COUNT(*) FROM rollup_dirty_days").fetchone()[0]
+        if days == 0:
+            logger.info("No dirty days, rollups are up to date")
+            return 0
+
+        for table, insert in _DAILY_INSERTS.items():
+            db_conn.execute(f"DELETE FROM {table} WHERE grain = 'day' AND period IN (SELECT day FROM rollup_dirty_days)")
+            db_conn.execute(insert)
+
+        for grain, (period_start, next_period) in PERIOD_GRAINS.items():
+            dirty_periods = f"SELECT DISTINCT {period_start.format(col='day')} AS period FROM rollup_dirty_days"
+            source = f'''
+                FROM ({dirty_periods}) p
+                JOIN {{table}} r ON r.grain = 'day' AND r.period >= p.period AND r.period < date(p.period, '{next_period}')
+            '''
+            for table, insert in _PERIOD_INSERTS.items():
+                db_conn.execute(f"DELETE FROM {table} WHERE grain = ? AND period IN ({dirty_periods})", (grain,))
+                db_conn.execute(insert.format(source=source.format(table=table)), {'grain': grain})
+
+        db_conn.execute("DELETE FROM rollup_dirty_days")
+    logger.info(f"Refreshed rollups for {days} days in {time.perf_counter() - start:.2f}s")
+    return days
+
+
+def _period_filter(start: datetime.date | None, end: datetime.date | None) -> tuple[str, list]:
+    conditions, params = [], []
+    if start is not None:
+        conditions.append("period >= ?")
+        params.append(str(start))
+    if end is not None:
+        conditions.append("period <= ?")
+        params.append(str(end))
+    return "".join(f" AND {condition}" for condition in conditions), params
+
+
+def read_mood_rollup(db_conn: sqlite3.Connection, grain: str = 'day', start: datetime.date | None = None,
+                     end: datetime.date | None = None) -> pd.DataFrame:
+    """
+    :param grain: 'day', 'week' or 'month'
+    :return: entries and average mood value of every period between start and end, newest first
+    """
+    where, params = _period_filter(start, end)
+    return pd.read_sql_query(
+        f"SELECT period, entries, avg_mood_value FROM mood_rollups WHERE grain = ?{where} ORDER BY period DESC",
+        db_conn, params=[grain, *params], parse_dates=['period'])
+
+
+def read_top_tags(db_conn: sqlite3.Connection, start: datetime.date | None = None,
+                  end: datetime.date | None = None, top_n: int = 10) -> pd.DataFrame:
+    """
+    :return: the top_n most used tags of every tag group between start and end, as group, activity and count
+    """
+    where, params = _period_filter(start, end)
+    return pd.read_sql_query(f'''
+        WITH ranked AS (
+            SELECT tag_group, tag_name, SUM(entries) AS entries,
+                   ROW_NUMBER() OVER (PARTITION BY tag_group ORDER BY SUM(entries) DESC) AS rank
+            FROM tag_rollups
+            WHERE grain = 'day'{where}
+            GROUP BY tag_id
+        )
+        SELECT tag_group AS [group], tag_name AS activity, entries AS [count]
+        FROM ranked
+        WHERE rank <= ?
+        ORDER BY [group], [count] DESC
+    ''', db_conn, params=[*params, top_n])
@@ -0,0 +1,98 @@
+"""When every synced row first appeared, last changed and was deleted.
+
+Rows are identified the way delta_ingest identifies them, by table name and the JSON
+of their primary key, and compared by the delta row hash. ``RowHistory`` merges the
+row hashes of many backups in date order, which is how the backfill rebuilds the
+history of old backups, and ``record_delta_history`` keeps the table current on every
+delta ingest after that.
+"""
+import sqlite3
+from dataclasses import dataclass
+from datetime import date
+import pandas as pd
+
+UPSERT_CHANGED = '''
+    INSERT INTO row_history (table_name, pk, first_seen, last_changed) VALUES (?, ?, ?, ?)
+    ON CONFLICT (table_name, pk) DO UPDATE SET
+        last_changed = excluded.last_changed, versions = versions + 1, deleted_on = NULL
+'''
+
+
+@dataclass(slots=True)
+class RowVersion:
+    row_hash: str
+    first_seen: str
+    last_changed: str
+    last_seen: str
+    versions: int = 1
+    deleted_on: str | None = None
+
+
+class RowHistory:
+    """Row history merged from a series of backups, fed oldest first."""
+
+    def __init__(self):
+        self.rows: dict[tuple[str, str], RowVersion] = {}
+        self.last_day: str | None = None
+
+    def observe(self, day: str, table_hashes: dict[str, dict[str, str]]):
+        """
+        :param day: ISO date of the backup, backups have to be observed in date order
+        :param table_hashes: table name to row hash by primary key, as hash_table_rows returns them
+        """
+        for table_name, hashes in table_hashes.items():
+            for pk, row_hash in hashes.items():
+                known = self.rows.get((table_name, pk))
+                if known is None:
+                    self.rows[(table_name, pk)] = RowVersion(row_hash, day, day, day)
+                    continue
+                if known.row_hash != row_hash or known.deleted_on is not None:
+                    known.row_hash, known.last_changed = row_hash, day
+                    known.versions += 1
+                    known.deleted_on = None
+                known.last_seen = day
+        # rows of the observed tables that this backup no longer has were deleted since the previous one
+        for (table_name, pk), known in self.rows.items():
+            if table_name in table_hashes and known.last_seen != day and known.deleted_on is None:
+                known.deleted_on = day
+        self.last_day = day
+
+    def store(self, db_conn: sqlite3.Connection) -> int:
+        """
+        replaces the row_history table with the merged history
+        :return: number of rows written
+        """
+        with db_conn:
+            db_conn.execute("DELETE FROM row_history")
+            db_conn.executemany(
+                "INSERT INTO row_history (table_name, pk, first_seen, last_changed, versions, deleted_on) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(table_name, pk, row.first_seen, row.last_changed, row.versions, row.deleted_on)
+                 for (table_name, pk), row in self.rows.items()])
+        return len(self.rows)
+
+
+def record_delta_history(db_conn: sqlite3.Connection, delta, day: str | None = None):
+    """
+    updates row_history with the changes of one TableDelta, inside the caller's transaction
+    :param day: ISO date the changes are recorded under, today when None
+    """
+    day = day or date.today().isoformat()
+    if delta.baseline:
+        # a baseline rewrites every row, only rows the history does not know yet are new
+        db_conn.executemany(
+            "INSERT OR IGNORE INTO row_history (table_name, pk, first_seen, last_changed) VALUES (?, ?, ?, ?)",
+            [(delta.table_name, pk, day, day) for pk in delta.inserts])
+        return
+    db_conn.executemany(UPSERT_CHANGED, [(delta.table_name, pk, day, day) for pk in (*delta.inserts, *delta.updates)])
+    db_conn.executemany("UPDATE row_history SET deleted_on = ? WHERE table_name = ? AND pk = ?",
+                        [(day, delta.table_name, pk) for pk in delta.deletes])
+
+
+def read_row_history(db_conn: sqlite3.Connection, table_name: str) -> pd.DataFrame:
+    """
+    :return: DataFrame of a table's row history, with the primary key as stored in ingest_row_hashes
+    """
+    return pd.read_sql_query(
+        "SELECT pk, first_seen, last_changed, versions, deleted_on FROM row_history WHERE table_name = ? ORDER BY pk",
+        db_conn, params=(table_name,), parse_dates=['first_seen', 'last_changed', 'deleted_on'])
@@ -0,0 +1,288 @@
+"""Ranked full-text search over journal notes and topics.
+
+entries_fts indexes dayEntries.note_title and note, topics_fts indexes topics.topic
+and details. Both are FTS5 external-content tables kept in sync by the triggers in
+sql/create_tables.sql, so an ingest or a topic edit is searchable as soon as it
+commits. Full rewrites of a table, the bulk load and the first delta ingest, suspend
+the triggers and rebuild the index in one pass instead. ``ensure_search_index``
+rebuilds an index that is missing rows, e.g. the first time a database that predates
+the search tables is opened.
+
+Results are ranked by bm25, titles weighing more than the text, and come back a page
+at a time. Pages are keyset paginated on (score, id): the last row of a page is the
+cursor of the next one, so every page costs the same however deep the reader goes.
+Topic listings are keyset paginated the same way on their timestamp and id.
+
+Run ``python -m sql_cmds.search [years ...]`` to time searches over synthetic journals.
+"""
+import html
+import re
+import sqlite3
+from contextlib import contextmanager
+from typing import Iterator
+import pandas as pd
+from log_setup import logger
+
+from .sql_cmds import triggers_suspended
+
+DEFAULT_PAGE_SIZE = 20
+SNIPPET_TOKENS = 24
+# markers put around matched terms, the pages escape the text and turn them into <mark> tags
+HIGHLIGHT_OPEN = "\x02"
+HIGHLIGHT_CLOSE = "\x03"
+
+# index -> content table, content rowid and the indexed columns
+SEARCH_INDEXES = {
+    'entries_fts': ('dayEntries', 'id', ('note_title', 'note')),
+    'topics_fts': ('topics', 'id', ('topic', 'details')),
+}
+
+# bm25 column weights, a match in a title counts like several in the body
+ENTRY_WEIGHTS = (4.0, 1.0)
+TOPIC_WEIGHTS = (4.0, 1.0)
+
+_TERM = re.compile(r'\w+', re.UNICODE)
+
+Cursor = tuple[float, int]
+
+
+def to_match_query(text: str) -> str | None:
+    """
+    turns free text into an FTS5 query matching every word, the last one as a prefix so results show while typing
+    quotes and operators in the text are taken literally instead of failing as FTS5 syntax
+    :return: the MATCH expression, None if the text has no words
+    """
+    terms = _TERM.findall(text)
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def highlight_html(text: str | None) -> str:
+    """escapes a highlighted search result for st.markdown, with the matched terms in <mark> tags"""
+    return html.escape(text or "").replace(HIGHLIGHT_OPEN, "<mark>").replace(HIGHLIGHT_CLOSE, "</mark>")
+
+
+def strip_highlights(text: str | None) -> str:
+    return (text or "").replace(HIGHLIGHT_OPEN, "").replace(HIGHLIGHT_CLOSE, "")
+
+
+def ensure_search_index(db_conn: sqlite3.Connection) -> list[str]:
+    """
+    rebuilds every search index that does not hold exactly the rows of its content table
+    :return: names of the rebuilt indexes
+    """
+    rebuilt = []
+    for index, (table, _, _) in SEARCH_INDEXES.items():
+        indexed = db_conn.execute(f"SELECT COUNT(*) FROM {index}_docsize").fetchone()[0]
+        rows = db_conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        if indexed != rows:
+            logger.info(f"Rebuilding search index {index}: {indexed} of {rows} {table} rows indexed")
+            with db_conn:
+                db_conn.execute(f"INSERT INTO {index} ({index}) VALUES ('rebuild')")
+            rebuilt.append(index)
+    return rebuilt
+
+
+@contextmanager
+def search_index_suspended(db_conn: sqlite3.Connection, table_name: str) -> Iterator[None]:
+    """
+    suspends the search triggers of a table for a rewrite of all of its rows and rebuilds its index in one pass at
+    the end, several times faster than keeping the index in sync row by row. Tables without an index are left alone
+    must run inside the caller's `with db_conn:` block, see triggers_suspended
+    """
+    indexes = [index for index, (table, _, _) in SEARCH_INDEXES.items() if table == table_name]
+    if not indexes:
+        yield
+        return
+    with triggers_suspended(db_conn, table_name, "_fts"):
+        yield
+        for index in indexes:
+            db_conn.execute(f"INSERT INTO {index} ({index}) VALUES ('rebuild')")
+
+
+def _keyset(index: str, weights: tuple[float, float], after: Cursor | None) -> tuple[str, list]:
+    if after is None:
+        return "", []
+    # bm25 is repeated rather than aliased, a subquery around the match would build highlights for every hit
+    return f" AND (bm25({index}, ?, ?), {index}.rowid) > (?, ?)", [*weights, *after]
+
+
+def search_entries(db_conn: sqlite3.Connection, text: str, limit: int = DEFAULT_PAGE_SIZE,
+                   after: Cursor | None = None) -> pd.DataFrame:
+    """
+    journal entries matching every word of `text`, best match first
+    :param after: (score, id) of the last row of the previous page, None for the first page
+    :return: id, date, mood, highlighted title, snippet of the note around the matches and score
+    """
+    columns = ['id', 'date', 'mood', 'title', 'snippet', 'score']
+    match = to_match_query(text)
+    if match is None:
+        return pd.DataFrame(columns=columns)
+    keyset, keyset_params = _keyset('entries_fts', ENTRY_WEIGHTS, after)
+    # kept to the index alone, SQLite then only builds highlights and snippets for the rows of the page
+    hits = pd.read_sql_query(f'''
+        SELECT rowid AS id, bm25(entries_fts, ?, ?) AS score,
+               highlight(entries_fts, 0, ?, ?) AS title,
+               snippet(entries_fts, 1, ?, ?, '…', ?) AS snippet
+        FROM entries_fts
+        WHERE entries_fts MATCH ?{keyset}
+        ORDER BY score, id
+        LIMIT ?
+    ''', db_conn, params=[*ENTRY_WEIGHTS, HIGHLIGHT_OPEN, HIGHLIGHT_CLOSE, HIGHLIGHT_OPEN, HIGHLIGHT_CLOSE,
+                          SNIPPET_TOKENS, match, *keyset_params, limit])
+    entries = pd.read_sql_query(f'''
+        SELECT de.id, de.date, COALESCE(NULLIF(cm.custom_name, ''), mg.name) AS mood
+        FROM dayEntries de
+        LEFT JOIN customMoods cm ON cm.id = de.mood
+        LEFT JOIN mood_groups mg ON mg.id = cm.mood_group_id
+        WHERE de.id IN ({', '.join('?' * len(hits))})
+    ''', db_conn, params=hits['id'].tolist(), parse_dates=['date'])
+    return hits.merge(entries, on='id', how='left')[columns]
+
+
+def search_topics(db_conn: sqlite3.Connection, text: str, covered: bool | None = None,
+                  limit: int = DEFAULT_PAGE_SIZE, after: Cursor | None = None) -> pd.DataFrame:
+    """
+    topics matching every word of `text`, best match first
+    :param covered: only covered topics when True, only open ones when False, both when None
+    :param after: (score, id) of the last row of the previous page, None for the first page
+    :return: id, highlighted topic and details, covered, created_at, covered_at and score
+    """
+    match = to_match_query(text)
+    if match is None:
+        return pd.DataFrame(columns=['id', 'topic', 'details', 'covered', 'created_at', 'covered_at', 'score'])
+    keyset, keyset_params = _keyset('topics_fts', TOPIC_WEIGHTS, after)
+    covered_filter, covered_params = ("", []) if covered is None else (" AND t.covered = ?", [int(covered)])
+    return pd.read_sql_query(f'''
+        SELECT t.id, highlight(topics_fts, 0, ?, ?) AS topic, highlight(topics_fts, 1, ?, ?) AS details,
+               t.covered, t.created_at, t.covered_at, bm25(topics_fts, ?, ?) AS score
+        FROM topics_fts JOIN topics t ON t.id = topics_fts.rowid
+        WHERE topics_fts MATCH ?{covered_filter}{keyset}
+        ORDER BY score, t.id
+        LIMIT ?
+    ''', db_conn, params=[HIGHLIGHT_OPEN, HIGHLIGHT_CLOSE, HIGHLIGHT_OPEN, HIGHLIGHT_CLOSE, *TOPIC_WEIGHTS, match,
+                          *covered_params, *keyset_params, limit])
+
+
+def count_matches(db_conn: sqlite3.Connection, index: str, text: str) -> int:
+    """:return: number of rows of entries_fts or topics_fts matching every word of `text`"""
+    if index not in SEARCH_INDEXES:
+        raise ValueError(f"unknown search index {index}")
+    match = to_match_query(text)
+    if match is None:
+        return 0
+    return db_conn.execute(f"SELECT COUNT(*) FROM {index} WHERE {index} MATCH ?", (match,)).fetchone()[0]
+
+
+def read_topics(db_conn: sqlite3.Connection, covered: bool = False, limit: int = DEFAULT_PAGE_SIZE,
+                after: tuple[str, int] | None = None) -> pd.DataFrame:
+    """
+    one page of open or covered topics, newest first
+    :param after: (created_at, id) of the last open topic, or (covered_at, id) of the last covered topic,
+        on the previous page. None for the first page
+    :return: id, topic, details and the created_at or covered_at timestamp as 'date', '' for topics without one
+    """
+    # a NULL timestamp would make the keyset comparison NULL and end the listing, so they sort as ''
+    key = f"COALESCE({'covered_at' if covered else 'created_at'}, '')"
+    keyset, params = ("", []) if after is None else (f" AND ({key}, id) < (?, ?)", list(after))
+    return pd.read_sql_query(f'''
+        SELECT id, topic, details, {key} AS date
+        FROM topics
+        WHERE covered = ?{keyset}
+        ORDER BY {key} DESC, id DESC
+        LIMIT ?
+    ''', db_conn, params=[int(covered), *params, limit])
+
+
+def next_cursor(page: pd.DataFrame, limit: int, key: str = 'score') -> tuple | None:
+    """
+    :param key: the column the page is ordered on besides id, 'score' for searches and 'date' for topic listings
+    :return: the cursor of the page after this one, None if this is the last page
+    """
+    if len(page) < limit:
+        return None
+    value = page[key].iloc[-1]
+    return float(value) if key == 'score' else value, int(page['id'].iloc[-1])
+
+
+def synthetic_journal(db_path: str, years: int, seed: int = 0) -> sqlite3.Connection:
+    """
+    the query_plans synthetic database, with notes and titles drawn from a 50 word vocabulary
+    every word is in a large share of the notes, the worst case for ranking
+    """
+    import numpy as np
+    from .query_plans import synthetic_database
+    rng = np.random.default_rng(seed)
+    db_conn = synthetic_database(db_path, years, seed)
+    vocabulary = np.array(("walk run work family friends sleep tired coffee rain sun garden read movie "
+                           "music anxious calm happy sad dinner lunch cooking travel train office meeting "
+                           "doctor therapy gym yoga beach city mountain snow birthday holiday project "
+                           "deadline headache grateful lonely proud stressed relaxed weekend").split())
+    ids = [row[0] for row in db_conn.execute("SELECT id FROM dayEntries")]
+    lengths = rng.integers(0, 80, len(ids))
+    with db_conn:
+        db_conn.executemany("UPDATE dayEntries SET note_title = ?, note = ? WHERE id = ?", (
+            (' '.join(rng.choice(vocabulary, 3)), ' '.join(rng.choice(vocabulary, length)), entry_id)
+            for entry_id, length in zip(ids, lengths.tolist())))
+        db_conn.executemany("INSERT INTO topics (topic, details, covered, created_at) VALUES (?, ?, ?, ?)", (
+            (' '.join(rng.choice(vocabulary, 4)), ' '.join(rng.choice(vocabulary, 30)), int(i % 3 == 0),
+             f"2020-01-01 00:00:{i % 60:02d}") for i in range(2000)))
+    return db_conn
+
+
+def benchmark(years_list: list[int], queries: tuple[str, ...] = ("coffee", "therapy anxious", "dead", "walk rain sun"),
+              repeats: int = 20) -> pd.DataFrame:
+    """
+    times the first and the tenth page of entry searches, and counting the matches through the index
+    against a LIKE scan of the notes, over synthetic journals of increasing length
+    """
+    import statistics
+    import tempfile
+    import time
+    from pathlib import Path
+
+    def timed(fn) -> float:
+        samples = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            fn()
+            samples.append(time.perf_counter() - started)
+        return statistics.median(samples) * 1000
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for years in years_list:
+            db_conn = synthetic_journal(str(Path(tmp) / f"search_{years}.db"), years)
+            entries = db_conn.execute("SELECT COUNT(*) FROM dayEntries").fetchone()[0]
+            for text in queries:
+                cursor = None
+                for _ in range(9):
+                    page = search_entries(db_conn, text, after=cursor)
+                    cursor = next_cursor(page, DEFAULT_PAGE_SIZE)
+                    if cursor is None:
+                        break
+                like = f"%{text.split()[0]}%"
+                rows.append({
+                    "years": years,
+                    "entries": entries,
+                    "query": text,
+                    "matches": count_matches(db_conn, 'entries_fts', text),
+                    "page_1_ms": timed(lambda: search_entries(db_conn, text)),
+                    "page_10_ms": timed(lambda: search_entries(db_conn, text, after=cursor)) if cursor else None,
+                    "like_count_ms": timed(lambda: db_conn.execute(
+                        "SELECT COUNT(*) FROM dayEntries WHERE note LIKE ? OR note_title LIKE ?",
+                        (like, like)).fetchall()),
+                    "fts_count_ms": timed(lambda: count_matches(db_conn, 'entries_fts', text)),
+                })
+            db_conn.close()
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    import sys
+    logger.disabled = True
+    print(benchmark([int(arg) for arg in sys.argv[1:]] or [1, 4, 16]).to_string(
+        index=False, float_format=lambda value: f"{value:.2f}"))
@@ -0,0 +1,250 @@
+"""Per-user database shards and the router that picks one.
+
+Every user's Daylio and Fitbit data, ingest jobs, working store and snapshot archive
+live in their own folder ``data/shards/<username>/``, with the database at
+``daylio.db``. The directory database at ``data/daylio.db`` keeps the users table and
+which patients every provider serves.
+
+The shard a thread or task works on is held in a ContextVar. ``route_to(username)``
+sets it for a block, ``route_session`` sets it from a Streamlit session, and
+create_db_conn(), execute_sql_command(), get_query_cache() and the db_init helpers
+use it whenever they are not given a database. Nothing routed means the directory
+database, which is the single-user setup the app started out as.
+
+Ingest locks are rows of each shard's ingest_jobs table and writes go to the shard's
+own file, so an ingest for one user never waits on, or blocks, another user's data.
+Providers read across their patients with ``fan_out``, which runs a reader on every
+patient shard in a thread pool, each through that shard's query cache.
+
+The history ingested before there were shards stays in the directory database. Which
+user it belongs to is not known, so it never moves on its own: an administrator copies
+it into the owner's shard with ``python -m sql_cmds.shard_router --migrate-to <user>``,
+as long as that shard holds no data yet.
+"""
+import argparse
+import re
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator, MutableMapping
+import pandas as pd
+from log_setup import logger
+
+from .connection_pool import DEFAULT_DB_PATH, get_connection
+
+SHARD_DIR = Path("data") / "shards"
+SHARD_DB_NAME = "daylio.db"
+FAN_OUT_WORKERS = 8
+_USERNAME = re.compile(r"[A-Za-z0-9][A-Za-z0-9_.-]{0,63}")
+# tables that stay in the directory database, every other one holds the single-user history
+DIRECTORY_TABLES = ("provider_patients", "users")
+
+
+@dataclass(frozen=True)
+class Shard:
+    username: str
+    root: Path
+
+    @property
+    def db_path(self) -> Path:
+        return self.root / SHARD_DB_NAME
+
+    def exists(self) -> bool:
+        return self.db_path.exists()
+
+
+_active_shard: ContextVar[Shard | None] = ContextVar("active_shard", default=None)
+
+
+def shard_for(username: str, shard_dir: Path = SHARD_DIR) -> Shard:
+    """
+    :return: the shard of a user, whether it was created yet or not
+    :raises ValueError: for usernames that cannot name a folder, they must not reach the filesystem
+    """
+    if not _USERNAME.fullmatch(username or ""):
+        raise ValueError(f"{username!r} is not a valid username for a shard")
+    return Shard(username, Path(shard_dir) / username)
+
+
+def active_shard() -> Shard | None:
+    """the shard the current thread or task is routed to, None in single-user mode"""
+    return _active_shard.get()
+
+
+def active_db_path() -> str | Path:
+    """database of the routed shard, the directory database when nothing is routed"""
+    shard = _active_shard.get()
+    return shard.db_path if shard is not None else DEFAULT_DB_PATH
+
+
+@contextmanager
+def route_to(username: str | None) -> Iterator[Shard | None]:
+    """
+    routes the block to a user's shard, None routes it to the directory database
+    threads started inside the block only inherit the route when run through contextvars.copy_context()
+    """
+    shard = shard_for(username) if username is not None else None
+    token = _active_shard.set(shard)
+    try:
+        yield shard
+    finally:
+        _active_shard.reset(token)
+
+
+def route_session(session_state: MutableMapping) -> Shard | None:
+    """
+    routes the rest of a Streamlit script run to the logged-in user's shard, creating it on first use
+    every page calls this first, a run without a logged-in user reads the directory database
+    """
+    username = session_state.get("user")
+    shard = ensure_shard(username) if username else None
+    _active_shard.set(shard)
+    return shard
+
+
+def ensure_shard(username: str) -> Shard:
+    """creates a user's shard folder and database with every table and view, if it does not exist yet"""
+    from .db_init import create_tables, create_views
+    shard = shard_for(username)
+    if shard.exists():
+        return shard
+    logger.info(f"Creating the database shard of {username} in {shard.root}")
+    shard.root.mkdir(parents=True, exist_ok=True)
+    db_conn = get_connection(shard.db_path)
+    create_tables(db_conn, reset=False)
+    create_views(db_conn)
+    return shard
+
+
+def holds_history(db_path: str | Path) -> bool:
+    """whether a database has ingested anything, any entry or any ingest run"""
+    if not Path(db_path).exists():
+        return False
+    db_conn = sqlite3.connect(f"{Path(db_path).resolve().as_uri()}?mode=ro", uri=True)
+    try:
+        return bool(db_conn.execute(
+            "SELECT EXISTS (SELECT 1 FROM dayEntries) OR EXISTS (SELECT 1 FROM ingest_runs)").fetchone()[0])
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        db_conn.close()
+
+
+def migrate_directory_to_shard(username: str) -> Shard:
+    """
+    copies the single-user history of the directory database into a user's shard, with SQLite's backup API so
+    entries, sleep, rollups, search indexes, topics and the ingest bookkeeping all come along. The users and
+    provider assignments are removed from the copy, the directory database is left as it is
+    :raises ValueError: if the shard holds data of its own, it would be overwritten
+    """
+    from .db_init import create_tables, create_views
+    shard = shard_for(username)
+    if holds_history(shard.db_path):
+        raise ValueError(f"The database shard of {username} already holds data, not overwriting it")
+    logger.info(f"Copying the single-user history of {DEFAULT_DB_PATH} into the database shard of {username}")
+    shard.root.mkdir(parents=True, exist_ok=True)
+    source = sqlite3.connect(DEFAULT_DB_PATH)
+    target = sqlite3.connect(shard.db_path)
+    try:
+        source.backup(target)
+        with target:
+            placeholders = ", ".join("?" * len(DIRECTORY_TABLES))
+            copied = target.execute(
+                f"SELECT name FROM sqlite_master WHERE type = 'table' AND name IN ({placeholders})",
+                DIRECTORY_TABLES).fetchall()
+            for (table,) in copied:
+                target.execute(f"DELETE FROM {table}")
+    finally:
+        source.close()
+        target.close()
+    db_conn = get_connection(shard.db_path)
+    create_tables(db_conn, reset=False)
+    create_views(db_conn)
+    return shard
+
+
+def directory_connection(read_only: bool = False) -> sqlite3.Connection:
+    """pooled connection to the directory database with the users and provider_patients tables"""
+    return get_connection(DEFAULT_DB_PATH, read_only)
+
+
+def user_role(username: str) -> str | None:
+    """:return: role of a user, None if there is no such user"""
+    row = directory_connection(read_only=True).execute(
+        "SELECT role FROM users WHERE username = ?", (username,)).fetchone()
+    return row[0] if row else None
+
+
+def patients_of(provider: str) -> list[str]:
+    """:return: usernames of the patients a provider serves, in the order they were assigned"""
+    rows = directory_connection(read_only=True).execute(
+        "SELECT patient FROM provider_patients WHERE provider = ? ORDER BY assigned_at, patient", (provider,))
+    return [row[0] for row in rows]
+
+
+def assign_patient(provider: str, patient: str, db_conn: sqlite3.Connection | None = None):
+    """gives a provider access to a patient's shard, both have to be users of the directory"""
+    db_conn = db_conn or directory_connection()
+    roles = dict(db_conn.execute("SELECT username, role FROM users WHERE username IN (?, ?)", (provider, patient)))
+    if roles.get(provider) != 'provider':
+        raise ValueError(f"{provider} is not a provider")
+    if patient not in roles:
+        raise ValueError(f"{patient} is not a user")
+    with db_conn:
+        db_conn.execute("INSERT OR IGNORE INTO provider_patients (provider, patient) VALUES (?, ?)",
+                        (provider, patient))
+    ensure_shard(patient)
+
+
+def fan_out(usernames: Iterable[str], reader: Callable, *args, max_workers: int = FAN_OUT_WORKERS,
+            **kwargs) -> dict[str, Any]:
+    """
+    runs reader(db_conn, *args, **kwargs) on the shard of every user in a thread pool, through each
+    shard's query cache. SQLite releases the GIL while it reads, so the shards are read side by side
+    like query_cache.call, the arguments must be hashable and the reader must return a DataFrame or rows
+    users without a shard are skipped
+    :return: the reader's result by username, in the order the users were given
+    """
+    from .query_cache import get_query_cache
+    shards = [shard_for(username) for username in dict.fromkeys(usernames)]
+    missing = [shard.username for shard in shards if not shard.exists()]
+    if missing:
+        logger.warning(f"No database shard for {', '.join(missing)}, skipping")
+    shards = [shard for shard in shards if shard.exists()]
+    if not shards:
+        return {}
+
+    def read(shard: Shard):
+        with route_to(shard.username):
+            return get_query_cache(shard.db_path).call(reader, *args, **kwargs)
+
+    with ThreadPoolExecutor(min(max_workers, len(shards)), thread_name_prefix="shard-fan-out") as pool:
+        return dict(zip((shard.username for shard in shards), pool.map(read, shards)))
+
+
+def fan_out_frame(usernames: Iterable[str], reader: Callable, *args, max_workers: int = FAN_OUT_WORKERS,
+                  **kwargs) -> pd.DataFrame:
+    """
+    fan_out for readers that return DataFrames
+    :return: the frames of every user stacked, with the username in a leading 'user' column
+    """
+    frames = fan_out(usernames, reader, *args, max_workers=max_workers, **kwargs)
+    if not frames:
+        return pd.DataFrame(columns=['user'])
+    return pd.concat([frame.assign(user=username)[['user', *frame.columns]] for username, frame in frames.items()],
+                     ignore_index=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Copies the history of the single-user database into a user's shard")
+    parser.add_argument("--migrate-to", required=True, metavar="USER", help="user whose shard receives the history")
+    args = parser.parse_args()
+    role = user_role(args.migrate_to)
+    if role is None:
+        parser.error(f"{args.migrate_to} is not a user of the directory database")
+    if role == 'provider':
+        parser.error(f"{args.migrate_to} is a provider, providers read their patients' shards and hold no history")
+    migrate_directory_to_shard(args.migrate_to)
@@ -1,25 +1,40 @@
 import sqlite3
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Iterator
+import numpy as np
 import pandas as pd
 import logging
+from .connection_pool import get_connection
+from .shard_router import active_db_path
 
 logger = logging.getLogger(__name__)
 
-def create_db_conn(db_path: str = "data/daylio.db") -> sqlite3.Connection:
+def create_db_conn(db_path: str | None = None, read_only: bool = False) -> sqlite3.Connection:
     """
-    creates a new database connection to the SQLite database
+    returns the calling thread's pooled connection to the SQLite database
+    closing it is a no-op, the connection stays open for the thread's next caller
+    :param db_path: database file, None for the routed user's shard, see shard_router
+    :param read_only: a mode=ro connection, for pages and anything else that only reads
     :return:
     """
-    return sqlite3.connect(db_path)
+    return get_connection(db_path or active_db_path(), read_only)
 
-def execute_sql_command(conn: sqlite3.Connection, command: str, commit: bool = True, *args):
+def execute_sql_command(conn: sqlite3.Connection | None, command: str, commit: bool = True, *args):
+    """
+    :param conn: connection to run the command on, None uses the thread's pooled connection to the routed shard
+    :param commit: False runs a query and returns its rows
+    """
+    if conn is None:
+        conn = get_connection(active_db_path(), read_only=not commit)
     with conn:
         cursor = conn.cursor()
         if args:
-            if len(args) == 1:
-                cursor.execute(command, (args[0],))
+            # a single tuple or list holds all of the parameters, anything else is one parameter each
+            if len(args) == 1 and isinstance(args[0], (tuple, list)):
+                cursor.execute(command, args[0])
             else:
-                cursor.execute(command, *args)
+                cursor.execute(command, args)
         else:
             cursor.execute(command)
             
@@ -39,9 +54,56 @@ def execute_sql_script(conn: sqlite3.Connection, script_path: str):
         script_text = script.read_text()
         cursor.executescript(script_text)
     
-def read_sql_view_to_df(conn: sqlite3.Connection, view_name: str) -> pd.DataFrame:
+@contextmanager
+def triggers_suspended(db_conn: sqlite3.Connection, table_name: str, suffix: str) -> Iterator[list[str]]:
+    """
+    drops the triggers on a table whose names end in `suffix` for the block and creates them again after it
+    for rewrites of a whole table, whose derived data is cheaper to rebuild in one pass than to keep in sync
+    row by row. Must run inside the caller's `with db_conn:` block, a transaction is opened if none is yet, so
+    the triggers come back together with the rewrite or, on an error, are rolled back with it
+    :return: names of the suspended triggers, empty if the table has none
+    """
+    triggers = db_conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = ? AND name LIKE ?",
+        (table_name, f"%{suffix}")).fetchall()
+    if triggers and not db_conn.in_transaction:
+        db_conn.execute("BEGIN")
+    for name, _ in triggers:
+        db_conn.execute(f'DROP TRIGGER "{name}"')
+    yield [name for name, _ in triggers]
+    for _, sql in triggers:
+        db_conn.execute(sql)
+
+
+def _timestamps_to_text(values: np.ndarray) -> list:
+    # matches sqlite3's datetime adapter: microseconds are only written when they are non-zero
+    values = values.astype('datetime64[us]')
+    text = np.where(values.astype('datetime64[s]') == values,
+                    np.datetime_as_string(values, unit='s'),
+                    np.datetime_as_string(values, unit='us'))
+    text = np.char.replace(text, 'T', ' ').astype(object)
+    text[np.isnat(values)] = None
+    return text.tolist()
+
+def frame_to_rows(df: pd.DataFrame, columns: list[str]) -> list[tuple]:
+    """
+    converts DataFrame columns into sqlite-ready row tuples
+    timestamps become ISO text, the same way pandas' to_sql writes them, and missing values become NULL
+    :return:
+    """
+    values = []
+    for col in columns:
+        series = df[col]
+        if pd.api.types.is_datetime64_any_dtype(series):
+            values.append(_timestamps_to_text(series.to_numpy(dtype='datetime64[ns]')))
+        else:
+            values.append(series.astype(object).where(series.notna(), None).tolist())
+    return list(zip(*values))
+
+def read_sql_view_to_df(conn: sqlite3.Connection | None, view_name: str) -> pd.DataFrame:
+    """
+    :param conn: connection to read from, None uses the thread's pooled read-only connection to the routed shard
+    """
     logger.info(f"Retrieving data from view {view_name}...")
     query = f"SELECT * FROM {view_name}"
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-    return df
\ No newline at end of file
+    return pd.read_sql_query(query, conn or get_connection(active_db_path(), read_only=True))
\ No newline at end of file
@@ -0,0 +1,37 @@
+import sqlite3
+import pandas as pd
+from log_setup import Span
+
+METRIC_COLUMNS = ["job_id", "job", "stage", "parent", "started_at", "wall_seconds", "cpu_seconds", "peak_bytes", "rows"]
+
+
+def store_spans(db_conn: sqlite3.Connection, job_id: int | None, job: str, spans: list[Span]):
+    """writes the spans recorded during one ingest job to stage_metrics"""
+    with db_conn:
+        db_conn.executemany(
+            f"INSERT INTO stage_metrics ({', '.join(METRIC_COLUMNS)}) VALUES ({', '.join('?' * len(METRIC_COLUMNS))})",
+            [(job_id, job, s.stage, s.parent, s.started_at.strftime('%Y-%m-%d %H:%M:%S'), s.wall_seconds,
+              s.cpu_seconds, s.peak_bytes, s.rows) for s in spans])
+
+
+def read_stage_metrics(db_conn: sqlite3.Connection, job: str | None = None, last_runs: int | None = None) -> pd.DataFrame:
+    """
+    :param job: only the stages of this job
+    :param last_runs: only the stages of the most recent runs
+    :return: one row per stage per run, oldest run first, with run_started set to the start of the run's first stage
+    """
+    conditions, params = [], []
+    if job is not None:
+        conditions.append("job = ?")
+        params.append(job)
+    if last_runs is not None:
+        conditions.append(f"job_id IN (SELECT DISTINCT job_id FROM stage_metrics "
+                          f"{'WHERE job = ?' if job is not None else ''} ORDER BY job_id DESC LIMIT ?)")
+        params.extend([job, last_runs] if job is not None else [last_runs])
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return pd.read_sql_query(f'''
+        SELECT {', '.join(METRIC_COLUMNS)}, MIN(started_at) OVER (PARTITION BY job_id) AS run_started
+        FROM stage_metrics
+        {where}
+        ORDER BY job_id, started_at
+    ''', db_conn, params=params, parse_dates=['started_at', 'run_started'])